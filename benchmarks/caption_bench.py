@@ -0,0 +1,138 @@
+"""
+Caption backend benchmark: per-image latency, peak memory and caption agreement.
+
+Each backend runs in its own subprocess, one after another, so peak RSS is the
+backend's own footprint and backends never compete for CPU. Every image is
+captioned one at a time (after one warm-up call) with the caption cache off.
+Agreement compares each backend's captions with the first backend's: exact
+matches and mean token overlap (Jaccard).
+
+    python benchmarks/caption_bench.py
+    python benchmarks/caption_bench.py --backends blip,blip-int8 --repeat 3 --output captions.json
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+from run_benchmarks import peak_rss_mb, percentile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_IMAGES = os.path.join(ROOT, "demo_assets")
+
+
+def list_images(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(p for ext in ("png", "jpg", "jpeg", "webp") for p in glob.glob(os.path.join(path, f"*.{ext}")))
+
+
+def run_worker(backend_name, images, repeat):
+    """Runs inside the subprocess: loads one backend and times it on every image."""
+    sys.path.insert(0, os.path.join(ROOT, "orchestrator"))
+    from PIL import Image
+    from captioning import caption_images, get_backend
+
+    backend = get_backend(backend_name)
+    start = time.perf_counter()
+    backend.load()
+    load_seconds = time.perf_counter() - start
+    rss_after_load = peak_rss_mb()
+
+    decoded = [Image.open(path).convert("RGB") for path in images]
+    caption_images(decoded[:1], backend=backend, use_cache=False)
+
+    latencies, captions = [], {}
+    for path, image in zip(images, decoded):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            caption = caption_images([image], backend=backend, use_cache=False)[0]
+            latencies.append(time.perf_counter() - start)
+        captions[os.path.basename(path)] = caption
+
+    return {
+        "backend": backend_name,
+        "name": backend.name,
+        "load_s": load_seconds,
+        "latencies": latencies,
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": peak_rss_mb(),
+        "captions": captions,
+    }
+
+
+def tokens(caption):
+    return set(caption.lower().split())
+
+
+def agreement(reference, other):
+    names = [name for name in reference if name in other]
+    if not names:
+        return 0.0, 0.0
+    exact = sum(reference[n] == other[n] for n in names) / len(names)
+    overlaps = []
+    for n in names:
+        a, b = tokens(reference[n]), tokens(other[n])
+        overlaps.append(len(a & b) / len(a | b) if a | b else 1.0)
+    return exact, sum(overlaps) / len(overlaps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption backend latency / memory / agreement benchmark.")
+    parser.add_argument("--backends", default="blip,blip-int8",
+                        help="comma-separated CAPTION_BACKEND names; the first is the agreement reference")
+    parser.add_argument("--images", default=DEFAULT_IMAGES, help="an image or a directory of images")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per image")
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    images = list_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, images, args.repeat)))
+        return
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        print(f"Benchmarking {backend} on {len(images)} images...", flush=True)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend,
+             "--images", args.images, "--repeat", str(args.repeat)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(proc.stderr)
+            sys.exit(f"{backend} failed with exit code {proc.returncode}")
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    reference = results[0]
+    print("\n=== Caption backends ===")
+    for r in results:
+        lat = r["latencies"]
+        exact, overlap = agreement(reference["captions"], r["captions"])
+        r["agreement"] = {"reference": reference["backend"], "exact": exact, "token_jaccard": overlap}
+        print(f"{r['backend']:<10} load={r['load_s']:.1f}s  per image p50={percentile(lat, 50):.3f}s "
+              f"p95={percentile(lat, 95):.3f}s mean={sum(lat) / len(lat):.3f}s  "
+              f"RSS after load={r['rss_after_load_mb']:.0f} MB peak={r['peak_rss_mb']:.0f} MB  "
+              f"vs {reference['backend']}: exact={exact:.0%} overlap={overlap:.2f}")
+
+    if len(results) > 1:
+        print("\n=== Captions ===")
+        for name in reference["captions"]:
+            print(name)
+            for r in results:
+                print(f"  {r['backend']:<10} {r['captions'].get(name, '')}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
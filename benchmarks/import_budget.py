@@ -0,0 +1,111 @@
+"""
+Import-time budget for the orchestrator CLI.
+
+Runs each inspection command of `python -m orchestrator` in a fresh interpreter
+with -X importtime, against a throwaway state DB and asset store, and fails if
+a command imports any of HEAVY_MODULES or takes longer than the budget (wall
+time, including interpreter startup; best of --repeat runs). Also reports what
+`import run` costs and fails if that alone pulls in torch or transformers.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --budget-ms 300
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+COMMANDS = [
+    ["status", "--json"],
+    ["list", "--limit", "5"],
+    ["list", "--jobs"],
+    ["gc", "--dry-run"],
+    ["profile"],
+]
+
+# Nothing that only inspects state should need these
+HEAVY_MODULES = {
+    "torch", "transformers", "PIL", "numpy", "requests",
+    "run", "captioning", "mockup_renderer", "shopify_client", "pipeline",
+}
+# Importing the pipeline itself may load PIL and numpy, but never the model stack
+MODEL_MODULES = {"torch", "transformers"}
+
+
+def imported_modules(stderr):
+    """Module names and the total microseconds from -X importtime output."""
+    modules, total = set(), 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            # Top-level imports only; nested ones are included in their parent
+            total += int(cumulative)
+        modules.add(name.strip())
+    return modules, total
+
+
+def timed_run(cmd, env, repeat):
+    best, stderr = None, ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(cmd)} exited with {proc.returncode}:\n{proc.stdout}{proc.stderr}")
+        if best is None or elapsed < best:
+            best, stderr = elapsed, proc.stderr
+    return best, stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the orchestrator CLI's import-time budget.")
+    parser.add_argument("--budget-ms", type=float, default=500, help="maximum wall time per command")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            STATE_DB=os.path.join(workdir, "state.db"),
+            ASSET_STORE_DIR=os.path.join(workdir, "assets"),
+            PROFILE_DIR=os.path.join(workdir, "profiles"),
+        )
+        for command in COMMANDS:
+            label = " ".join(command)
+            elapsed, stderr = timed_run([sys.executable, "-X", "importtime", "-m", "orchestrator", *command],
+                                        env, args.repeat)
+            modules, import_us = imported_modules(stderr)
+            heavy = sorted(HEAVY_MODULES & modules)
+            print(f"{label:<20} {elapsed * 1000:7.1f} ms wall, {import_us / 1000:6.1f} ms imports, "
+                  f"{len(modules)} modules{'  heavy: ' + ', '.join(heavy) if heavy else ''}")
+            if heavy:
+                failures.append(f"{label} imports {', '.join(heavy)}")
+            if elapsed * 1000 > args.budget_ms:
+                failures.append(f"{label} took {elapsed * 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+        code = "import sys; sys.path.insert(0, 'orchestrator'); import run"
+        elapsed, stderr = timed_run([sys.executable, "-X", "importtime", "-c", code], env, args.repeat)
+        modules, import_us = imported_modules(stderr)
+        model = sorted(MODEL_MODULES & modules)
+        print(f"{'import run':<20} {elapsed * 1000:7.1f} ms wall, {import_us / 1000:6.1f} ms imports, "
+              f"{len(modules)} modules (reference)")
+        if model:
+            failures.append(f"import run loads {', '.join(model)} before any caption is requested")
+
+    if failures:
+        print("\nImport budget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nAll commands within budget.")
+
+
+if __name__ == "__main__":
+    main()
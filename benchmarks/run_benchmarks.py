@@ -0,0 +1,289 @@
+"""
+Offline end-to-end benchmark for the orchestrator pipeline.
+
+Starts local stand-ins for Gemini, Cloudflare, the fake publisher and the
+Shopify Admin API (see stubs.py), runs the real generator service against
+them, then drives orchestrator/run.py through a single-product and a batch
+scenario. Reports throughput, p50/p95 per stage and peak RSS, and compares
+against the stored baseline, which must have been recorded with the same
+options (benchmarks/baseline.json uses BASELINE_FLAGS).
+
+    python benchmarks/run_benchmarks.py --batch-size 6 --stub-caption 0.05 --image-size 256
+    python benchmarks/run_benchmarks.py --batch-size 20 --concurrency 4 --no-compare
+    python benchmarks/run_benchmarks.py --save-baseline
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from stubs import FakeCloudflare, FakeGemini, FakePublisher, FakeShopify
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Options the committed baseline was recorded with: offline and quick, no BLIP model needed
+BASELINE_FLAGS = "--batch-size 6 --stub-caption 0.05 --image-size 256"
+# Options that don't change what is measured
+UNCOMPARED_OPTIONS = ("baseline", "save_baseline", "no_compare", "tolerance", "output")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def start_generator(stubs, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        GOOGLE_API_KEY="benchmark",
+        GEMINI_BASE_URL=stubs["gemini"].url,
+        CLOUDFLARE_API_TOKEN="benchmark",
+        CLOUDFLARE_ACCOUNT_ID="benchmark",
+        CLOUDFLARE_API_BASE=stubs["cloudflare"].url,
+        ASSET_STORE_DIR=os.path.join(workdir, "assets"),
+        # Measure the real generation path, not cache hits from earlier runs
+        GENERATOR_CACHE_MODE="off",
+    )
+    log = open(os.path.join(workdir, "generator.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.join(ROOT, "generator"), env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(url + "/", timeout=1).status_code == 200:
+                return proc, url
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"Generator did not start; see {workdir}/generator.log")
+
+
+def stage_stats(db, run_id):
+    durations = {}
+    for row in db.get_stage_timings(run_id):
+        durations.setdefault(row["stage"], []).append(row["duration"])
+    return {
+        stage: {"p50": percentile(values, 50), "p95": percentile(values, 95), "count": len(values)}
+        for stage, values in durations.items()
+    }
+
+
+def run_scenarios(args, run, db):
+    results = {}
+
+    if "single" in args.scenarios:
+        started = time.perf_counter()
+        run_id = run.main()
+        elapsed = time.perf_counter() - started
+        ok = all(row["status"] == "ok" for row in db.get_stage_timings(run_id))
+        results["single"] = {
+            "elapsed": elapsed,
+            "ok": int(ok),
+            "failed": int(not ok),
+            "throughput": (60.0 / elapsed) if ok else 0.0,
+            "stages": stage_stats(db, run_id),
+        }
+
+    if "batch" in args.scenarios:
+        result = run.run_batch(args.batch_size, args.concurrency)
+        results["batch"] = {
+            "elapsed": result.elapsed,
+            "ok": result.count("ok"),
+            "failed": result.count("failed"),
+            "throughput": result.throughput,
+            "stages": stage_stats(db, result.run_id),
+        }
+
+    return results
+
+
+def print_report(results, peak_rss):
+    print("\n=== Benchmark results ===")
+    for name, scenario in results.items():
+        print(f"{name}: {scenario['ok']} ok, {scenario['failed']} failed in {scenario['elapsed']:.2f}s "
+              f"-> {scenario['throughput']:.2f} products/min")
+        for stage, stats in scenario["stages"].items():
+            print(f"  {stage:<12} n={stats['count']:<4} p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s")
+    print(f"peak RSS: {peak_rss:.0f} MB")
+
+
+def compare_to_baseline(results, peak_rss, baseline, tolerance):
+    """Returns a list of regression messages: lower throughput or higher stage p95 beyond tolerance."""
+    regressions = []
+    for name, scenario in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if base["throughput"] and scenario["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {scenario['throughput']:.2f}/min vs baseline {base['throughput']:.2f}/min")
+        for stage, stats in scenario["stages"].items():
+            base_stage = base["stages"].get(stage)
+            if base_stage and stats["p95"] > base_stage["p95"] * (1 + tolerance) + 0.01:
+                regressions.append(f"{name}/{stage}: p95 {stats['p95']:.3f}s vs baseline {base_stage['p95']:.3f}s")
+    if baseline.get("peak_rss_mb") and peak_rss > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {peak_rss:.0f} MB vs baseline {baseline['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def config_flags(config, keys):
+    """Command-line flags that reproduce `keys` of a recorded config."""
+    flags = []
+    for key in keys:
+        value = config.get(key)
+        if isinstance(value, list):
+            value = ",".join(value)
+        if value is not None:
+            flags.append(f"--{key.replace('_', '-')} {value}")
+    return " ".join(flags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark.")
+    parser.add_argument("--scenarios", default="single,batch", help="comma-separated: single, batch")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--gemini-latency", type=float, default=1.5, help="seconds per Gemini call")
+    parser.add_argument("--cloudflare-latency", type=float, default=3.0, help="seconds per image generation")
+    parser.add_argument("--shopify-latency", type=float, default=0.2)
+    parser.add_argument("--publisher-latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.1, help="fraction of latency added or removed at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability each stub call returns HTTP 500")
+    parser.add_argument("--image-size", type=int, default=1024, help="side of the generated PNGs in pixels")
+    parser.add_argument("--shopify-bucket", type=int, default=40)
+    parser.add_argument("--stub-caption", type=float, default=None, metavar="SECONDS",
+                        help="replace BLIP with a fixed-latency stand-in (for boxes without the model)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated product mix")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--no-compare", action="store_true", help="only report; skip the baseline comparison")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression before failing")
+    parser.add_argument("--output", help="write the results JSON here")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    def stub_args(latency):
+        return {"latency": latency, "jitter": latency * args.jitter, "error_rate": args.error_rate}
+
+    stubs = {
+        "gemini": FakeGemini(seed=args.seed, **stub_args(args.gemini_latency)),
+        "cloudflare": FakeCloudflare(image_size=args.image_size, **stub_args(args.cloudflare_latency)),
+        "publisher": FakePublisher(**stub_args(args.publisher_latency)),
+        "shopify": FakeShopify(bucket_size=args.shopify_bucket, **stub_args(args.shopify_latency)),
+    }
+    for stub in stubs.values():
+        stub.start()
+
+    workdir = tempfile.mkdtemp(prefix="merch-bench-")
+    print(f"Benchmark working directory: {workdir}")
+    generator = None
+    try:
+        generator, generator_url = start_generator(stubs, workdir)
+
+        # Everything the orchestrator reads at import time must be set first
+        os.environ.update({
+            "GENERATOR_URL": f"{generator_url}/generate",
+            "GENERATOR_BATCH_URL": f"{generator_url}/generate/batch",
+            "GENERATOR_IMAGE_URL": f"{generator_url}/generate/image",
+            "PUBLISHER_URL": f"{stubs['publisher'].url}/api.php",
+            "SHOPIFY_API_BASE": stubs["shopify"].url,
+            "SHOPIFY_ACCESS_TOKEN": "benchmark",
+            "ASSET_STORE_DIR": os.path.join(workdir, "assets"),
+            "CAPTION_CACHE_PATH": os.path.join(workdir, "caption_cache.db"),
+            "THUMBNAIL_DIR": os.path.join(workdir, "thumbnails"),
+            "PROFILE_DIR": os.path.join(workdir, "profiles"),
+            "MOCKUP_MODE": "local",
+        })
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.join(ROOT, "orchestrator"))
+        import run
+
+        if args.stub_caption is not None:
+            def stub_caption_images(sources):
+                time.sleep(args.stub_caption)
+                return ["a product with a printed design"] * len(sources)
+            run.caption_images = stub_caption_images
+
+        results = run_scenarios(args, run, run.get_db())
+    finally:
+        if generator:
+            generator.terminate()
+            generator.wait(timeout=10)
+        for stub in stubs.values():
+            stub.stop()
+
+    peak_rss = peak_rss_mb()
+    print_report(results, peak_rss)
+    print("stub calls: " + ", ".join(f"{name}={stub.requests} ({stub.errors} errors)" for name, stub in stubs.items())
+          + f"; shopify throttled {stubs['shopify'].throttled}, "
+          + f"{stubs['shopify'].bytes_received / 1024 / 1024:.1f} MB uploaded")
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in UNCOMPARED_OPTIONS},
+        "scenarios": results,
+        "peak_rss_mb": peak_rss,
+        "shopify_upload_mb": stubs["shopify"].bytes_received / 1024 / 1024,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if args.no_compare:
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}. Record one with --save-baseline, or pass --no-compare.")
+        return 2
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    differing = sorted(key for key in set(baseline.get("config", {})) | set(report["config"])
+                       if baseline.get("config", {}).get(key) != report["config"].get(key))
+    if differing:
+        print(f"The baseline was recorded with other options; rerun with "
+              f"{config_flags(baseline.get('config', {}), differing)} or pass --no-compare.")
+        return 2
+    regressions = compare_to_baseline(results, peak_rss, baseline, args.tolerance)
+    if regressions:
+        print("Regressions against baseline:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Local stand-ins for the external APIs the pipeline talks to, for offline
+benchmarking. Every stub takes a latency (mean and jitter, in seconds) and an
+error rate; requests that draw an error get an HTTP 500.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, quote
+
+ADJECTIVES = ["Galactic", "Sleepy", "Retro", "Cosmic", "Neon", "Vintage", "Mystic", "Happy", "Lunar", "Wild"]
+SUBJECTS = ["Cat", "Dragon", "Fox", "Robot", "Owl", "Panda", "Whale", "Tiger", "Octopus", "Astronaut"]
+PRODUCT_TYPES = ["t-shirt", "cup", "cap"]
+
+
+class StubServer:
+    """Runs a handler class on a background ThreadingHTTPServer bound to 127.0.0.1."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.dispatch(self, "GET")
+
+            def do_POST(self):
+                stub.dispatch(self, "POST")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def dispatch(self, handler, method):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return self.send(handler, 500, {"error": {"message": "stub injected error"}})
+        self.handle(handler, method, body)
+
+    def handle(self, handler, method, body):
+        raise NotImplementedError
+
+    def send(self, handler, status, payload, content_type="application/json", headers=None):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeGemini(StubServer):
+    """
+    generateContent endpoint answering in the generator's "Product Title:/Tags:/Price:"
+    format. With `seed` the sequence of listings (and so the product type mix)
+    is the same on every run.
+    """
+
+    counter = itertools.count(1)
+
+    def __init__(self, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.rng = random.Random(seed)
+
+    def listing(self):
+        n = next(self.counter)
+        subject = self.rng.choice(SUBJECTS)
+        product_type = self.rng.choice(PRODUCT_TYPES)
+        noun = {"t-shirt": "T-shirt", "cup": "Cup", "cap": "Cap"}[product_type]
+        return (
+            f"Product Title: {self.rng.choice(ADJECTIVES)} {subject} {n} {noun}\n"
+            f"Product Description: A benchmark {subject.lower()} design printed on a comfortable, durable {product_type}.\n"
+            f"Tags: {product_type}, {subject.lower()}, benchmark\n"
+            f"Price: {self.rng.randint(10, 49)}.9\n"
+            f"Product Type: {product_type}\n"
+            f"Image Prompt: A vivid illustration of a {subject.lower()} for a {product_type}"
+        )
+
+    def handle(self, handler, method, body):
+        try:
+            prompt = json.loads(body)["contents"][0]["parts"][0]["text"]
+        except (ValueError, KeyError, IndexError):
+            prompt = ""
+        match = re.search(r"generating (\d+) different product listings", prompt)
+        count = int(match.group(1)) if match else 1
+        text = "\n---\n".join(self.listing() for _ in range(count))
+        self.send(handler, 200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]
+        })
+
+
+class FakeCloudflare(StubServer):
+    """
+    Workers AI text-to-image endpoint returning PNG bytes of roughly `image_size`
+    pixels per side. Every image is a random coarse pattern, so each design is
+    perceptually distinct, under fine noise that keeps PNG sizes close to real generations.
+    """
+
+    def __init__(self, image_size=1024, **kwargs):
+        super().__init__(**kwargs)
+        self.image_size = image_size
+        self.noise = None
+
+    def start(self):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        self.noise = [rng.integers(0, 64, (self.image_size, self.image_size, 3), dtype=np.uint8) for _ in range(4)]
+        return super().start()
+
+    def render(self):
+        from PIL import Image
+        import numpy as np
+
+        blocks = np.random.default_rng().integers(0, 192, (16, 16, 3), dtype=np.uint8)
+        scale = -(-self.image_size // 16)
+        pattern = blocks.repeat(scale, axis=0).repeat(scale, axis=1)[:self.image_size, :self.image_size]
+        buf = BytesIO()
+        Image.fromarray(pattern + random.choice(self.noise)).save(buf, format="PNG", compress_level=1)
+        return buf.getvalue()
+
+    def handle(self, handler, method, body):
+        self.send(handler, 200, self.render(), content_type="image/png")
+
+
+class FakePublisher(StubServer):
+    """Stand-in for publisher/api.php."""
+
+    def handle(self, handler, method, body):
+        if method == "GET":
+            return self.send(handler, 200, {"status": "ok"})
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            results = [{"status": "success", "fake_product_id": f"FP-{random.randint(1000, 9999)}"} for _ in data]
+            return self.send(handler, 200, {"status": "success", "results": results})
+        self.send(handler, 200, {"status": "success", "fake_product_id": f"FP-{random.randint(1000, 9999)}"})
+
+
+class FakeShopify(StubServer):
+    """
+    Admin API products/images endpoints that enforce a leaky call-limit bucket:
+    `bucket_size` calls, draining `leak_rate` per second. Requests over the
+    limit get a 429 with Retry-After, like the real store. GET /products.json
+    pages through the created products with page_info cursors in a Link header.
+    """
+
+    def __init__(self, bucket_size=40, leak_rate=2.0, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket_size = bucket_size
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.ids = itertools.count(1000)
+        self.throttled = 0
+        self.products = []
+
+    def take_token(self):
+        with self.lock:
+            now = time.monotonic()
+            self.level = max(0.0, self.level - (now - self.updated) * self.leak_rate)
+            self.updated = now
+            if self.level + 1 > self.bucket_size:
+                self.throttled += 1
+                return None
+            self.level += 1
+            return int(self.level)
+
+    def handle(self, handler, method, body):
+        used = self.take_token()
+        if used is None:
+            return self.send(handler, 429, {"errors": "Exceeded 2 calls per second for api client."},
+                             headers={"Retry-After": "1.0"})
+        headers = {"X-Shopify-Shop-Api-Call-Limit": f"{used}/{self.bucket_size}"}
+        if handler.path.endswith("/images.json"):
+            return self.send(handler, 200, {"image": {"id": next(self.ids)}}, headers=headers)
+        path, _, query = handler.path.partition("?")
+        if path.endswith("/products.json") and method == "GET":
+            return self.list_products(handler, parse_qs(query), headers)
+        if path.endswith("/products.json"):
+            data = json.loads(body)["product"]
+            variants = [dict(variant, id=next(self.ids)) for variant in data["variants"]]
+            product = {"id": next(self.ids), "title": data.get("title"), "status": "active",
+                       "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())}
+            with self.lock:
+                self.products.append(product)
+            return self.send(handler, 201, {"product": dict(product, variants=variants)}, headers=headers)
+        self.send(handler, 404, {"errors": "Not Found"}, headers=headers)
+
+    def list_products(self, handler, params, headers):
+        limit = int(params.get("limit", ["50"])[0])
+        if "page_info" in params:
+            updated_at_min, offset = json.loads(params["page_info"][0])
+        else:
+            updated_at_min, offset = params.get("updated_at_min", [""])[0], 0
+        with self.lock:
+            matching = [p for p in self.products if p["updated_at"] >= updated_at_min]
+        page = matching[offset:offset + limit]
+        if offset + limit < len(matching):
+            cursor = quote(json.dumps([updated_at_min, offset + limit]))
+            headers = dict(headers, Link=f'<{self.url}/products.json?limit={limit}&page_info={cursor}>; rel="next"')
+        self.send(handler, 200, {"products": page}, headers=headers)
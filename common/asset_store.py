@@ -0,0 +1,101 @@
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO
+
+ASSET_ROOT = os.getenv(
+    "ASSET_STORE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "assets")),
+)
+
+
+class AssetStore:
+    """
+    Content-addressed file store shared by the generator, mockup renderer and
+    orchestrator. Files are named by the SHA-256 of their bytes and sharded two
+    levels deep (ab/cd/abcd....png), so identical images are stored once and
+    concurrent writers can never overwrite each other's output.
+    """
+
+    def __init__(self, root=ASSET_ROOT):
+        self.root = os.path.abspath(root)
+
+    def path_for(self, digest, ext=".png"):
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def put_bytes(self, data, ext=".png"):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, ext)
+        if os.path.exists(path):
+            # Already stored; refresh mtime so gc treats it as recently used
+            os.utime(path)
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def put_image(self, image, fmt="PNG", **save_args):
+        buf = BytesIO()
+        image.save(buf, format=fmt, **save_args)
+        ext = ".jpg" if fmt.upper() == "JPEG" else f".{fmt.lower()}"
+        return self.put_bytes(buf.getvalue(), ext)
+
+    def contains(self, path):
+        return bool(path) and os.path.abspath(path).startswith(self.root + os.sep)
+
+    def digest_of(self, path):
+        """Returns the content hash for a path inside the store, or None."""
+        if not self.contains(path):
+            return None
+        return os.path.basename(path).split(".", 1)[0]
+
+    def relative_path(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def iter_assets(self):
+        """Yields (digest, path, size, mtime) for every stored file."""
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield filename.split(".", 1)[0], path, st.st_size, st.st_mtime
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        # Drop now-empty shard directories
+        for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+
+    def remove_stale_temp_files(self, max_age=3600):
+        cutoff = time.time() - max_age
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if filename.endswith(".tmp") and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
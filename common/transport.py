@@ -0,0 +1,270 @@
+"""
+Shared HTTP transport for every service client in the project.
+
+- One keep-alive requests.Session per (scheme, host), so repeated calls to the
+  same service reuse connections.
+- Every call has a (connect, read) timeout; clients set a default and callers
+  can override it per endpoint.
+- Failed calls are retried with full-jitter backoff, but every retry draws from
+  one process-wide RetryBudget, so an outage does not multiply traffic.
+- Each downstream service has a CircuitBreaker; while it is open calls fail
+  immediately instead of waiting for timeouts.
+- ServiceClient.arequest runs calls on a shared thread pool for asyncio callers.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = (3.05, 30)
+DEFAULT_RETRIES = 2
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# Retries may add at most this fraction of extra requests, plus a small floor per second
+RETRY_BUDGET_RATIO = float(os.getenv("HTTP_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("HTTP_RETRY_BUDGET_MIN_PER_SEC", "1"))
+
+BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without calling the service while its circuit breaker is open."""
+
+
+class RetryBudget:
+    """
+    Every request deposits `ratio` tokens and every retry withdraws one, so
+    retries stay a bounded fraction of traffic. `min_per_sec` tokens are also
+    added each second so low-traffic clients can still retry.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_sec=RETRY_BUDGET_MIN_PER_SEC, max_tokens=None):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens if max_tokens is not None else max(10.0, min_per_sec * 10)
+        self.tokens = self.max_tokens
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_sec)
+        self.updated = now
+
+    def deposit(self):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures. While open, calls are refused
+    until `reset_seconds` have passed; then one trial call is let through
+    (half-open), and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def end_trial(self):
+        # Lets another caller probe if a trial ended without recording an outcome
+        with self.lock:
+            self.trial_running = False
+
+
+RETRY_BUDGET = RetryBudget()
+
+_sessions = {}
+_breakers = {}
+_clients = {}
+_client_settings = {}
+_registry_lock = threading.RLock()
+_executor = None
+
+
+def session_for(url, pool_size=POOL_SIZE):
+    """The shared keep-alive session for the host `url` points at."""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _registry_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount(f"{parts.scheme}://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def breaker_for(name):
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def backoff_delay(attempt):
+    # Full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class ServiceClient:
+    """
+    Client for one downstream service. Responses are returned as-is (callers
+    still call raise_for_status); connection errors and timeouts propagate as
+    the usual requests exceptions once retries are exhausted.
+
+    POSTs are only retried on connection failures unless `retry_unsafe` is set,
+    since a POST that timed out reading or got a 5xx may already have done (and
+    billed for) the work.
+    """
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, retry_unsafe=False,
+                 budget=RETRY_BUDGET, circuit_breaker=True):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_unsafe = retry_unsafe
+        self.budget = budget
+        self.breaker = breaker_for(name) if circuit_breaker else None
+
+    def _record(self, ok):
+        if self.breaker is None:
+            return
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        method = method.upper()
+        timeout = timeout or self.timeout
+        retries = self.retries if retries is None else retries
+        can_retry_any = self.retry_unsafe or method in IDEMPOTENT_METHODS
+        session = session_for(url)
+
+        attempt = 0
+        while True:
+            if self.breaker and not self.breaker.allow():
+                raise CircuitOpenError(f"{self.name}: circuit open after repeated failures")
+            self.budget.deposit()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectionError:
+                # Includes connect timeouts: the request never reached the service
+                self._record(False)
+                if not (attempt < retries and self.budget.withdraw()):
+                    raise
+            except requests.exceptions.Timeout:
+                self._record(False)
+                if not (can_retry_any and attempt < retries and self.budget.withdraw()):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._record(True)
+                    return response
+                self._record(False)
+                if not (can_retry_any and attempt < retries and self.budget.withdraw()):
+                    return response
+                response.close()
+            finally:
+                # Anything else raised (bad URL, encoding errors, ...) must not
+                # leave a half-open breaker waiting forever for its trial
+                if self.breaker:
+                    self.breaker.end_trial()
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    async def arequest(self, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(self.request, method, url, **kwargs))
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest("GET", url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest("POST", url, **kwargs)
+
+
+def get_executor():
+    global _executor
+    with _registry_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="transport")
+        return _executor
+
+
+def get_client(name, **kwargs):
+    """
+    Returns the shared ServiceClient for `name`, creating it with `kwargs` on
+    first use. Later calls may omit `kwargs` but must not pass different ones.
+    """
+    with _registry_lock:
+        if name not in _clients:
+            _clients[name] = ServiceClient(name, **kwargs)
+            _client_settings[name] = kwargs
+        elif kwargs and kwargs != _client_settings[name]:
+            raise ValueError(f"client {name!r} already exists with settings {_client_settings[name]}, got {kwargs}")
+        return _clients[name]
@@ -1,7 +1,7 @@
 import os
-import time
+import sys
+import threading
 import base64
-import requests
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -9,70 +9,102 @@ from google.genai.errors import ClientError
 from io import BytesIO
 from PIL import Image
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+from common.transport import get_client
+from cache import cached_generate
+
 load_dotenv()
 CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
 CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
+# Overridable so the generator can run against local stand-ins (see benchmarks/)
+CLOUDFLARE_API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+CLOUDFLARE_IMAGE_MODEL = "@cf/stabilityai/stable-diffusion-xl-base-1.0"
+NEGATIVE_PROMPT = "blurry, ugly, bad quality, low-res"
+
+# A failed generation is not billed, so 5xx and read timeouts are retried too
+cloudflare_client = get_client("cloudflare", timeout=(5, 120), retry_unsafe=True)
+
+_gemini_client = None
+_gemini_lock = threading.Lock()
+
+def get_gemini_client(api_key: str):
+    # One client (and its HTTP connection pool) shared by every request
+    global _gemini_client
+    with _gemini_lock:
+        if _gemini_client is None:
+            http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+            _gemini_client = genai.Client(api_key=api_key, http_options=http_options)
+    return _gemini_client
 
 def generate_text_from_gemini(text_prompt: str) -> str:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        # Fallback mock response for demo if no key
-        return (
-            "Product Title: Galactic Cat Tee\n"
-            "Product Description: A cosmic-themed t-shirt featuring a cute astronaut cat floating in space. Perfect for cat lovers and stargazers!\n"
-            "Tags: cat, space, t-shirt, astronomy\n"
-            "Price: 25.0\n"
-            "Image Prompt: A photorealistic astronaut cat floating in a vibrant space background, perfect for printing on a t-shirt."
-        )
-    try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-preview-05-20",
-            contents=[types.Part(text=text_prompt)]
-        )
-        return response.candidates[0].content.parts[0].text
-    except ClientError as e:
-        return f"API Error: {e}"
+    # Errors and the no-key demo listing are returned but never cached
+    fallback = []
+
+    def generate():
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            # Fallback mock response for demo if no key
+            fallback.append(
+                "Product Title: Galactic Cat Tee\n"
+                "Product Description: A cosmic-themed t-shirt featuring a cute astronaut cat floating in space. Perfect for cat lovers and stargazers!\n"
+                "Tags: cat, space, t-shirt, astronomy\n"
+                "Price: 25.0\n"
+                "Image Prompt: A photorealistic astronaut cat floating in a vibrant space background, perfect for printing on a t-shirt."
+            )
+            return None
+        try:
+            client = get_gemini_client(api_key)
+            response = client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[types.Part(text=text_prompt)]
+            )
+            return response.candidates[0].content.parts[0].text.encode("utf-8")
+        except ClientError as e:
+            fallback.append(f"API Error: {e}")
+            return None
+
+    data, _ = cached_generate("text", GEMINI_MODEL, text_prompt, None, generate)
+    return data.decode("utf-8") if data is not None else fallback[0]
 
 def generate_image_from_cloudflare(prompt: str) -> str:
     """
     Generates an image using a free Stable Diffusion model on Cloudflare Workers AI.
     """
-    if not CLOUDFLARE_API_TOKEN or not CLOUDFLARE_ACCOUNT_ID:
-        print("Error: Cloudflare API credentials missing in .env. Using fallback.")
+    params = {"negative_prompt": NEGATIVE_PROMPT}
+
+    def generate():
+        if not CLOUDFLARE_API_TOKEN or not CLOUDFLARE_ACCOUNT_ID:
+            print("Error: Cloudflare API credentials missing in .env. Using fallback.")
+            return None
+
+        try:
+            # The API endpoint for the Stable Diffusion model
+            api_url = f"{CLOUDFLARE_API_BASE}/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/{CLOUDFLARE_IMAGE_MODEL}"
+
+            headers = {
+                "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
+                "Content-Type": "application/json"
+            }
+
+            data = {"prompt": prompt, **params}
+
+            response = cloudflare_client.post(api_url, headers=headers, json=data)
+            response.raise_for_status()
+            return response.content
+
+        except Exception as e:
+            print(f"Error generating image with Cloudflare AI: {e}")
+            return None
+
+    img_bytes, from_cache = cached_generate("image", CLOUDFLARE_IMAGE_MODEL, prompt, params, generate)
+    if img_bytes is None:
         return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "demo_assets", "sample_image.png"))
 
-    try:
-        # The API endpoint for the Stable Diffusion model
-        api_url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
-        
-        headers = {
-            "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-
-        data = {
-            "prompt": prompt,
-            "negative_prompt": "blurry, ugly, bad quality, low-res"
-        }
-
-        response = requests.post(api_url, headers=headers, json=data)
-        response.raise_for_status()
-
-        img_bytes = response.content
-        
-        output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "demo_assets"))
-
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save the generated image locally
-        image_path = os.path.join(output_dir, f"generated_image_{int(time.time())}.png")
-        with open(image_path, "wb") as f:
-            f.write(img_bytes)
-            
-        print(f"Generated image saved to: {image_path}")
-        return image_path
-    
-    except Exception as e:
-        print(f"Error generating image with Cloudflare AI: {e}")
-        return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "demo_assets", "sample_image.png"))
\ No newline at end of file
+    # Save the generated image in the content-addressed asset store
+    image_path = AssetStore().put_bytes(img_bytes, ".png")
+
+    print(f"{'Cached' if from_cache else 'Generated'} image saved to: {image_path}")
+    return image_path
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# off: always call the APIs. images: cache generated images (the default; image
+# prompts are unique per listing, so repeats are retries). on: cache listing text
+# too, so reruns of the fixed prompts return the same products (for development).
+# replay: serve only from the cache and fail on a miss, never calling the APIs.
+CACHE_MODE = os.getenv("GENERATOR_CACHE_MODE", "images").lower()
+CACHE_DIR = os.getenv("GENERATOR_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+CACHE_MAX_BYTES = int(float(os.getenv("GENERATOR_CACHE_MAX_MB", "500")) * 1024 * 1024)
+CACHE_MAX_AGE = float(os.getenv("GENERATOR_CACHE_MAX_AGE_DAYS", "30")) * 86400
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def cache_key(model, prompt, params=None):
+    """SHA-256 over the model, the full prompt and every generation parameter."""
+    payload = json.dumps({"model": model, "prompt": prompt, "params": params or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    On-disk cache of generated text and image bytes. Each entry is a file under
+    objects/, written to a temp file and renamed into place, and indexed in an
+    SQLite table that tracks size, creation and last use. Entries older than
+    `max_age` seconds are ignored and removed; once the total size passes
+    `max_bytes` the least recently used entries are evicted. Several generator
+    processes can share one cache directory.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=5, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            kind TEXT,
+            size INTEGER,
+            created_at REAL,
+            last_used REAL
+        )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used)")
+        self.conn.commit()
+
+    def path_for(self, key):
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.max_age:
+                self._delete([key])
+                return None
+            try:
+                with open(self.path_for(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self._delete([key])
+                return None
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return data
+
+    def put(self, key, kind, data):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, len(data), now, now),
+            )
+            self.conn.commit()
+            self._evict(now)
+
+    def _evict(self, now):
+        expired = [row[0] for row in self.conn.execute(
+            "SELECT key FROM entries WHERE created_at < ?", (now - self.max_age,)
+        ).fetchall()]
+        self._delete(expired)
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evict.append(key)
+            total -= size
+        self._delete(evict)
+
+    def _delete(self, keys):
+        if not keys:
+            return
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+        self.conn.commit()
+        for key in keys:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache()
+    return _cache
+
+
+def caching(kind):
+    """Whether results of `kind` ("text" or "image") are read from and written to the cache."""
+    if CACHE_MODE in ("on", "replay"):
+        return True
+    return CACHE_MODE == "images" and kind == "image"
+
+
+def cached_generate(kind, model, prompt, params, generate):
+    """
+    Returns (data, from_cache). `generate()` must return the bytes to cache, or
+    None when the result should not be cached (errors, fallbacks).
+    """
+    if not caching(kind):
+        return generate(), False
+    cache = get_cache()
+    key = cache_key(model, prompt, params)
+    data = cache.get(key)
+    if data is not None:
+        return data, True
+    if CACHE_MODE == "replay":
+        raise CacheMiss(f"No cached {kind} for this prompt (GENERATOR_CACHE_MODE=replay)")
+    data = generate()
+    if data is not None:
+        cache.put(key, kind, data)
+    return data, False
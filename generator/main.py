@@ -1,45 +1,74 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import os
 
 from ai_client import generate_text_from_gemini, generate_image_from_cloudflare
+from cache import CacheMiss
 
 app = FastAPI()
 
+@app.exception_handler(CacheMiss)
+def cache_miss_handler(request: Request, exc: CacheMiss):
+    return JSONResponse(status_code=404, content={"error": {"message": str(exc)}})
+
 class ProductOutput(BaseModel):
     title: str
     description: str
     tags: list[str]
     price: float
     product_type: str
+    image_path: str = ""
+    image_prompt: str = ""
+
+class ImageRequest(BaseModel):
+    image_prompt: str
+
+class ImageOutput(BaseModel):
     image_path: str
 
 @app.get("/")
 def root():
     return {"message": "AI Merch Maker Generator API"}
 
-@app.post("/generate", response_model=ProductOutput)
-def generate_product():
-    llm_prompt = """
-    You are generating a product listing for a merchandise item to be sold on a Shopify store.
-
-    Please provide ONLY the following fields, each on its own line, in this exact format:
-
+LISTING_FORMAT = """
     Product Title: <a short, catchy product title, 3-5 words, and always end with the product type, e.g., 'Cute Cat T-shirt'>
     Product Description: <a 50-70 word description focused on the product’s features, style, and appeal — do NOT mention AI or how it was made>
     Tags: <a comma-separated list of relevant search tags, e.g. 't-shirt, cat, space'>
     Price: <a realistic retail price in dollars, between 10 and 50, with 1 decimal place>
     Product Type: <must be one of these three only — t-shirt, cup, or cap. Choose a random one each time.>
     Image Prompt: <a detailed and vivid description of the image/design to be printed on the product - like the graphic on a T-shirt or mug>
+"""
+
+LLM_PROMPT = f"""
+    You are generating a product listing for a merchandise item to be sold on a Shopify store.
 
+    Please provide ONLY the following fields, each on its own line, in this exact format:
+{LISTING_FORMAT}
     The product must be a tangible item a t-shirt, cup, or cap, and the image prompt should describe how the product looks visually.
 
     Do NOT include any other text, explanation, or formatting.
     """
 
-    raw_text = generate_text_from_gemini(llm_prompt)
+BATCH_LLM_PROMPT = """
+    You are generating {n} different product listings for merchandise items to be sold on a Shopify store.
+
+    For EACH listing provide ONLY the following fields, each on its own line, in this exact format:
+{listing_format}
+    Separate listings with a line containing only ---
+    Every listing must have a different title and design. Each product must be a tangible item a t-shirt, cup, or cap, and the image prompt should describe how the product looks visually.
+
+    Do NOT include any other text, explanation, or formatting.
+    """
+
+# Cloudflare image generations run in parallel for batch requests
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "4"))
+MAX_BATCH_SIZE = 25
+
 
+def parse_product_fields(raw_text: str) -> dict:
     title, description, tags, image_prompt = "", "", [], ""
     product_type = ""
     price = 0.0
@@ -87,23 +116,90 @@ def generate_product():
     if not tags:
         tags = []
 
-    image_path = generate_image_from_cloudflare(image_prompt)
-
-    # Save JSON output for demo
-    os.makedirs("output", exist_ok=True)
-    output_json = {
+    return {
         "title": title,
         "description": description,
         "tags": tags,
         "price": price,
         "product_type": product_type,
-        "image_path": image_path
+        "image_prompt": image_prompt,
     }
+
+
+def split_listings(raw_text: str) -> list[str]:
+    """Splits a multi-listing LLM response on --- separators or on each new Product Title line."""
+    blocks, current = [], []
+    for line in raw_text.split("\n"):
+        stripped = line.strip()
+        starts_listing = "product title" in stripped.lower() and any("product title" in l.lower() for l in current)
+        if stripped.strip("-") == "" and stripped.startswith("---") or starts_listing:
+            if current:
+                blocks.append("\n".join(current))
+            current = [] if not starts_listing else [line]
+            continue
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return [block for block in blocks if "product title" in block.lower()]
+
+
+def with_image(fields: dict) -> dict:
+    fields = dict(fields)
+    fields["image_path"] = generate_image_from_cloudflare(fields["image_prompt"])
+    return fields
+
+
+@app.post("/generate", response_model=ProductOutput)
+def generate_product(images: bool = True):
+    """
+    With images=false only the listing is generated; the caller can check it
+    for duplicates and then request the design from /generate/image.
+    """
+    raw_text = generate_text_from_gemini(LLM_PROMPT)
+    output_json = parse_product_fields(raw_text)
+    if images:
+        output_json = with_image(output_json)
+
+    # Save JSON output for demo
+    os.makedirs("output", exist_ok=True)
     with open("output/product.json", "w", encoding="utf-8") as f:
         json.dump(output_json, f, indent=2)
 
     return output_json
 
+
+@app.post("/generate/image", response_model=ImageOutput)
+def generate_image(request: ImageRequest):
+    return {"image_path": generate_image_from_cloudflare(request.image_prompt)}
+
+
+@app.post("/generate/batch")
+def generate_batch(n: int = Query(5, ge=1, le=MAX_BATCH_SIZE), images: bool = True):
+    """
+    Generates up to n listings from a single LLM call and streams them as NDJSON,
+    one product per line, each as soon as its image is ready. With images=false
+    the listings are streamed straight away without images.
+    """
+    raw_text = generate_text_from_gemini(BATCH_LLM_PROMPT.format(n=n, listing_format=LISTING_FORMAT))
+    listings = [parse_product_fields(block) for block in split_listings(raw_text)][:n]
+
+    def stream():
+        if not images:
+            for fields in listings:
+                yield ProductOutput(**fields).model_dump_json() + "\n"
+            return
+        with ThreadPoolExecutor(max_workers=IMAGE_CONCURRENCY) as pool:
+            futures = [pool.submit(with_image, fields) for fields in listings]
+            for future in as_completed(futures):
+                try:
+                    product = ProductOutput(**future.result())
+                except CacheMiss as e:
+                    print(f"Skipping listing: {e}")
+                    continue
+                yield product.model_dump_json() + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="localhost", port=8001)
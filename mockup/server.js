@@ -4,6 +4,7 @@ import { createCanvas, loadImage } from 'canvas';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import fs from 'fs';
+import crypto from 'crypto';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -16,11 +17,30 @@ const PORT = 3000;
 
 const TEMPLATES_DIR = path.join(__dirname, 'templates');
 const OUTPUT_DIR = path.join(__dirname, 'output');
+// Content-addressed store shared with the Python services (common/asset_store.py)
+const ASSET_ROOT = process.env.ASSET_STORE_DIR || path.join(__dirname, '..', 'assets');
 
 if (!fs.existsSync(OUTPUT_DIR)) {
   fs.mkdirSync(OUTPUT_DIR);
 }
 
+// Writes the buffer as <root>/ab/cd/<sha256>.png, atomically; identical images are stored once.
+const putAsset = async (buffer, ext = '.png') => {
+  const digest = crypto.createHash('sha256').update(buffer).digest('hex');
+  const dir = path.join(ASSET_ROOT, digest.slice(0, 2), digest.slice(2, 4));
+  const assetPath = path.join(dir, `${digest}${ext}`);
+  if (fs.existsSync(assetPath)) {
+    const now = new Date();
+    await fs.promises.utimes(assetPath, now, now);
+    return { digest, assetPath };
+  }
+  await fs.promises.mkdir(dir, { recursive: true });
+  const tmpPath = path.join(dir, `${digest}.${process.pid}.${crypto.randomBytes(4).toString('hex')}.tmp`);
+  await fs.promises.writeFile(tmpPath, buffer);
+  await fs.promises.rename(tmpPath, assetPath);
+  return { digest, assetPath };
+};
+
 app.get('/', (req, res) => {
   res.status(200).send('Mockup server is up and running.');
 });
@@ -38,9 +58,24 @@ const productConfig = {
 };
 
 
+// Colors rendered without a dedicated template by tinting the white one inside
+// templates/<product>-mask.png. Mirrors COLOR_SWATCHES in orchestrator/mockup_renderer.py.
+const colorSwatches = {
+  'white': [255, 255, 255],
+  'black': [40, 40, 42],
+  'navy': [38, 52, 88],
+  'heather gray': [168, 168, 172],
+  'red': [182, 38, 44],
+  'forest green': [40, 88, 56],
+  'royal blue': [46, 84, 170],
+  'sand': [214, 196, 160]
+};
+
+const normalize = (value) => value.toLowerCase().replace(/\s/g, '');
+
 const findTemplatePath = (productType, color) => {
-  const normalizedProductType = productType.toLowerCase().replace(/\s/g, '');
-  const normalizedColor = color ? `-${color.toLowerCase().replace(/\s/g, '')}` : '';
+  const normalizedProductType = normalize(productType);
+  const normalizedColor = color ? `-${normalize(color)}` : '';
   let templateFileName = `${normalizedProductType}${normalizedColor}.png`;
   let templateFilePath = path.join(TEMPLATES_DIR, templateFileName);
   if (fs.existsSync(templateFilePath)) {
@@ -49,6 +84,68 @@ const findTemplatePath = (productType, color) => {
   return null;
 };
 
+// Decoded templates (loaded or tinted), keyed by "<product>|<color>", kept for the life of the process.
+const templateCache = new Map();
+
+const tintTemplate = async (productType, color) => {
+  const whitePath = findTemplatePath(productType, 'white');
+  const maskPath = path.join(TEMPLATES_DIR, `${normalize(productType)}-mask.png`);
+  if (!whitePath || !fs.existsSync(maskPath)) {
+    return null;
+  }
+  const [templateImg, maskImg] = await Promise.all([loadImage(whitePath), loadImage(maskPath)]);
+  const [r, g, b] = colorSwatches[color.toLowerCase()];
+
+  // Multiply the template by the swatch, then keep that only inside the mask
+  const tint = createCanvas(templateImg.width, templateImg.height);
+  const tintCtx = tint.getContext('2d');
+  tintCtx.drawImage(templateImg, 0, 0);
+  tintCtx.globalCompositeOperation = 'multiply';
+  tintCtx.fillStyle = `rgb(${r}, ${g}, ${b})`;
+  tintCtx.fillRect(0, 0, tint.width, tint.height);
+  tintCtx.globalCompositeOperation = 'destination-in';
+  tintCtx.drawImage(maskImg, 0, 0, tint.width, tint.height);
+
+  const canvas = createCanvas(templateImg.width, templateImg.height);
+  const ctx = canvas.getContext('2d');
+  ctx.drawImage(templateImg, 0, 0);
+  ctx.drawImage(tint, 0, 0);
+  return canvas;
+};
+
+// Resolves to the decoded template (an Image or Canvas), or null when there is none for this color.
+const getTemplate = (productType, color) => {
+  const key = `${normalize(productType)}|${color.toLowerCase()}`;
+  if (!templateCache.has(key)) {
+    const templatePath = findTemplatePath(productType, color);
+    let pending;
+    if (templatePath) {
+      pending = loadImage(templatePath);
+    } else if (colorSwatches[color.toLowerCase()]) {
+      pending = tintTemplate(productType, color);
+    } else {
+      pending = Promise.resolve(null);
+    }
+    // Drop failed loads so a later request can retry them
+    pending.catch(() => templateCache.delete(key));
+    templateCache.set(key, pending);
+  }
+  return templateCache.get(key);
+};
+
+const loadDesign = async (imageUrl) => {
+  if (imageUrl.startsWith('http')) {
+    const response = await fetch(imageUrl);
+    if (!response.ok) throw new Error('Failed to fetch image from URL');
+    const buffer = await response.buffer();
+    return loadImage(buffer);
+  }
+  if (path.isAbsolute(imageUrl)) {
+    return loadImage(imageUrl);
+  }
+  return loadImage(path.resolve(__dirname, imageUrl));
+};
+
 // This function now handles both vertical and horizontal bending.
 function drawTransformedDesign(ctx, designImg, printArea, bendStrengthTop, bendStrengthBottom, horizontalBend) {
   const numStrips = 400; // Increased strips for a smoother look
@@ -88,6 +185,86 @@ function drawTransformedDesign(ctx, designImg, printArea, bendStrengthTop, bendS
   }
 }
 
+const renderMockup = (templateImg, designImg, productType, templateConfig) => {
+  const canvas = createCanvas(templateImg.width, templateImg.height);
+  const ctx = canvas.getContext('2d');
+
+  ctx.drawImage(templateImg, 0, 0);
+
+  const printArea = templateConfig.printArea;
+  const printAreaWidth = templateImg.width * printArea.width;
+  const printAreaHeight = templateImg.height * printArea.height;
+  const printAreaX = templateImg.width * printArea.x;
+  const printAreaY = templateImg.height * printArea.y;
+
+  const designAspectRatio = designImg.width / designImg.height;
+  const printAreaAspectRatio = printAreaWidth / printAreaHeight;
+
+  let finalDesignWidth, finalDesignHeight;
+  if (designAspectRatio > printAreaAspectRatio) {
+    finalDesignWidth = printAreaWidth;
+    finalDesignHeight = finalDesignWidth / designAspectRatio;
+  } else {
+    finalDesignHeight = printAreaHeight;
+    finalDesignWidth = finalDesignHeight * designAspectRatio;
+  }
+
+  const finalDesignX = printAreaX + (printAreaWidth - finalDesignWidth) / 2;
+  const finalDesignY = printAreaY + (printAreaHeight - finalDesignHeight) / 2;
+
+  if (productType.toLowerCase() === 'cup') {
+    const curvedPrintArea = {
+      x: finalDesignX,
+      y: finalDesignY,
+      width: finalDesignWidth,
+      height: finalDesignHeight
+    };
+    // For cups, use a symmetrical vertical curve.
+    drawTransformedDesign(ctx, designImg, curvedPrintArea, 0.13, 0.15, 0);
+  } else if (productType.toLowerCase() === 'cap') {
+    const curvedPrintArea = {
+      x: finalDesignX,
+      y: finalDesignY,
+      width: finalDesignWidth,
+      height: finalDesignHeight
+    };
+    // Horizontal and vertical bend for the cap's rounded shape.
+    drawTransformedDesign(ctx, designImg, curvedPrintArea, 0.05, 0.05, 0);
+  } else {
+    ctx.globalAlpha = 0.95;
+    ctx.drawImage(designImg, finalDesignX, finalDesignY, finalDesignWidth, finalDesignHeight);
+    ctx.globalAlpha = 1.0;
+  }
+  return canvas;
+};
+
+// Renders one variant and stores it; resolves to the JSON the endpoints return.
+const renderVariant = async (designImg, productType, color) => {
+  const templateConfig = productConfig[normalize(productType)];
+  if (!templateConfig) {
+    return { product_type: productType, color, error: `Product type "${productType}" is not supported in the configuration.` };
+  }
+  const templateImg = await getTemplate(productType, color);
+  if (!templateImg) {
+    return { product_type: productType, color, error: `No template found for product type "${productType}" with color "${color}".` };
+  }
+
+  const canvas = renderMockup(templateImg, designImg, productType, templateConfig);
+  const buffer = await new Promise((resolve, reject) => {
+    canvas.toBuffer((err, buf) => (err ? reject(err) : resolve(buf)), 'image/png');
+  });
+  const { digest, assetPath } = await putAsset(buffer);
+  const relativePath = path.relative(ASSET_ROOT, assetPath).split(path.sep).join('/');
+
+  return {
+    mockup_id: `mockup_${digest.slice(0, 16)}`,
+    mockup_url: `http://localhost:${PORT}/assets/${relativePath}`,
+    mockup_path: assetPath,
+    product_type: productType,
+    color: color
+  };
+};
+
 app.post('/mockup', async (req, res) => {
   try {
     const { image_url, product_type, color } = req.body;
@@ -96,109 +273,51 @@ app.post('/mockup', async (req, res) => {
       return res.status(400).json({ error: 'Missing image_url, product_type, or color in request body' });
     }
 
-    const templatePath = findTemplatePath(product_type, color);
-
-    if (!templatePath) {
-      return res.status(400).json({ error: `No template found for product type "${product_type}" with color "${color}".` });
+    const designImg = await loadDesign(image_url);
+    const result = await renderVariant(designImg, product_type, color);
+    if (result.error) {
+      return res.status(400).json({ error: result.error });
     }
+    return res.json(result);
 
-    const templateConfig = productConfig[product_type.toLowerCase().replace(/\s/g, '')];
-
-    if (!templateConfig) {
-      return res.status(400).json({ error: `Product type "${product_type}" is not supported in the configuration.` });
-    }
+  } catch (error) {
+    console.error('Error in /mockup:', error);
+    return res.status(500).json({ error: error.message });
+  }
+});
 
-    const templateImg = await loadImage(templatePath);
-    let designImg;
-    if (image_url.startsWith('http')) {
-      const response = await fetch(image_url);
-      if (!response.ok) throw new Error('Failed to fetch image from URL');
-      const buffer = await response.buffer();
-      designImg = await loadImage(buffer);
-    } else {
-      if (path.isAbsolute(image_url)) {
-        designImg = await loadImage(image_url);
-      } else {
-        designImg = await loadImage(path.resolve(__dirname, image_url));
-      }
+// One design, many product/color variants: { image_url, variants: [{ product_type, color }] }.
+// The design is fetched and decoded once and the variants render concurrently
+// (PNG encoding runs on libuv's thread pool). Each entry of `mockups` is either
+// a mockup or { product_type, color, error }.
+app.post('/mockup/batch', async (req, res) => {
+  try {
+    const { image_url, variants } = req.body;
 
+    if (!image_url || !Array.isArray(variants) || variants.length === 0) {
+      return res.status(400).json({ error: 'Missing image_url or a non-empty variants list in request body' });
     }
-
-    const canvas = createCanvas(templateImg.width, templateImg.height);
-    const ctx = canvas.getContext('2d');
-    
-    ctx.drawImage(templateImg, 0, 0);
-
-    const printArea = templateConfig.printArea;
-    const printAreaWidth = templateImg.width * printArea.width;
-    const printAreaHeight = templateImg.height * printArea.height;
-    const printAreaX = templateImg.width * printArea.x;
-    const printAreaY = templateImg.height * printArea.y;
-
-    const designAspectRatio = designImg.width / designImg.height;
-    const printAreaAspectRatio = printAreaWidth / printAreaHeight;
-
-    let finalDesignWidth, finalDesignHeight;
-    if (designAspectRatio > printAreaAspectRatio) {
-      finalDesignWidth = printAreaWidth;
-      finalDesignHeight = finalDesignWidth / designAspectRatio;
-    } else {
-      finalDesignHeight = printAreaHeight;
-      finalDesignWidth = finalDesignHeight * designAspectRatio;
+    if (variants.some((v) => !v || !v.product_type || !v.color)) {
+      return res.status(400).json({ error: 'Every variant needs a product_type and a color' });
     }
 
-    const finalDesignX = printAreaX + (printAreaWidth - finalDesignWidth) / 2;
-    const finalDesignY = printAreaY + (printAreaHeight - finalDesignHeight) / 2;
-
-    if (product_type.toLowerCase() === 'cup') {
-      const curvedPrintArea = {
-        x: finalDesignX,
-        y: finalDesignY,
-        width: finalDesignWidth,
-        height: finalDesignHeight
-      };
-      // For cups, use a symmetrical vertical curve.
-      drawTransformedDesign(ctx, designImg, curvedPrintArea, 0.13, 0.15, 0);
-    } else if (product_type.toLowerCase() === 'cap') {
-      const curvedPrintArea = {
-        x: finalDesignX,
-        y: finalDesignY,
-        width: finalDesignWidth,
-        height: finalDesignHeight
-      };
-      // Horizontal and vertical bend for the cap's rounded shape.
-      drawTransformedDesign(ctx, designImg, curvedPrintArea, 0.05, 0.05, 0); 
-    } else {
-      ctx.globalAlpha = 0.95;
-      ctx.drawImage(designImg, finalDesignX, finalDesignY, finalDesignWidth, finalDesignHeight);
-      ctx.globalAlpha = 1.0;
-    }
-    
-    const timestamp = Date.now();
-    const outputFilename = `mockup_${timestamp}.png`;
-    const outputPath = path.join(OUTPUT_DIR, outputFilename);
-
-    const outStream = fs.createWriteStream(outputPath);
-    const stream = canvas.createPNGStream();
-    stream.pipe(outStream);
-
-    outStream.on('finish', () => {
-      const mockupResponse = {
-        mockup_id: `mockup_${timestamp}`,
-        mockup_url: `http://localhost:${PORT}/output/${outputFilename}`,
-        product_type: product_type,
-        color: color
-      };
-      return res.json(mockupResponse);
-    });
+    const designImg = await loadDesign(image_url);
+    const mockups = await Promise.all(variants.map(({ product_type, color }) =>
+      renderVariant(designImg, product_type, color).catch((error) => {
+        console.error(`Error rendering ${product_type}/${color}:`, error);
+        return { product_type, color, error: error.message };
+      })
+    ));
+    return res.json({ mockups });
 
   } catch (error) {
-    console.error('Error in /mockup:', error);
+    console.error('Error in /mockup/batch:', error);
     return res.status(500).json({ error: error.message });
   }
 });
 
 app.use('/output', express.static(path.join(__dirname, 'output')));
+app.use('/assets', express.static(ASSET_ROOT));
 
 app.listen(PORT, () => {
   console.log(`Mockup visualizer running on http://localhost:${PORT}`);
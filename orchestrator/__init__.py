@@ -0,0 +1 @@
+"""AI Merch Maker orchestrator. Run `python -m orchestrator --help` for the command-line interface."""
@@ -0,0 +1,194 @@
+"""
+Command-line interface for the orchestrator:
+
+    python -m orchestrator run                  # one product
+    python -m orchestrator batch --count 10     # several products through the stage pipeline
+    python -m orchestrator resume               # failed or interrupted jobs
+    python -m orchestrator status [--json]      # jobs, published products, supervisor
+    python -m orchestrator list [--jobs]        # recent products or jobs
+    python -m orchestrator gc [--dry-run]       # orphaned asset store files
+    python -m orchestrator sync [--full]        # mirror the Shopify catalog into state.db
+    python -m orchestrator profile [A [B]]      # list, show or diff profiles of --profile runs
+
+Only state.py is imported up front. The pipeline and its dependencies (PIL,
+numpy, the Shopify client, and transformers/torch on the first caption) are
+imported by the commands that run it, so status checks and health probes
+stay cheap. See benchmarks/import_budget.py.
+"""
+import argparse
+import json
+import os
+import sys
+
+orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
+# Modules in this directory import each other by bare name (from state import StateDB)
+sys.path.insert(0, orchestrator_dir)
+
+from state import StateDB
+from asset_gc import DEFAULT_GRACE_HOURS, collect_garbage
+
+
+def get_db():
+    return StateDB()
+
+
+def cmd_run(args):
+    import run
+    run_id = run.main(profile=args.profile)
+    failed = [row for row in get_db().get_stage_timings(run_id) if row["status"] == "failed"]
+    return 1 if failed else 0
+
+
+def cmd_batch(args):
+    import run
+    result = run.run_batch(args.count, args.concurrency, stream=not args.no_stream, profile=args.profile)
+    return 1 if result.count("failed") else 0
+
+
+def cmd_resume(args):
+    import run
+    result = run.resume(limit=args.limit, concurrency=args.concurrency, profile=args.profile)
+    return 1 if result and result.count("failed") else 0
+
+
+def cmd_status(args):
+    from supervisor import supervisor_running
+    db = get_db()
+    _, latest, published = db.records_version()
+    status = {
+        "jobs": db.job_counts(),
+        "published": published,
+        "last_published_at": latest,
+        "shopify_mirror": db.shopify_product_count(),
+        "shopify_synced_through": db.get_sync_state("shopify_products.updated_at"),
+        "supervisor": "running" if supervisor_running() else "not running",
+    }
+    if args.json:
+        print(json.dumps(status))
+        return 0
+    jobs = ", ".join(f"{count} {name}" for name, count in sorted(status["jobs"].items())) or "none"
+    print(f"Jobs: {jobs}")
+    print(f"Published products: {published} (latest {latest or 'never'})")
+    print(f"Shopify mirror: {status['shopify_mirror']} products "
+          f"(synced through {status['shopify_synced_through'] or 'never'})")
+    print(f"Supervisor: {status['supervisor']}")
+    return 0
+
+
+def cmd_list(args):
+    db = get_db()
+    if args.jobs:
+        for job in db.list_jobs(status=args.status, limit=args.limit):
+            print(f"{job['id']:>6}  {job['status']:<8} {job['stage'] or '-':<8} attempts={job['attempts']}  "
+                  f"{job['updated_at']}  {job['error'] or ''}")
+        return 0
+    records, _ = db.get_records_page(args.limit)
+    for record in records:
+        print(f"{record['published_at']}  {record['fake_product_id'] or '-':<10} {record['product_title']}")
+    if not records:
+        print("No products published yet.")
+    return 0
+
+
+def cmd_gc(args):
+    removed, freed = collect_garbage(get_db(), grace_hours=args.grace_hours, dry_run=args.dry_run)
+    print(f"{removed} assets, {freed / 1024 / 1024:.1f} MB {'reclaimable' if args.dry_run else 'freed'}.")
+    return 0
+
+
+def cmd_sync(args):
+    from shopify_client import credentials_set
+    from shopify_sync import sync_catalog
+    if not credentials_set():
+        print("Shopify credentials not set; nothing to sync.")
+        return 1
+    result = sync_catalog(get_db(), full=args.full)
+    print(f"Synced {result['products']} products in {result['pages']} pages, removed {result['pruned']}; "
+          f"watermark {result['watermark'] or 'none'}.")
+    return 0
+
+
+def cmd_profile(args):
+    import profiling
+    if not args.profiles:
+        names = profiling.list_profiles()
+        for name in names:
+            print(name)
+        if not names:
+            print(f"No profiles in {profiling.PROFILE_DIR}. Run with --profile or PIPELINE_PROFILE=1.")
+        return 0
+    try:
+        paths = [profiling.resolve_profile(name) for name in args.profiles]
+    except FileNotFoundError as e:
+        print(e)
+        return 1
+    if len(paths) == 1:
+        print(profiling.format_profile(paths[0], top=args.top))
+    else:
+        print(profiling.diff_profiles(*paths, top=args.top))
+    return 0
+
+
+def add_profile_flag(parser):
+    parser.add_argument("--profile", action="store_true", default=None,
+                        help="write cProfile, sampled stacks and tracemalloc peaks per stage (see profiling.py)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m orchestrator", description="Run and inspect the AI Merch Maker pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="generate and publish one product")
+    add_profile_flag(run)
+    run.set_defaults(func=cmd_run)
+
+    batch = sub.add_parser("batch", help="run several products through the stage pipeline")
+    batch.add_argument("--count", type=int, default=5, help="number of products to generate")
+    batch.add_argument("--concurrency", type=int, default=None, help="workers per stage")
+    batch.add_argument("--no-stream", action="store_true", help="call /generate once per product")
+    add_profile_flag(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    resume = sub.add_parser("resume", help="resume failed or interrupted jobs")
+    resume.add_argument("--limit", type=int, default=50, help="maximum jobs to claim")
+    resume.add_argument("--concurrency", type=int, default=None, help="workers per stage")
+    add_profile_flag(resume)
+    resume.set_defaults(func=cmd_resume)
+
+    status = sub.add_parser("status", help="show job counts, published products and the supervisor")
+    status.add_argument("--json", action="store_true", help="print one JSON object (for health checks)")
+    status.set_defaults(func=cmd_status)
+
+    listing = sub.add_parser("list", help="list recently published products")
+    listing.add_argument("--limit", type=int, default=20)
+    listing.add_argument("--jobs", action="store_true", help="list jobs instead of products")
+    listing.add_argument("--status", help="with --jobs, only jobs in this status")
+    listing.set_defaults(func=cmd_list)
+
+    gc = sub.add_parser("gc", help="remove orphaned and expired assets from the asset store")
+    gc.add_argument("--grace-hours", type=float, default=DEFAULT_GRACE_HOURS, help="keep unreferenced assets newer than this")
+    gc.add_argument("--dry-run", action="store_true", help="only list what would be removed")
+    gc.set_defaults(func=cmd_gc)
+
+    sync = sub.add_parser("sync", help="mirror the Shopify store's products into state.db")
+    sync.add_argument("--full", action="store_true",
+                      help="fetch the whole catalog and drop products deleted from the store")
+    sync.set_defaults(func=cmd_sync)
+
+    profile = sub.add_parser("profile", help="list profiles, show one, or diff two (before, after)")
+    profile.add_argument("profiles", nargs="*", metavar="PROFILE", help="run id or profile directory")
+    profile.add_argument("--top", type=int, default=10, help="functions shown per stage")
+    profile.set_defaults(func=cmd_profile)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # state.db and caption_cache.db are relative to the orchestrator directory,
+    # as when running `python run.py` from it
+    os.chdir(orchestrator_dir)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
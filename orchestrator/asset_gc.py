@@ -0,0 +1,46 @@
+import argparse
+import time
+from state import StateDB
+from common.asset_store import AssetStore
+
+DEFAULT_GRACE_HOURS = 24
+
+
+def collect_garbage(db, store=None, grace_hours=DEFAULT_GRACE_HOURS, dry_run=False):
+    """
+    Removes asset store files that no published product references. Unreferenced
+    files younger than `grace_hours` are kept, since they may belong to a run
+    that has not reached the publish stage yet; after that they are treated as
+    expired. Returns (files_removed, bytes_freed).
+    """
+    store = store or AssetStore()
+    if not dry_run:
+        pruned = db.prune_asset_refs()
+        if pruned:
+            print(f"Pruned {pruned} references to deleted products.")
+        store.remove_stale_temp_files()
+
+    live = db.live_asset_digests()
+    cutoff = time.time() - grace_hours * 3600
+    removed, freed = [], 0
+    for digest, path, size, mtime in store.iter_assets():
+        if digest in live or mtime >= cutoff:
+            continue
+        print(f"{'Would remove' if dry_run else 'Removing'} {path} ({size} bytes)")
+        if not dry_run:
+            store.remove(path)
+        removed.append(path)
+        freed += size
+    if removed and not dry_run:
+        db.forget_derivatives(removed)
+    return len(removed), freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove orphaned and expired assets from the asset store.")
+    parser.add_argument("--grace-hours", type=float, default=DEFAULT_GRACE_HOURS,
+                        help="keep unreferenced assets newer than this")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be removed")
+    args = parser.parse_args()
+    removed, freed = collect_garbage(StateDB(), grace_hours=args.grace_hours, dry_run=args.dry_run)
+    print(f"{removed} assets, {freed / 1024 / 1024:.1f} MB {'reclaimable' if args.dry_run else 'freed'}.")
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+from io import BytesIO
+from PIL import Image
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.transport import get_client
+
+CAPTION_MODEL = "Salesforce/blip-image-captioning-base"
+# "blip" (full precision) or "blip-int8" (quantized, for CPU-only boxes); see CAPTION_BACKENDS
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "blip")
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
+CAPTION_CACHE_PATH = os.getenv("CAPTION_CACHE_PATH", "caption_cache.db")
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", "10000"))
+# Used by blip-int8: caption length cap, and torch intra-op threads (0 keeps torch's default)
+CAPTION_MAX_NEW_TOKENS = int(os.getenv("CAPTION_MAX_NEW_TOKENS", "20"))
+CAPTION_THREADS = int(os.getenv("CAPTION_THREADS", "0"))
+
+
+class CaptionBackend:
+    """
+    A captioning model. `caption` takes a batch of RGB PIL images and returns
+    one caption per image. `name` identifies the model and its settings; it
+    keys the caption cache, so backends never serve each other's captions.
+    """
+
+    name = None
+
+    def load(self):
+        """Loads the model if needed; safe to call from several threads."""
+
+    def caption(self, images):
+        raise NotImplementedError
+
+
+class BlipBackend(CaptionBackend):
+    """BLIP base in full precision with the model's default generate() settings."""
+
+    def __init__(self, model_name=CAPTION_MODEL):
+        self.name = model_name
+        self.model_name = model_name
+        self.lock = threading.Lock()
+        self.processor = None
+        self.model = None
+
+    def load(self):
+        # Load model once, on first use
+        with self.lock:
+            if self.model is None:
+                from transformers import BlipProcessor, BlipForConditionalGeneration
+                self.processor = BlipProcessor.from_pretrained(self.model_name)
+                self.model = self.prepare(BlipForConditionalGeneration.from_pretrained(self.model_name).eval())
+        return self.processor, self.model
+
+    def prepare(self, model):
+        return model
+
+    def generate_kwargs(self):
+        return {}
+
+    def caption(self, images):
+        import torch
+        processor, model = self.load()
+        inputs = processor(images=images, return_tensors="pt")
+        with torch.inference_mode():
+            out = model.generate(**inputs, **self.generate_kwargs())
+        return [caption.strip() for caption in processor.batch_decode(out, skip_special_tokens=True)]
+
+
+class QuantizedBlipBackend(BlipBackend):
+    """
+    BLIP base for CPU-only boxes: Linear layers are dynamically quantized to
+    int8 (roughly a quarter of their fp32 size, and faster matmuls), decoding is
+    greedy with at most `max_new_tokens` tokens, and torch uses `threads`
+    intra-op threads so several workers can share a box without oversubscribing it.
+    """
+
+    def __init__(self, model_name=CAPTION_MODEL, max_new_tokens=CAPTION_MAX_NEW_TOKENS, threads=CAPTION_THREADS):
+        super().__init__(model_name)
+        self.name = f"{model_name}:int8:greedy-{max_new_tokens}"
+        self.max_new_tokens = max_new_tokens
+        self.threads = threads
+
+    def prepare(self, model):
+        import torch
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        try:
+            # Only allowed before any inter-op parallel work has started
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def generate_kwargs(self):
+        return {"max_new_tokens": self.max_new_tokens, "num_beams": 1, "do_sample": False}
+
+
+CAPTION_BACKENDS = {
+    "blip": BlipBackend,
+    "blip-int8": QuantizedBlipBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name=None):
+    """The shared backend instance for `name` (default CAPTION_BACKEND)."""
+    name = name or CAPTION_BACKEND
+    with _backends_lock:
+        if name not in _backends:
+            if name not in CAPTION_BACKENDS:
+                raise ValueError(f"Unknown CAPTION_BACKEND {name!r}; expected one of {', '.join(CAPTION_BACKENDS)}")
+            _backends[name] = CAPTION_BACKENDS[name]()
+        return _backends[name]
+
+
+def load_model():
+    return get_backend().load()
+
+
+class CaptionCache:
+    """
+    Persistent caption store keyed by the SHA-256 of the image bytes and the
+    backend name, so each backend keeps its own captions. Once the cache holds
+    more than `max_entries` captions the least recently used ones are evicted.
+    """
+
+    def __init__(self, db_path=CAPTION_CACHE_PATH, max_entries=CAPTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Caches from before the (image_hash, model) key let backends overwrite each other
+        pk = [row[1] for row in self.conn.execute("PRAGMA table_info(captions)") if row[5]]
+        if pk == ["image_hash"]:
+            self.conn.execute("DROP INDEX IF EXISTS idx_captions_last_used")
+            self.conn.execute("ALTER TABLE captions RENAME TO captions_old")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS captions (
+            image_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            caption TEXT,
+            last_used REAL,
+            PRIMARY KEY (image_hash, model)
+        )
+        """)
+        if pk == ["image_hash"]:
+            self.conn.execute("""
+                INSERT OR IGNORE INTO captions (image_hash, model, caption, last_used)
+                SELECT image_hash, COALESCE(model, ?), caption, last_used FROM captions_old
+            """, (CAPTION_MODEL,))
+            self.conn.execute("DROP TABLE captions_old")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_captions_last_used ON captions (last_used)")
+        self.conn.commit()
+
+    def get_many(self, hashes, model=CAPTION_MODEL):
+        if not hashes:
+            return {}
+        placeholders = ",".join("?" for _ in hashes)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT image_hash, caption FROM captions WHERE model = ? AND image_hash IN ({placeholders})",
+                (model, *hashes),
+            ).fetchall()
+            found = {row[0]: row[1] for row in rows}
+            if found:
+                self.conn.executemany(
+                    "UPDATE captions SET last_used = julianday('now') WHERE image_hash = ? AND model = ?",
+                    [(h, model) for h in found],
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, captions, model=CAPTION_MODEL):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO captions (image_hash, model, caption, last_used) VALUES (?, ?, ?, julianday('now'))",
+                [(h, model, caption) for h, caption in captions.items()],
+            )
+            self.conn.execute("""
+                DELETE FROM captions WHERE rowid IN (
+                    SELECT rowid FROM captions ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self.conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CaptionCache()
+    return _cache
+
+
+def read_image_bytes(source):
+    if isinstance(source, bytes):
+        return source
+    if source.startswith("http"):
+        response = get_client("image-fetch", timeout=(3.05, 30)).get(source)
+        response.raise_for_status()
+        return response.content
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def caption_images(sources, batch_size=CAPTION_BATCH_SIZE, backend=None, use_cache=True):
+    """
+    Captions a list of image paths, URLs, raw bytes or PIL images. Cached captions are
+    served without touching the model; the rest are decoded and run through
+    the caption backend (CAPTION_BACKEND unless `backend` is given) in batches
+    of `batch_size`. Images that fail to load get "".
+    """
+    backend = backend or get_backend()
+    captions = [""] * len(sources)
+    hashes = [None] * len(sources)
+    raw = {}
+    for i, source in enumerate(sources):
+        try:
+            if isinstance(source, Image.Image):
+                # Already decoded in memory (e.g. a freshly rendered mockup)
+                data = source
+                hashes[i] = hashlib.sha256(f"{source.mode}{source.size}".encode() + source.tobytes()).hexdigest()
+            else:
+                data = read_image_bytes(source)
+                hashes[i] = hashlib.sha256(data).hexdigest()
+        except Exception as e:
+            print(f"Error loading image for captioning: {e}")
+            continue
+        raw[hashes[i]] = data
+
+    cache = get_cache() if use_cache else None
+    cached = cache.get_many(list(raw), backend.name) if cache else {}
+    pending = []
+    for h, data in raw.items():
+        if h not in cached:
+            try:
+                image = data if isinstance(data, Image.Image) else Image.open(BytesIO(data))
+                pending.append((h, image.convert('RGB')))
+            except Exception as e:
+                print(f"Error loading image for captioning: {e}")
+
+    fresh = {}
+    if pending:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            for (h, _), caption in zip(batch, backend.caption([image for _, image in batch])):
+                fresh[h] = caption
+        if cache:
+            cache.put_many(fresh, backend.name)
+
+    for i, h in enumerate(hashes):
+        if h is not None:
+            captions[i] = cached.get(h) or fresh.get(h, "")
+    return captions
+
+
+def generate_image_caption(image_path_or_url: str) -> str:
+    return caption_images([image_path_or_url])[0]
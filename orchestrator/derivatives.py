@@ -0,0 +1,94 @@
+"""
+Size- and format-specific renditions of pipeline images, made by the
+derivatives stage (after mockup) so each consumer reads only what it needs:
+
+    caption     384x384 RGB PNG, the size BLIP's processor resizes to anyway
+    shopify     at most SHOPIFY_IMAGE_SIZE pixels on the longest side, JPEG or
+                WebP (SHOPIFY_IMAGE_FORMAT), transparency flattened onto white
+    thumbnail   the dashboard's JPEG thumbnail (see thumbnails.py)
+
+Renditions are stored next to their sources in the asset store (thumbnails in
+the thumbnail cache). StateDB's derivatives table maps a source's content
+hash and each rendition's settings to the file, so every source is resized
+and encoded once per setting.
+"""
+import hashlib
+import os
+import sys
+
+from PIL import Image
+
+from thumbnails import THUMBNAIL_WIDTH, fit, flatten, make_thumbnail, save_thumbnail
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+
+# BlipImageProcessor resizes every input to 384x384 (bicubic) before inference
+CAPTION_INPUT_SIZE = 384
+SHOPIFY_IMAGE_SIZE = int(os.getenv("SHOPIFY_IMAGE_SIZE", "2048"))
+SHOPIFY_IMAGE_FORMAT = os.getenv("SHOPIFY_IMAGE_FORMAT", "jpeg").upper()
+SHOPIFY_IMAGE_QUALITY = int(os.getenv("SHOPIFY_IMAGE_QUALITY", "85"))
+
+
+def caption_rendition(image, digest, store):
+    # The same conversion and resize captioning applied to full-size images
+    image = image.convert("RGB").resize((CAPTION_INPUT_SIZE, CAPTION_INPUT_SIZE), Image.BICUBIC)
+    return store.put_image(image, "PNG")
+
+
+def shopify_rendition(image, digest, store):
+    image = flatten(fit(image, SHOPIFY_IMAGE_SIZE, SHOPIFY_IMAGE_SIZE))
+    if SHOPIFY_IMAGE_FORMAT == "WEBP":
+        return store.put_image(image, "WEBP", quality=SHOPIFY_IMAGE_QUALITY, method=4)
+    return store.put_image(image, "JPEG", quality=SHOPIFY_IMAGE_QUALITY, optimize=True, progressive=True)
+
+
+def thumbnail_rendition(image, digest, store):
+    return save_thumbnail(make_thumbnail(image), digest)
+
+
+# name -> (settings key, renderer). The key changes with the settings, so changing
+# them produces new renditions instead of reusing files made with the old ones.
+RENDITIONS = {
+    "caption": (f"caption-{CAPTION_INPUT_SIZE}", caption_rendition),
+    "shopify": (f"shopify-{SHOPIFY_IMAGE_SIZE}-{SHOPIFY_IMAGE_FORMAT.lower()}-q{SHOPIFY_IMAGE_QUALITY}",
+                shopify_rendition),
+    "thumbnail": (f"thumbnail-{THUMBNAIL_WIDTH}", thumbnail_rendition),
+}
+
+
+def source_digest(path, store):
+    """The content hash of an image file; free for asset store files, which are named by it."""
+    digest = store.digest_of(path)
+    if digest:
+        return digest
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def make_renditions(path, names, db=None, store=None):
+    """
+    Returns {name: path} for the named renditions of the image file at `path`.
+    Renditions recorded in `db` whose files still exist are reused; the source
+    is decoded only if any are missing.
+    """
+    store = store or AssetStore()
+    digest = source_digest(path, store)
+    known = db.get_derivatives(digest) if db else {}
+    paths = {}
+    for name in names:
+        existing = known.get(RENDITIONS[name][0])
+        if existing and os.path.exists(existing):
+            paths[name] = existing
+    missing = [name for name in names if name not in paths]
+    if not missing:
+        return paths
+
+    made = {}
+    with Image.open(path) as source:
+        for name in missing:
+            key, render = RENDITIONS[name]
+            paths[name] = made[key] = render(source, digest, store)
+    if db:
+        db.save_derivatives(digest, made)
+    return paths
@@ -1,13 +1,153 @@
-from flask import Flask, render_template
+import hashlib
+import os
+import sys
+from datetime import datetime, timezone
+from flask import Flask, Response, abort, jsonify, make_response, render_template, request, send_file, url_for
+from werkzeug.http import is_resource_modified
 from state import StateDB
+from metrics import render_prometheus
+from thumbnails import get_thumbnail
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
 
 app = Flask(__name__)
+db = StateDB()
+
+
+def page_args():
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    return max(1, min(MAX_PAGE_SIZE, limit)), request.args.get("cursor") or None
+
+
+def with_thumbnails(records):
+    """Replaces local mockup paths with thumbnail URLs."""
+    store = AssetStore()
+    for record in records:
+        digest = store.digest_of(record.pop("mockup_path"))
+        # Mockups from before the asset store have no thumbnail; show the original
+        record["thumbnail_url"] = url_for("thumbnail", digest=digest) if digest else record["mockup_url"]
+    return records
+
+
+def get_page(limit, cursor):
+    try:
+        records, next_cursor = db.get_records_page(limit, cursor)
+    except (ValueError, TypeError, KeyError):
+        # Malformed base64/JSON, or JSON that is not a [published_at, title] pair
+        abort(400, "Invalid cursor")
+    return with_thumbnails(records), next_cursor
+
+
+def search_args():
+    limit, _ = page_args()
+    offset = max(0, request.args.get("offset", 0, type=int))
+    return request.args.get("q", "").strip(), request.args.get("tag") or None, limit, offset
+
+
+def run_search(query, tag, limit, offset):
+    found = db.search(query, tag=tag, limit=limit, offset=offset)
+    with_thumbnails(found["results"])
+    return found
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def conditional(render):
+    """
+    Answers 304 without running `render` when the client's copy is current.
+    The ETag comes from the published_products change counter, so a refresh
+    costs two small queries until something is published, updated or removed.
+    """
+    version, latest, count = db.records_version()
+    etag = hashlib.sha1(f"{version}|{count}|{request.full_path}".encode()).hexdigest()
+    last_modified = parse_timestamp(latest)
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Cache, but revalidate on every load
+    response.cache_control.no_cache = True
+    return response
+
 
 @app.route('/')
 def products():
-    db = StateDB()
-    products = db.get_all_records()  
-    return render_template('products.html', products=products)
+    limit, cursor = page_args()
+
+    def render():
+        products, next_cursor = get_page(limit, cursor)
+        next_url = None
+        if next_cursor:
+            next_url = url_for("products", cursor=next_cursor, limit=limit if limit != PAGE_SIZE else None)
+        return render_template('products.html', products=products, next_url=next_url,
+                               first_url=url_for("products") if cursor else None)
+
+    return conditional(render)
+
+
+@app.route('/api/products')
+def api_products():
+    limit, cursor = page_args()
+
+    def render():
+        products, next_cursor = get_page(limit, cursor)
+        return jsonify({"products": products, "next_cursor": next_cursor})
+
+    return conditional(render)
+
+
+@app.route('/search')
+def search():
+    query, tag, limit, offset = search_args()
+
+    def render():
+        found = run_search(query, tag, limit, offset)
+        next_url = None
+        if offset + limit < found["total"]:
+            next_url = url_for("search", q=query or None, tag=tag, offset=offset + limit,
+                               limit=limit if limit != PAGE_SIZE else None)
+        facet_urls = [
+            (facet, url_for("search", q=query or None, tag=None if facet["tag"] == tag else facet["tag"]))
+            for facet in found["facets"]
+        ]
+        return render_template('products.html', products=found["results"], next_url=next_url,
+                               first_url=url_for("products"), query=query, tag=tag, total=found["total"],
+                               facets=facet_urls)
+
+    return conditional(render)
+
+
+@app.route('/api/search')
+def api_search():
+    query, tag, limit, offset = search_args()
+    return conditional(lambda: jsonify(run_search(query, tag, limit, offset)))
+
+
+@app.route('/thumbnails/<digest>.jpg')
+def thumbnail(digest):
+    path = get_thumbnail(digest)
+    if path is None:
+        abort(404)
+    # The URL names the source's content hash, so the thumbnail never changes
+    return send_file(path, mimetype="image/jpeg", max_age=365 * 86400, conditional=True)
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(db), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(port=5001, debug=True)
@@ -0,0 +1,82 @@
+import time
+import uuid
+from contextlib import contextmanager
+from pipeline import SkipItem
+from state import DURATION_BUCKETS
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+@contextmanager
+def span(db, run_id, stage, items):
+    """
+    Times one stage call and writes a row per item to stage_timings. Items in a
+    batch stage share the batch's duration. The status is "skipped" for SkipItem,
+    "failed" for any other exception and "ok" otherwise; exceptions propagate.
+    """
+    started = time.time()
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield
+    except SkipItem as e:
+        status, error = "skipped", str(e)
+        raise
+    except Exception as e:
+        status, error = "failed", str(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        rows = []
+        for item in items:
+            # Batch stages may fail individual items without raising
+            if status == "ok" and item.get("status") in ("failed", "skipped"):
+                rows.append((run_id, item.get("title") or item.get("label") or "", stage, started, duration,
+                             item["status"], item.get("error")))
+            else:
+                rows.append((run_id, item.get("title") or item.get("label") or "", stage, started, duration, status, error))
+        try:
+            db.save_stage_timings(rows)
+        except Exception as e:
+            print(f"Could not record timing for stage {stage}: {e}")
+
+
+def timed(db, run_id, stage, fn):
+    """Wraps a pipeline stage function so every call is recorded with span()."""
+    def wrapper(arg):
+        items = arg if isinstance(arg, list) else [arg]
+        with span(db, run_id, stage, items):
+            return fn(arg)
+    return wrapper
+
+
+def render_prometheus(db):
+    """Prometheus text exposition of the stage counters and duration histograms in StateDB."""
+    stats = db.stage_timing_stats()
+    lines = [
+        "# HELP merch_stage_runs_total Pipeline stage executions by outcome.",
+        "# TYPE merch_stage_runs_total counter",
+    ]
+    for row in stats["runs"]:
+        lines.append(f'merch_stage_runs_total{{stage="{row["stage"]}",status="{row["status"]}"}} {row["count"]}')
+
+    lines += [
+        "# HELP merch_stage_duration_seconds Pipeline stage latency.",
+        "# TYPE merch_stage_duration_seconds histogram",
+    ]
+    for row in stats["durations"]:
+        stage = row["stage"]
+        for le, count in zip(DURATION_BUCKETS, row["buckets"]):
+            lines.append(f'merch_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+        lines.append(f'merch_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {row["count"]}')
+        lines.append(f'merch_stage_duration_seconds_sum{{stage="{stage}"}} {row["sum"]:.6f}')
+        lines.append(f'merch_stage_duration_seconds_count{{stage="{stage}"}} {row["count"]}')
+
+    lines += [
+        "# HELP merch_published_products Products recorded in the state DB.",
+        "# TYPE merch_published_products gauge",
+        f"merch_published_products {stats['published']}",
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,365 @@
+import argparse
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "mockup", "templates"))
+
+# Mirrors productConfig in mockup/server.js
+PRODUCT_CONFIG = {
+    "tshirt": {
+        "print_area": {"x": 0.25, "y": 0.35, "width": 0.5, "height": 0.35},
+    },
+    "cup": {
+        "print_area": {"x": 0.18, "y": 0.28, "width": 0.47, "height": 0.54},
+        # (bend top, bend bottom, horizontal bend) for a symmetrical vertical curve
+        "bend": (0.13, 0.15, 0),
+    },
+    "cap": {
+        "print_area": {"x": 0.35, "y": 0.3, "width": 0.3, "height": 0.25},
+        "bend": (0.05, 0.05, 0),
+    },
+}
+
+FLAT_DESIGN_ALPHA = 0.95
+
+# Colors that can be rendered without a dedicated template by tinting the white
+# one inside its product mask. Mirrors colorSwatches in mockup/server.js.
+COLOR_SWATCHES = {
+    "white": (255, 255, 255),
+    "black": (40, 40, 42),
+    "navy": (38, 52, 88),
+    "heather gray": (168, 168, 172),
+    "red": (182, 38, 44),
+    "forest green": (40, 88, 56),
+    "royal blue": (46, 84, 170),
+    "sand": (214, 196, 160),
+}
+MOCKUP_COLORS = [c.strip() for c in os.getenv("MOCKUP_COLORS", "white,black,navy,heather gray").split(",") if c.strip()]
+# Render threads shared by every caller of render_variants, so several mockup
+# stage workers don't each start their own pool
+MOCKUP_WORKERS = int(os.getenv("MOCKUP_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Tinted templates are full-size RGBA images (up to ~64 MB each). By default the
+# cache holds one per product type and configured color, so a mixed batch never
+# evicts a template it is about to need again.
+TINTED_TEMPLATE_CACHE = int(os.getenv("MOCKUP_TINTED_TEMPLATE_CACHE", "0")) or max(
+    1, len(PRODUCT_CONFIG) * len({c.lower() for c in MOCKUP_COLORS if c.lower() != "white"})
+)
+MASK_WIDTH = 1024
+# Each product now saves one PNG per color; level 3 encodes 4000px mockups about
+# twice as fast as the default 6 for files ~12% larger
+PNG_COMPRESS_LEVEL = 3
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+class MockupError(Exception):
+    pass
+
+
+def build_once(maxsize):
+    """
+    An LRU cache like functools.lru_cache, except that concurrent calls for the
+    same missing key wait for one build instead of each making their own copy.
+    """
+    def decorator(fn):
+        cache = OrderedDict()
+        building = {}
+        lock = threading.Lock()
+
+        @wraps(fn)
+        def wrapper(*key):
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+                key_lock = building.setdefault(key, threading.Lock())
+            with key_lock:
+                with lock:
+                    if key in cache:
+                        return cache[key]
+                try:
+                    value = fn(*key)
+                    with lock:
+                        cache[key] = value
+                        while len(cache) > maxsize:
+                            cache.popitem(last=False)
+                finally:
+                    with lock:
+                        building.pop(key, None)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def normalize(value):
+    return "".join(value.lower().split())
+
+
+def find_template_path(product_type, color):
+    normalized_color = f"-{normalize(color)}" if color else ""
+    template_path = os.path.join(TEMPLATES_DIR, f"{normalize(product_type)}{normalized_color}.png")
+    if os.path.exists(template_path):
+        return template_path
+    return None
+
+
+def mask_path(product_type):
+    return os.path.join(TEMPLATES_DIR, f"{normalize(product_type)}-mask.png")
+
+
+@build_once(maxsize=32)
+def load_template(template_path):
+    # Decoded once per process; callers must copy before drawing on it
+    image = Image.open(template_path).convert("RGBA")
+    image.load()
+    return image
+
+
+def build_mask(template, print_area, max_hole=0.003):
+    """
+    Segments the product in a white-product template photo: pixels that differ
+    from the border (background) color and are bright and near-neutral, keeping
+    the connected region under the print area and filling holes smaller than
+    `max_hole` of the image (highlights, not e.g. the gap inside a mug handle).
+    Returns an RGBA image (white, alpha = mask) MASK_WIDTH pixels wide.
+    """
+    small = template.convert("RGB").resize(
+        (MASK_WIDTH, round(MASK_WIDTH * template.height / template.width)), Image.BILINEAR
+    ).filter(ImageFilter.MedianFilter(3))
+    pixels = np.asarray(small).astype(np.int16)
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    # A flat studio background allows a tight threshold; textured ones need more
+    tolerance = min(18, max(6, 3 * float(border.std(axis=0).max())))
+    product = (
+        (np.abs(pixels - background).max(axis=-1) > tolerance)
+        & (pixels.mean(axis=-1) > 140)
+        & (pixels.max(axis=-1) - pixels.min(axis=-1) < 60)
+    )
+
+    mask = Image.fromarray((product * 255).astype(np.uint8))
+    mask = mask.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.MinFilter(5))
+    seed = (int(mask.width * (print_area["x"] + print_area["width"] / 2)),
+            int(mask.height * (print_area["y"] + print_area["height"] / 2)))
+    ImageDraw.floodfill(mask, seed, 128)
+    region = np.asarray(mask) == 128
+
+    # Everything reachable from outside without crossing the region is background;
+    # what is left are holes, filled one connected hole at a time if small enough
+    outside = Image.new("L", (mask.width + 2, mask.height + 2), 255)
+    outside.paste(Image.fromarray(np.where(region, 0, 255).astype(np.uint8)), (1, 1))
+    ImageDraw.floodfill(outside, (0, 0), 100)
+    filled = region.copy()
+    holes = outside.crop((1, 1, mask.width + 1, mask.height + 1))
+    while True:
+        remaining = np.argwhere(np.asarray(holes) == 255)
+        if not len(remaining):
+            break
+        y, x = remaining[0]
+        ImageDraw.floodfill(holes, (int(x), int(y)), 50)
+        hole = np.asarray(holes) == 50
+        if hole.sum() <= max_hole * hole.size:
+            filled |= hole
+        holes.paste(0, mask=Image.fromarray((hole * 255).astype(np.uint8)))
+
+    alpha = Image.fromarray((filled * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(1))
+    rgba = Image.new("RGBA", alpha.size, (255, 255, 255, 0))
+    rgba.putalpha(alpha)
+    return rgba
+
+
+@lru_cache(maxsize=8)
+def load_mask(product_type, size):
+    path = mask_path(product_type)
+    if not os.path.exists(path):
+        raise MockupError(f'No mask for product type "{product_type}"; run `python mockup_renderer.py masks`.')
+    return Image.open(path).getchannel("A").resize(size, Image.BILINEAR)
+
+
+@build_once(maxsize=TINTED_TEMPLATE_CACHE)
+def tinted_template(product_type, color):
+    """The white template multiplied by the color swatch inside the product mask."""
+    white_path = find_template_path(product_type, "white")
+    if not white_path:
+        raise MockupError(f'No white template to tint for product type "{product_type}".')
+    template = load_template(white_path)
+    mask = load_mask(normalize(product_type), template.size)
+    swatch = Image.new("RGBA", template.size, COLOR_SWATCHES[color.lower()] + (255,))
+    # Plain 8-bit Pillow ops: a float copy of a 4000px template would be ~250 MB
+    tinted = ImageChops.multiply(template, swatch)
+    tinted.putalpha(template.getchannel("A"))
+    return Image.composite(tinted, template, mask)
+
+
+def get_template(product_type, color):
+    """Decoded template for a product/color: a dedicated template file if there is one, else a tint."""
+    template_path = find_template_path(product_type, color)
+    if template_path:
+        return load_template(template_path)
+    if color and color.lower() in COLOR_SWATCHES:
+        return tinted_template(normalize(product_type), color.lower())
+    raise MockupError(f'No template found for product type "{product_type}" with color "{color}".')
+
+
+def fit_design(design, template_size, print_area):
+    """Returns the (x, y, width, height) box the design occupies, matching server.js."""
+    tw, th = template_size
+    area_w = tw * print_area["width"]
+    area_h = th * print_area["height"]
+    area_x = tw * print_area["x"]
+    area_y = th * print_area["y"]
+
+    design_ratio = design.width / design.height
+    if design_ratio > area_w / area_h:
+        width = area_w
+        height = width / design_ratio
+    else:
+        height = area_h
+        width = height * design_ratio
+
+    return area_x + (area_w - width) / 2, area_y + (area_h - height) / 2, width, height
+
+
+def bend_design(design, width, height, bend_top, bend_bottom, horizontal_bend):
+    """
+    Warps the design onto a curved surface with a single inverse remap. For each
+    destination column at position t (0..1) across the print area, the column is
+    pushed down by -(t^2 - t) * height * bend(t), where bend interpolates between
+    the top and bottom strengths, and sideways by sin(t * pi) * width * horizontal_bend.
+    This is the continuous form of drawTransformedDesign's strip loop.
+
+    Returns the warped RGBA layer and its (dx, dy) offset from the print box origin.
+    """
+    w, h = max(1, round(width)), max(1, round(height))
+    src = np.asarray(design.convert("RGBA").resize((w, h), Image.LANCZOS))
+
+    t = (np.arange(w) + 0.5) / w
+    bend = bend_top * (1 - t) + bend_bottom * t
+    offset_y = -(t * t - t) * h * bend
+    offset_x = np.sin(t * np.pi) * w * horizontal_bend
+
+    pad_x = int(np.ceil(np.abs(offset_x).max()))
+    pad_y = int(np.ceil(offset_y.max()))
+    out_w, out_h = w + 2 * pad_x, h + pad_y
+
+    # Destination grid relative to the unbent print box
+    u = np.arange(out_w) - pad_x
+    v = np.arange(out_h)
+    col_t = np.clip((u + 0.5) / w, 0, 1)
+    col_bend = bend_top * (1 - col_t) + bend_bottom * col_t
+    src_x = np.floor(u - np.sin(col_t * np.pi) * w * horizontal_bend).astype(np.int64)
+    src_y = np.floor(v[:, None] + (col_t * col_t - col_t) * h * col_bend).astype(np.int64)
+    src_x = np.broadcast_to(src_x[None, :], src_y.shape)
+
+    valid = (src_x >= 0) & (src_x < w) & (src_y >= 0) & (src_y < h)
+    out = np.zeros((out_h, out_w, 4), dtype=np.uint8)
+    out[valid] = src[src_y[valid], src_x[valid]]
+    return Image.fromarray(out, "RGBA"), (-pad_x, 0)
+
+
+def render_mockup(design, product_type, color="white"):
+    """
+    Renders `design` (a PIL image or a path) onto the product template and
+    returns the mockup as an RGBA PIL image.
+    """
+    config = PRODUCT_CONFIG.get(normalize(product_type))
+    if not config:
+        raise MockupError(f'Product type "{product_type}" is not supported in the configuration.')
+
+    template = get_template(product_type, color)
+
+    if not isinstance(design, Image.Image):
+        design = Image.open(design)
+    design = design.convert("RGBA")
+
+    canvas = template.copy()
+    x, y, width, height = fit_design(design, canvas.size, config["print_area"])
+
+    if "bend" in config:
+        layer, (dx, dy) = bend_design(design, width, height, *config["bend"])
+    else:
+        layer = design.resize((max(1, round(width)), max(1, round(height))), Image.LANCZOS)
+        alpha = layer.getchannel("A").point(lambda a: int(a * FLAT_DESIGN_ALPHA))
+        layer.putalpha(alpha)
+        dx, dy = 0, 0
+
+    canvas.alpha_composite(layer, (round(x) + dx, round(y) + dy))
+    return canvas
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=max(1, MOCKUP_WORKERS), thread_name_prefix="mockup-render")
+        return _render_pool
+
+
+def render_variants(design, variants, store=None):
+    """
+    Renders one design onto several (product_type, color) variants. The design
+    is decoded once and the variants render in parallel on the shared render
+    pool (resizing, the warp, compositing and PNG encoding release the GIL).
+    Returns one dict per variant, in order, with either "image" or "error";
+    with `store` each rendered variant is saved there and returned as "path"
+    instead, so its canvas is freed as soon as it is encoded.
+    """
+    if not isinstance(design, Image.Image):
+        design = Image.open(design)
+    design = design.convert("RGBA")
+
+    def render(variant):
+        product_type, color = variant
+        result = {"product_type": product_type, "color": color}
+        try:
+            image = render_mockup(design, product_type, color)
+            if store is None:
+                result["image"] = image
+            else:
+                result["path"] = save_mockup(image, store)
+        except MockupError as e:
+            result["error"] = str(e)
+        return result
+
+    return list(get_render_pool().map(render, variants))
+
+
+def save_mockup(image, store=None):
+    return (store or AssetStore()).put_image(image, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+
+def write_masks(force=False):
+    # Generated masks are a starting point and may be touched up by hand (the cup
+    # mask has its table reflection erased), so existing ones are kept by default
+    for product_type, config in PRODUCT_CONFIG.items():
+        template_path = find_template_path(product_type, "white")
+        if not template_path:
+            print(f"Skipping {product_type}: no white template")
+            continue
+        if os.path.exists(mask_path(product_type)) and not force:
+            print(f"Keeping {mask_path(product_type)} (use --force to rebuild)")
+            continue
+        build_mask(load_template(template_path), config["print_area"]).save(mask_path(product_type))
+        print(f"Wrote {mask_path(product_type)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mockup template tools.")
+    parser.add_argument("command", choices=["masks"], help="masks: rebuild the product masks used for color tinting")
+    parser.add_argument("--force", action="store_true", help="overwrite existing masks")
+    args = parser.parse_args()
+    write_masks(force=args.force)
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+
+class SkipItem(Exception):
+    """Raised by a stage to drop an item without counting it as a failure."""
+
+
+class StageError(Exception):
+    """Raised by a stage when the item cannot continue through the pipeline."""
+
+
+class Stage:
+    """
+    A named pipeline step. With `batch_size` > 1 the stage function receives a
+    list of up to that many items instead of a single item; a worker waits at
+    most `batch_wait` seconds for a batch to fill before running what it has.
+    """
+
+    def __init__(self, name, fn, concurrency=1, batch_size=1, batch_wait=0.5):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = batch_wait
+
+    def take(self, q):
+        """Returns (items, done) where done means the stage's input is exhausted."""
+        item = q.get()
+        if item is None:
+            return [], True
+        items = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(items) < self.batch_size:
+            try:
+                item = q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                return items, True
+            items.append(item)
+        return items, False
+
+
+class PipelineResult:
+    def __init__(self, items, stage_names, elapsed):
+        self.items = sorted(items, key=lambda item: item["id"])
+        self.stage_names = stage_names
+        self.elapsed = elapsed
+
+    def count(self, status):
+        return sum(1 for item in self.items if item["status"] == status)
+
+    @property
+    def throughput(self):
+        # Completed items per minute of wall time
+        if self.elapsed <= 0:
+            return 0.0
+        return self.count("ok") * 60.0 / self.elapsed
+
+    def summary(self):
+        lines = [
+            f"Batch finished in {self.elapsed:.1f}s: "
+            f"{self.count('ok')} ok, {self.count('skipped')} skipped, {self.count('failed')} failed "
+            f"({self.throughput:.2f} products/min)"
+        ]
+        for name in self.stage_names:
+            durations = [item["timings"][name] for item in self.items if name in item["timings"]]
+            if durations:
+                avg = sum(durations) / len(durations)
+                lines.append(f"  {name:<10} runs={len(durations):<4} avg={avg:.2f}s max={max(durations):.2f}s")
+        for item in self.items:
+            if item["status"] == "ok":
+                detail = item.get("title") or ""
+            else:
+                detail = f"{item['stage']}: {item['error']}"
+            lines.append(f"  [{item['label']}] {item['status']:<7} {detail}")
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """
+    Runs items through a fixed list of stages. Every stage has its own pool of
+    worker threads and a bounded queue in front of it, so different items can
+    occupy different stages at the same time.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, items):
+        stages = self.stages
+        queues = [queue.Queue(maxsize=stage.concurrency * max(2, stage.batch_size)) for stage in stages]
+        finished = []
+        finished_lock = threading.Lock()
+        remaining = [stage.concurrency for stage in stages]
+        remaining_lock = threading.Lock()
+
+        def finish(item, status, stage_name=None, error=None):
+            item["status"] = status
+            item["stage"] = stage_name
+            item["error"] = error
+            with finished_lock:
+                finished.append(item)
+
+        def worker(index):
+            stage = stages[index]
+            done = False
+            while not done:
+                batch, done = stage.take(queues[index])
+                if not batch:
+                    continue
+                start = time.perf_counter()
+                try:
+                    stage.fn(batch if stage.batch_size > 1 else batch[0])
+                except SkipItem as e:
+                    failed = ("skipped", str(e))
+                except StageError as e:
+                    failed = ("failed", str(e))
+                except Exception as e:
+                    failed = ("failed", f"Unexpected error: {e}")
+                else:
+                    failed = None
+                elapsed = time.perf_counter() - start
+
+                for item in batch:
+                    item["timings"][stage.name] = elapsed
+                    if failed:
+                        finish(item, failed[0], stage.name, failed[1])
+                    elif item.get("status") in ("skipped", "failed"):
+                        # Batch stages mark individual items instead of raising
+                        finish(item, item["status"], stage.name, item.get("error"))
+                    elif index + 1 < len(stages):
+                        queues[index + 1].put(item)
+                    else:
+                        finish(item, "ok")
+
+            # The last worker of a stage to shut down closes the next stage
+            with remaining_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and index + 1 < len(stages):
+                for _ in range(stages[index + 1].concurrency):
+                    queues[index + 1].put(None)
+
+        threads = []
+        for index, stage in enumerate(stages):
+            for n in range(stage.concurrency):
+                t = threading.Thread(target=worker, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        started = time.perf_counter()
+        for item in items:
+            item.setdefault("timings", {})
+            queues[0].put(item)
+        for _ in range(stages[0].concurrency):
+            queues[0].put(None)
+
+        for t in threads:
+            t.join()
+
+        return PipelineResult(finished, [stage.name for stage in stages], time.perf_counter() - started)
@@ -0,0 +1,345 @@
+"""
+Opt-in profiling of pipeline runs. Enabled with PIPELINE_PROFILE=1 or
+--profile (run.py and python -m orchestrator run/batch/resume); each run
+then writes to PROFILE_DIR/<run id>/:
+
+    <stage>.pstats       cProfile stats of every call of the stage and of the
+                         thread pool tasks it submitted, merged
+    <stage>.collapsed    sampled stacks of the threads working for the stage,
+                         in collapsed format (flamegraph.pl, speedscope)
+    <stage>.memory.txt   largest allocation sites (process-wide) when the
+                         stage's traced memory was highest
+    summary.json         calls, wall time, peak traced memory, top functions
+
+Stage profiles are exact on Python 3.11 and earlier. From 3.12, cProfile can
+only run in one thread at a time, so concurrent calls and tasks go unprofiled
+(counted as unprofiled_calls); the sampled stacks still cover them.
+tracemalloc slows code that allocates many small objects down a lot (less
+with a smaller PROFILE_TRACE_FRAMES), so compare profiles with each other
+rather than with unprofiled timings.
+
+    python -m orchestrator profile                     # list profiles
+    python -m orchestrator profile <run id>            # one profile
+    python -m orchestrator profile <run id> <run id>   # what changed
+"""
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+PROFILE_ENABLED = os.getenv("PIPELINE_PROFILE", "0") not in ("", "0")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+# Seconds between stack and memory samples
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+# Frames kept per traced allocation; tracemalloc's overhead grows with it
+TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "5"))
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+# A stage's memory snapshot is retaken only when its traced memory grew by both
+SNAPSHOT_GROWTH = 1.1
+SNAPSHOT_MIN_BYTES = 16 * 1024 * 1024
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def function_label(key):
+    filename, line, name = key
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class Profiler:
+    """
+    Profiles every call of the wrapped stage functions, including work they
+    hand to thread pools: while profiling, ThreadPoolExecutor.submit from
+    inside a stage runs the task as part of that stage. Each call and task
+    gets its own cProfile.Profile, merged into the stage's stats when it
+    returns. A sampler thread records the stack of every thread working for a
+    stage, and the peak traced memory since the previous sample, which is
+    charged to every stage that ran during that interval.
+    """
+
+    def __init__(self, run_id, root=PROFILE_DIR, interval=SAMPLE_INTERVAL):
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.sampler = None
+        self.started = None
+        self.submit = None
+        self.stats = {}
+        self.calls = Counter()
+        self.tasks = Counter()
+        self.unprofiled = Counter()
+        self.wall = defaultdict(float)
+        # Thread ident -> stage, for threads currently running a stage call or task
+        self.active = {}
+        # Stages that ran at some point since the last sample
+        self.window = set()
+        self.stacks = defaultdict(Counter)
+        self.peaks = Counter()
+        # Stage -> (traced bytes, tracemalloc snapshot) at its highest sample
+        self.snapshots = {}
+
+    def start(self):
+        self.started = time.time()
+        tracemalloc.start(TRACE_FRAMES)
+        self.submit = ThreadPoolExecutor.submit
+        profiler = self
+
+        def submit(executor, fn, /, *args, **kwargs):
+            stage = profiler.active.get(threading.get_ident())
+            if stage is None:
+                return profiler.submit(executor, fn, *args, **kwargs)
+            return profiler.submit(executor, profiler.run, stage, fn, args, kwargs, task=True)
+
+        ThreadPoolExecutor.submit = submit
+        self.sampler = threading.Thread(target=self.sample, name="profile-sampler", daemon=True)
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        """Stops sampling and writes the profile; returns its directory."""
+        ThreadPoolExecutor.submit = self.submit
+        self.stopping.set()
+        self.sampler.join()
+        tracemalloc.stop()
+        self.write(time.time() - self.started)
+        return self.path
+
+    def wrap(self, stage, fn):
+        def wrapper(arg):
+            return self.run(stage, fn, (arg,), {})
+        return wrapper
+
+    def run(self, stage, fn, args, kwargs, task=False):
+        ident = threading.get_ident()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: another thread's profiler is active
+            profile = None
+        with self.lock:
+            self.active[ident] = stage
+            self.window.add(stage)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profile:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            stats = pstats.Stats(profile) if profile else None
+            with self.lock:
+                del self.active[ident]
+                if task:
+                    self.tasks[stage] += 1
+                else:
+                    self.calls[stage] += 1
+                    self.wall[stage] += elapsed
+                if stats is None:
+                    self.unprofiled[stage] += 1
+                elif stage in self.stats:
+                    self.stats[stage].add(stats)
+                else:
+                    self.stats[stage] = stats
+
+    def collapse(self, frame):
+        """Semicolon-joined stack from the stage function or task down to `frame`."""
+        labels = []
+        while frame is not None and frame.f_code is not Profiler.run.__code__:
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def sample(self):
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            with self.lock:
+                active = dict(self.active)
+                window = self.window | set(active.values())
+                self.window = set(active.values())
+
+            for ident, stage in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[stage][self.collapse(frame)] += 1
+            for stage in window:
+                self.peaks[stage] = max(self.peaks[stage], peak)
+
+            grown = []
+            for stage in set(active.values()):
+                traced = self.snapshots.get(stage, (0, None))[0]
+                if current > traced * SNAPSHOT_GROWTH and current - traced > SNAPSHOT_MIN_BYTES:
+                    grown.append(stage)
+            if grown:
+                # Taking a snapshot is cheap; grouping its traces is not, so that waits for write()
+                snapshot = tracemalloc.take_snapshot()
+                for stage in grown:
+                    self.snapshots[stage] = (current, snapshot)
+
+    def write(self, duration):
+        os.makedirs(self.path, exist_ok=True)
+        tops = {}
+        stages = {}
+        for stage in sorted(self.calls, key=lambda s: -self.wall[s]):
+            stats = self.stats.get(stage)
+            if stats:
+                stats.dump_stats(os.path.join(self.path, f"{stage}.pstats"))
+            with open(os.path.join(self.path, f"{stage}.collapsed"), "w") as f:
+                for stack, count in self.stacks[stage].most_common():
+                    f.write(f"{stack} {count}\n")
+
+            allocations = []
+            traced, snapshot = self.snapshots.get(stage, (0, None))
+            if snapshot is not None and id(snapshot) not in tops:
+                tops[id(snapshot)] = snapshot.filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                ]).statistics("traceback")[:TOP_ALLOCATIONS]
+            with open(os.path.join(self.path, f"{stage}.memory.txt"), "w") as f:
+                f.write(f"{stage}: {traced / 1024 / 1024:.1f} MB traced at the highest sample\n")
+                for stat in tops.get(id(snapshot), []):
+                    f.write(f"\n{stat.size / 1024 / 1024:.1f} MB in {stat.count} blocks\n")
+                    f.write("\n".join(f"  {line}" for line in stat.traceback.format(most_recent_first=True)) + "\n")
+                    frame = stat.traceback[-1]
+                    allocations.append({"site": f"{frame.filename}:{frame.lineno}", "bytes": stat.size, "blocks": stat.count})
+
+            functions = []
+            if stats:
+                rows = sorted(stats.stats.items(), key=lambda kv: -kv[1][2])[:TOP_FUNCTIONS]
+                functions = [
+                    {"function": function_label(key), "calls": nc, "tottime": tt, "cumtime": ct}
+                    for key, (cc, nc, tt, ct, callers) in rows
+                ]
+            stages[stage] = {
+                "calls": self.calls[stage],
+                "tasks": self.tasks[stage],
+                "unprofiled_calls": self.unprofiled[stage],
+                "wall_seconds": self.wall[stage],
+                "samples": sum(self.stacks[stage].values()),
+                "peak_traced_bytes": self.peaks[stage],
+                "top_functions": functions,
+                "top_allocations": allocations,
+            }
+        self.snapshots.clear()
+
+        summary = {
+            "run_id": self.run_id,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "duration_seconds": duration,
+            "python": platform.python_version(),
+            "sample_interval": self.interval,
+            "stages": stages,
+        }
+        with open(os.path.join(self.path, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+@contextmanager
+def profile_run(run_id, enabled=None):
+    """Yields a started Profiler when profiling is enabled (else None) and writes it on exit."""
+    if not (PROFILE_ENABLED if enabled is None else enabled):
+        yield None
+        return
+    profiler = Profiler(run_id).start()
+    try:
+        yield profiler
+    finally:
+        print(f"Profile written to {profiler.stop()}")
+
+
+def resolve_profile(name, root=PROFILE_DIR):
+    path = name if os.path.isdir(name) else os.path.join(root, name)
+    if not os.path.isfile(os.path.join(path, "summary.json")):
+        raise FileNotFoundError(f"No profile at {path}")
+    return path
+
+
+def list_profiles(root=PROFILE_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isfile(os.path.join(root, name, "summary.json")))
+
+
+def load_summary(path):
+    with open(os.path.join(path, "summary.json")) as f:
+        return json.load(f)
+
+
+def megabytes(n):
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+def format_profile(path, top=10):
+    summary = load_summary(path)
+    lines = [f"Profile {summary['run_id']} ({summary['started_at']}, {summary['duration_seconds']:.1f}s, "
+             f"Python {summary['python']})"]
+    for stage, row in summary["stages"].items():
+        unprofiled = f", {row['unprofiled_calls']} unprofiled" if row["unprofiled_calls"] else ""
+        tasks = f", {row['tasks']} pool tasks" if row["tasks"] else ""
+        lines.append(f"\n{stage}: {row['calls']} calls{tasks}{unprofiled}, {row['wall_seconds']:.2f}s wall, "
+                     f"peak {megabytes(row['peak_traced_bytes'])} traced")
+        for fn in row["top_functions"][:top]:
+            lines.append(f"  {fn['tottime']:8.3f}s self {fn['cumtime']:8.3f}s cum  {fn['function']}")
+        for alloc in row["top_allocations"][:3]:
+            lines.append(f"  {megabytes(alloc['bytes']):>9} at {alloc['site']}")
+    return "\n".join(lines)
+
+
+def per_call_times(path, stage, calls):
+    """Self time per stage call of every function in a stage's pstats file."""
+    stats_path = os.path.join(path, f"{stage}.pstats")
+    if not calls or not os.path.isfile(stats_path):
+        return {}
+    stats = pstats.Stats(stats_path).stats
+    return {function_label(key): tt / calls for key, (cc, nc, tt, ct, callers) in stats.items()}
+
+
+def diff_profiles(before_path, after_path, top=10):
+    """
+    Compares two profiles stage by stage: wall time and self time per stage
+    call, so runs of different batch sizes compare, and peak traced memory.
+    """
+    before, after = load_summary(before_path), load_summary(after_path)
+    lines = [f"{before['run_id']} -> {after['run_id']} (per stage call)"]
+    for stage in list(dict.fromkeys([*after["stages"], *before["stages"]])):
+        a = before["stages"].get(stage)
+        b = after["stages"].get(stage)
+        if not a or not b:
+            lines.append(f"\n{stage}: only in {after['run_id'] if b else before['run_id']}")
+            continue
+        wall_a, wall_b = a["wall_seconds"] / a["calls"], b["wall_seconds"] / b["calls"]
+        change = f" ({(wall_b - wall_a) / wall_a:+.0%})" if wall_a else ""
+        peak = b["peak_traced_bytes"] - a["peak_traced_bytes"]
+        lines.append(f"\n{stage}: {wall_a:.3f}s -> {wall_b:.3f}s{change}, peak "
+                     f"{megabytes(a['peak_traced_bytes'])} -> {megabytes(b['peak_traced_bytes'])} "
+                     f"({'+' if peak >= 0 else '-'}{megabytes(abs(peak))})")
+
+        times_a = per_call_times(before_path, stage, a["calls"])
+        times_b = per_call_times(after_path, stage, b["calls"])
+        deltas = sorted(
+            ((times_b.get(fn, 0.0) - times_a.get(fn, 0.0), fn) for fn in times_a.keys() | times_b.keys()),
+            key=lambda d: -abs(d[0]),
+        )
+        for delta, fn in deltas[:top]:
+            if abs(delta) < 0.0005:
+                break
+            lines.append(f"  {delta * 1000:+9.1f} ms  {times_a.get(fn, 0.0) * 1000:8.1f} -> "
+                         f"{times_b.get(fn, 0.0) * 1000:8.1f} ms  {fn}")
+    return "\n".join(lines)
@@ -1,21 +1,144 @@
-import requests
+import argparse
 import json
 import os
+import socket
+import sys
+import threading
 import time
+from functools import partial
 from state import StateDB
-from shopify_client import publish_to_shopify
-from requests.exceptions import HTTPError, ConnectionError, Timeout
+from shopify_client import publish_many
+from shopify_sync import sync_if_configured
+from pipeline import Pipeline, Stage, SkipItem, StageError
+from captioning import caption_images, CAPTION_BATCH_SIZE
+from mockup_renderer import render_variants, MockupError, MOCKUP_COLORS
+from derivatives import make_renditions
+from metrics import new_run_id, timed
+from profiling import profile_run
+from similarity import (
+    dhash, normalize_tokens, tag_tokens, similarity_score, hamming, TITLE_THRESHOLD, DESIGN_MAX_DISTANCE,
+)
+from requests.exceptions import HTTPError, ConnectionError, Timeout, RequestException
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+from common.transport import get_client
 
-from transformers import BlipProcessor, BlipForConditionalGeneration
-from PIL import Image
-from io import BytesIO
 
+GENERATOR_URL = os.getenv("GENERATOR_URL", "http://localhost:8001/generate")
+GENERATOR_BATCH_URL = os.getenv("GENERATOR_BATCH_URL", "http://localhost:8001/generate/batch")
+GENERATOR_IMAGE_URL = os.getenv("GENERATOR_IMAGE_URL", "http://localhost:8001/generate/image")
+MOCKUP_BATCH_URL = os.getenv("MOCKUP_BATCH_URL", "http://localhost:3000/mockup/batch")
+PUBLISHER_URL = os.getenv("PUBLISHER_URL", "http://localhost:8000/api.php")
 
+# (connect, read) timeouts per downstream service. Generation and mockup reads are
+# slow; the batch stream's read timeout applies between NDJSON lines. Mockups and
+# publishes are idempotent (content-addressed, unique titles), so they may be
+# retried after a timeout; paid generation calls only after connection failures.
+generator_client = get_client("generator", timeout=(3.05, 120))
+mockup_client = get_client("mockup", timeout=(3.05, 60), retry_unsafe=True)
+publisher_client = get_client("publisher", timeout=(3.05, 15), retry_unsafe=True)
 
-GENERATOR_URL = "http://localhost:8001/generate"  
-MOCKUP_URL = "http://localhost:3000/mockup"
-PUBLISHER_URL = "http://localhost:8000/api.php"
+# Listings requested per /generate/batch call when streaming products in batch mode
+GENERATOR_BATCH_SIZE = int(os.getenv("GENERATOR_BATCH_SIZE", "10"))
+SHOPIFY_BATCH_SIZE = int(os.getenv("SHOPIFY_BATCH_SIZE", "8"))
+# Incrementally sync the local mirror of the Shopify catalog before each run
+SHOPIFY_SYNC_ON_RUN = os.getenv("SHOPIFY_SYNC_ON_RUN", "1") != "0"
+
+# "local" renders mockups in-process with mockup_renderer, "http" calls mockup/server.js
+MOCKUP_MODE = os.getenv("MOCKUP_MODE", "local")
+
+# Per-stage worker counts used by batch mode. BLIP runs on a single shared model,
+# so captioning stays serial unless explicitly overridden.
+STAGE_CONCURRENCY = {
+    "generate": 4,
+    "design": 4,
+    "mockup": 2,
+    "derivatives": 2,
+    "caption": 1,
+    "publish": 4,
+    "shopify": 1,
+}
+
+# Item fields saved as job checkpoints after each stage
+CHECKPOINT_FIELDS = (
+    "product", "title", "abs_path", "design_hash", "mockup_path_abs", "variant_mockups", "renditions", "caption",
+    "fake_id", "shopify_id",
+)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
+
+_db = None
+
+def get_db():
+    # StateDB pools its connections, so one instance is shared by every worker
+    global _db
+    if _db is None:
+        _db = StateDB()
+    return _db
+
+
+class RunClaims:
+    """
+    Titles and design hashes taken by items still in flight in one run, which
+    the published-product indexes don't know about yet. Each run gets its own;
+    an item's claims are released if it fails or is skipped.
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self.designs = {}
+        self.lock = threading.Lock()
+
+    def claim_title(self, item, title, tags):
+        """Returns the in-flight title `title` duplicates, or None after claiming it for `item`."""
+        tokens, tag_set = normalize_tokens(title), tag_tokens(tags)
+        with self.lock:
+            for other, (other_tokens, other_tags, _) in self.titles.items():
+                if other == title or similarity_score(tokens, tag_set, other_tokens, other_tags) >= TITLE_THRESHOLD:
+                    return other
+            self.titles[title] = (tokens, tag_set, item)
+            return None
+
+    def claim_design(self, item, title, design_hash):
+        with self.lock:
+            for other, (other_hash, _) in self.designs.items():
+                if hamming(design_hash, other_hash) <= DESIGN_MAX_DISTANCE:
+                    return other
+            self.designs[title] = (design_hash, item)
+            return None
+
+    def release(self, item):
+        with self.lock:
+            for claims in (self.titles, self.designs):
+                for title in [title for title, value in claims.items() if value[-1] is item]:
+                    del claims[title]
+
+    def releasing(self, fn):
+        """Wraps a stage so the claims of items it fails or skips are released."""
+        def wrapper(arg):
+            items = arg if isinstance(arg, list) else [arg]
+            try:
+                fn(arg)
+            except Exception:
+                for item in items:
+                    self.release(item)
+                raise
+            for item in items:
+                if item.get("status") in ("failed", "skipped"):
+                    self.release(item)
+        return wrapper
+
+
+def log(item, message):
+    label = item.get("label")
+    print(f"[{label}] {message}" if label else message)
+
+def fail(item, message):
+    log(item, message)
+    raise StageError(message)
 
 def print_api_error(response):
     try:
@@ -25,153 +148,509 @@ def print_api_error(response):
         print(f"API error response: {error_message}")
     except Exception:
         print(f"API returned HTTP {response.status_code} {response.reason} but no JSON error message.")
-# Load model once globally 
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-
-def generate_image_caption(image_path_or_url: str) -> str:
-    try:
-        if image_path_or_url.startswith("http"):
-            response = requests.get(image_path_or_url)
-            image = Image.open(BytesIO(response.content)).convert('RGB')
-        else:
-            image = Image.open(image_path_or_url).convert('RGB')
-    except Exception as e:
-        print(f"Error loading image for captioning: {e}")
-        return ""
-
-    inputs = processor(image, return_tensors="pt")
-    out = model.generate(**inputs)
-    caption = processor.decode(out[0], skip_special_tokens=True)
-    return caption
 
+def iter_generated_products(count):
+    """
+    Streams up to `count` products from the generator's NDJSON batch endpoint,
+    GENERATOR_BATCH_SIZE listings per request. Products are yielded as soon as
+    their line arrives, so downstream stages start before the batch finishes.
+    """
+    produced = 0
+    while produced < count:
+        n = min(GENERATOR_BATCH_SIZE, count - produced)
+        received = 0
+        try:
+            # Images are requested per product by the design stage, after the duplicate check
+            with generator_client.post(GENERATOR_BATCH_URL, params={"n": n, "images": "false"}, stream=True) as r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if line:
+                        received += 1
+                        yield json.loads(line)
+        except (RequestException, ValueError) as e:
+            print(f"Error streaming products from the generator: {e}")
+            return
+        if received == 0:
+            print("Generator batch returned no products.")
+            return
+        produced += received
 
-def main(run_once=True):
-    db = StateDB()
 
-    print("Starting orchestrator run...")
+def generate_stage(item, claims):
+    if item.get("product"):
+        # Already streamed in from the batch endpoint
+        return dedupe_product(item, item["product"], claims)
 
-    # Step 1: Call generator
-    print("Requesting product generation...")
+    log(item, "Requesting product generation...")
     try:
-        r = requests.post(GENERATOR_URL)
+        r = generator_client.post(GENERATOR_URL, params={"images": "false"})
         r.raise_for_status()
         product = r.json()
     except ConnectionError:
-        print("Error generating product: Could not connect to the generation service. Is the server running?")
-        return
+        fail(item, "Error generating product: Could not connect to the generation service. Is the server running?")
     except HTTPError as e:
         if e.response.status_code == 401:
-            print("Error generating product: Unauthorized. Check your API token or credentials.")
+            fail(item, "Error generating product: Unauthorized. Check your API token or credentials.")
         elif e.response.status_code == 429:
-            print("Error generating product: Rate limit exceeded. Try again later.")
+            fail(item, "Error generating product: Rate limit exceeded. Try again later.")
         else:
-            print(f"HTTP error during product generation: {e.response.status_code} - {e.response.reason}")
-        return
+            fail(item, f"HTTP error during product generation: {e.response.status_code} - {e.response.reason}")
     except Timeout:
-        print("Error generating product: Request timed out. Try again later.")
-        return
+        fail(item, "Error generating product: Request timed out. Try again later.")
     except Exception as e:
-        print(f"Unexpected error generating product: {e}")
-        return
+        fail(item, f"Unexpected error generating product: {e}")
+
+    dedupe_product(item, product, claims)
+
 
+def dedupe_product(item, product, claims):
+    # Runs before any image is generated, so duplicates cost only their share of the LLM call
     title = product.get("title")
-    if db.is_published(title):
-        print(f"Product '{title}' already published. Skipping.")
+    tags = product.get("tags", [])
+    if get_db().is_published(title):
+        log(item, f"Product '{title}' already published. Skipping.")
+        raise SkipItem(f"'{title}' already published")
+    if get_db().find_shopify_product(title):
+        # Created outside the pipeline, or by a run whose state.db was lost
+        log(item, f"Product '{title}' already exists in the Shopify store. Skipping.")
+        raise SkipItem(f"'{title}' already in the Shopify store")
+    similar = get_db().find_similar_titles(title, tags)
+    if similar:
+        other, score = similar[0]
+        log(item, f"Product '{title}' looks like published '{other}' ({score:.2f}). Skipping.")
+        raise SkipItem(f"'{title}' similar to '{other}'")
+    other = claims.claim_title(item, title, tags)
+    if other:
+        log(item, f"Product '{title}' duplicates '{other}' in this run. Skipping.")
+        raise SkipItem(f"'{title}' duplicates '{other}'")
+
+    log(item, f"Generated product: {title}")
+    item["product"] = product
+    item["title"] = title
+
+
+def request_image(item, image_prompt):
+    log(item, "Requesting design image...")
+    try:
+        r = generator_client.post(GENERATOR_IMAGE_URL, json={"image_prompt": image_prompt})
+        r.raise_for_status()
+        return r.json()["image_path"]
+    except ConnectionError:
+        fail(item, "Error generating image: Could not connect to the generation service. Is the server running?")
+    except HTTPError as e:
+        fail(item, f"HTTP error during image generation: {e.response.status_code} - {e.response.reason}")
+    except Timeout:
+        fail(item, "Error generating image: Request timed out. Try again later.")
+    except Exception as e:
+        fail(item, f"Unexpected error generating image: {e}")
+
+
+def design_stage(item, claims):
+    product = item["product"]
+    if not product.get("image_path"):
+        product["image_path"] = request_image(item, product.get("image_prompt") or product.get("title", ""))
+
+    image_path = product["image_path"]
+    if os.path.isfile(image_path):
+        abs_path = os.path.abspath(image_path)
+    else:
+        # Build correct absolute path relative to orchestrator dir
+        abs_path = os.path.abspath(os.path.join(orchestrator_dir, "..", "demo_assets", os.path.basename(image_path)))
+    item["abs_path"] = abs_path
+
+    # The demo fallback image is shared by every product, so only real generations are compared
+    if not AssetStore().contains(abs_path):
         return
+    try:
+        design_hash = dhash(abs_path)
+    except OSError as e:
+        fail(item, f"Error reading design image: {e}")
+    similar = get_db().find_similar_designs(design_hash)
+    if similar:
+        other, distance = similar[0]
+        log(item, f"Design matches published '{other}' ({distance} bits apart). Skipping.")
+        raise SkipItem(f"design similar to '{other}'")
+    other = claims.claim_design(item, item["title"], design_hash)
+    if other:
+        log(item, f"Design matches '{other}' in this run. Skipping.")
+        raise SkipItem(f"design duplicates '{other}'")
+    item["design_hash"] = design_hash
+
 
-    print(f"Generated product: {title}")
+def variant_colors():
+    # White comes first: it is the primary mockup used for captioning and publishing
+    return ["white"] + [color for color in MOCKUP_COLORS if color.lower() != "white"]
 
-    # Step 2: Call mockup API
-    print("Calling mockup API...")
+
+def mockup_stage(item):
+    product = item["product"]
     pt = product.get("product_type", "").lower().replace("-", "")
-    # Build correct absolute path relative to orchestrator dir
-    image_path = product.get("image_path", "")
-    orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
-    abs_path = os.path.abspath(os.path.join(orchestrator_dir, "..", "demo_assets", os.path.basename(image_path)))
+    abs_path = item["abs_path"]
+    colors = variant_colors()
+
+    if MOCKUP_MODE == "local":
+        log(item, f"Rendering {len(colors)} mockup variants...")
+        try:
+            results = render_variants(abs_path, [(pt, color) for color in colors], store=AssetStore())
+        except (MockupError, OSError) as e:
+            fail(item, f"Error during mockup: {e}")
+        if "error" in results[0]:
+            fail(item, f"Error during mockup: {results[0]['error']}")
+        item["mockup_path_abs"] = results[0]["path"]
+        set_variant_mockups(item, results)
+        return
 
+    log(item, f"Calling mockup API for {len(colors)} variants...")
     mockup_payload = {
         "image_url": abs_path,
-        "product_type": pt,
-        "color": "white"
+        "variants": [{"product_type": pt, "color": color} for color in colors],
     }
 
     try:
-        r = requests.post(MOCKUP_URL, json=mockup_payload)
+        r = mockup_client.post(MOCKUP_BATCH_URL, json=mockup_payload)
         r.raise_for_status()
-        mockup_response = r.json()
+        results = r.json()["mockups"]
     except HTTPError as e:
-        print(f"HTTP error during mockup: {e}")
+        log(item, f"HTTP error during mockup: {e}")
         if e.response is not None:
             print_api_error(e.response)
-        return
+        raise StageError(f"HTTP error during mockup: {e}")
     except ConnectionError:
-        print("Error during mockup: Could not connect to the mockup server. Is it running?")
-        return
+        fail(item, "Error during mockup: Could not connect to the mockup server. Is it running?")
     except Timeout:
-        print("Error during mockup: Request timed out.")
-        return
+        fail(item, "Error during mockup: Request timed out.")
     except Exception as e:
-        print(f"Error during mockup: {e}")
-        return
+        fail(item, f"Error during mockup: {e}")
+
+    primary = results[0]
+    if primary.get("error"):
+        fail(item, f"Error during mockup: {primary['error']}")
+
+    if primary.get("mockup_path"):
+        item["mockup_path_abs"] = primary["mockup_path"]
+    else:
+        mockup_filename = os.path.basename(primary.get("mockup_url", "N/A"))
+        item["mockup_path_abs"] = os.path.abspath(os.path.join(orchestrator_dir, "..", "mockup", "output", mockup_filename))
+    set_variant_mockups(item, [dict(result, path=result.get("mockup_path")) for result in results])
+
+
+def set_variant_mockups(item, results):
+    """Keeps the rendered color variants as [{"color", "path"}]; failed colors are logged and dropped."""
+    variants = []
+    for result in results:
+        if result.get("error") or not result.get("path"):
+            log(item, f"Skipping {result['color']} variant: {result.get('error', 'no mockup path')}")
+            continue
+        variants.append({"color": result["color"], "path": result["path"]})
+    item["variant_mockups"] = variants
+
+
+def derivatives_stage(item):
+    """
+    Makes the renditions later stages use instead of the full-size images: the
+    caption input and dashboard thumbnail of the primary mockup, and a Shopify
+    upload of the design and of every color variant. Only paths come through
+    the queue; each source is decoded here, one at a time.
+    """
+    wanted = {item["mockup_path_abs"]: ("caption", "shopify", "thumbnail"), item["abs_path"]: ("shopify",)}
+    for variant in item.get("variant_mockups", []):
+        wanted.setdefault(variant["path"], ("shopify",))
 
-    mockup_url = mockup_response.get("mockup_url", "N/A")
+    log(item, f"Rendering derivatives of {len(wanted)} images...")
+    renditions = {}
+    store = AssetStore()
+    for path, names in wanted.items():
+        try:
+            renditions[path] = make_renditions(path, names, db=get_db(), store=store)
+        except OSError as e:
+            fail(item, f"Error rendering derivatives of {os.path.basename(path)}: {e}")
+    item["renditions"] = renditions
 
-    mockup_filename = os.path.basename(mockup_url)
-    mockup_path_abs = os.path.abspath(os.path.join(orchestrator_dir, "..", "mockup", "output", mockup_filename))
 
-    print("Generating caption for mockup image...")
-    caption = generate_image_caption(mockup_path_abs)
-    print(f"Generated caption: {caption}")
+def rendition(item, path, name):
+    """The `name` rendition of the image at `path`, or `path` itself for jobs checkpointed without one."""
+    return item.get("renditions", {}).get(path, {}).get(name, path)
 
-    # Step 3: Call fake publisher
-    print("Publishing product...")
+
+def caption_stage(items):
+    # Receives a list of items so BLIP can caption them as one tensor batch
+    for item in items:
+        log(item, "Generating caption for mockup image...")
+    captions = caption_images([rendition(item, item["mockup_path_abs"], "caption") for item in items])
+    for item, caption in zip(items, captions):
+        log(item, f"Generated caption: {caption}")
+        item["caption"] = caption
+
+
+def publish_stage(item):
+    product = item["product"]
+    log(item, "Publishing product...")
     publish_payload = product.copy()
-    publish_payload["mockup_url"] = mockup_path_abs
-    publish_payload["caption"] = caption
+    publish_payload["mockup_url"] = item["mockup_path_abs"]
+    publish_payload["caption"] = item["caption"]
     try:
-        r = requests.post(PUBLISHER_URL, json=publish_payload)
+        r = publisher_client.post(PUBLISHER_URL, json=publish_payload)
         r.raise_for_status()
         publish_response = r.json()
 
     except ConnectionError:
-        print("Error publishing product: Could not connect to the fake publisher server. Is it running?")
-        return
+        fail(item, "Error publishing product: Could not connect to the fake publisher server. Is it running?")
     except HTTPError as e:
-        print(f"HTTP error publishing product: {e}")
+        log(item, f"HTTP error publishing product: {e}")
         if e.response is not None:
             print_api_error(e.response)
-        return
+        raise StageError(f"HTTP error publishing product: {e}")
     except Timeout:
-        print("Error publishing product: Request timed out.")
-        return
+        fail(item, "Error publishing product: Request timed out.")
     except Exception as e:
-        print(f"Unexpected error publishing product: {e}")
-        return
+        fail(item, f"Unexpected error publishing product: {e}")
 
     fake_id = publish_response.get("fake_product_id", "N/A")
-    print(f"Product published with fake ID: {fake_id}")
+    log(item, f"Product published with fake ID: {fake_id}")
+    item["fake_id"] = fake_id
+
+    # Save state
+    get_db().save_record(item["title"], fake_id, item["mockup_path_abs"], caption=item["caption"],
+                         tags=product.get("tags", []), design_hash=item.get("design_hash"))
+    asset_paths = {"design": item["abs_path"], "mockup": item["mockup_path_abs"]}
+    for variant in item.get("variant_mockups", []):
+        asset_paths[f"mockup-{'-'.join(variant['color'].lower().split())}"] = variant["path"]
+    for kind, path in list(asset_paths.items()):
+        for name, derived in item.get("renditions", {}).get(path, {}).items():
+            asset_paths[f"{kind}-{name}"] = derived
+    get_db().add_asset_refs(item["title"], asset_paths)
+
+    log(item, "Record saved to state DB.")
 
-    # Step 4: Save state
-    db.save_record(title, fake_id, mockup_path_abs, caption=caption, tags=product.get("tags", []))
 
-    print("Record saved to state DB.")
+def shopify_stage(items):
+    # Receives a list of items so they can go out through one publish_many call
+    pending = []
+    for item in items:
+        # e.g. a resumed job whose product was created before its checkpoint was saved
+        existing = get_db().find_shopify_product(item["title"])
+        if existing:
+            log(item, f"Already in the Shopify store as {existing}; not creating it again.")
+            item["shopify_id"] = existing
+        else:
+            pending.append(item)
+    items = pending
+    if not items:
+        return
 
-    # Step 5: Shopify publish (stub)
-    # Prepare local paths for Shopify images
-    product["image_path_abs"] = abs_path
-    product["mockup_path_abs"] = mockup_path_abs   
+    products = []
+    for item in items:
+        # Upload the Shopify renditions rather than the full-size PNGs
+        product = item["product"]
+        product["image_path_abs"] = rendition(item, item["abs_path"], "shopify")
+        product["mockup_path_abs"] = rendition(item, item["mockup_path_abs"], "shopify")
+        product["variant_mockups"] = [
+            dict(variant, path=rendition(item, variant["path"], "shopify")) for variant in item.get("variant_mockups", [])
+        ]
+        product["caption"] = item["caption"]
+        products.append(product)
+        log(item, "Preparing to publish to Shopify...")
 
-    print("Preparing to publish to Shopify...")
     try:
-        shopify_resp = publish_to_shopify(product)
-        print(f"Shopify publish response: {shopify_resp}")
+        responses = publish_many(products)
     except Exception as e:
-        print(f"Error publishing to Shopify: {e}")
-        return
-    
+        for item in items:
+            log(item, f"Error publishing to Shopify: {e}")
+        raise StageError(f"Error publishing to Shopify: {e}")
+
+    for item, shopify_resp in zip(items, responses):
+        log(item, f"Shopify publish response: {shopify_resp}")
+        if shopify_resp.get("status") == "skipped":
+            # No store configured; the job still completes
+            continue
+        if shopify_resp.get("status") == "error":
+            # Mark just this item; its job keeps the earlier checkpoints for resume
+            item["status"] = "failed"
+            item["error"] = f"Shopify: {shopify_resp.get('message')}"
+        else:
+            item["shopify_id"] = shopify_resp.get("shopify_product_id")
+    # Mirror what was just created, so later runs see it before the next sync
+    get_db().upsert_shopify_products([
+        {"id": item["shopify_id"], "title": item["title"]} for item in items if item.get("shopify_id")
+    ])
+
+
+# Stages listed here are called with a list of items
+BATCH_STAGES = {"caption": CAPTION_BATCH_SIZE, "shopify": SHOPIFY_BATCH_SIZE}
+
+STAGES = [
+    ("generate", generate_stage),
+    ("design", design_stage),
+    ("mockup", mockup_stage),
+    ("derivatives", derivatives_stage),
+    ("caption", caption_stage),
+    ("publish", publish_stage),
+    ("shopify", shopify_stage),
+]
+STAGE_NAMES = [name for name, _ in STAGES]
+# Stages that take the run's RunClaims as a second argument
+CLAIMING_STAGES = {"generate", "design"}
+
+
+def stage_done(item, name):
+    completed = item.get("completed_stage")
+    return completed is not None and STAGE_NAMES.index(name) <= STAGE_NAMES.index(completed)
+
+
+def checkpointed(name, fn):
+    """
+    Wraps a stage so each item is backed by a row in the jobs table. Stages an
+    item already completed (on a resumed job) are skipped; after a stage
+    succeeds its outputs are checkpointed, and on failure the job is marked
+    failed with the checkpoints of earlier stages intact.
+    """
+    def wrapper(arg):
+        db = get_db()
+        items = arg if isinstance(arg, list) else [arg]
+        for item in items:
+            if "job_id" not in item:
+                item["job_id"] = db.create_job(WORKER_ID)
+
+        pending = [item for item in items if not stage_done(item, name)]
+        if not pending:
+            return
+        try:
+            fn(pending if isinstance(arg, list) else pending[0])
+        except SkipItem as e:
+            for item in pending:
+                db.finish_job(item["job_id"], "skipped", WORKER_ID, error=str(e))
+            raise
+        except Exception as e:
+            for item in pending:
+                db.finish_job(item["job_id"], "failed", WORKER_ID, error=f"{name}: {e}")
+            raise
+
+        for item in pending:
+            if item.get("status") in ("failed", "skipped"):
+                db.finish_job(item["job_id"], item["status"], WORKER_ID, error=f"{name}: {item.get('error')}")
+                continue
+            data = {field: item[field] for field in CHECKPOINT_FIELDS if field in item}
+            item["completed_stage"] = name
+            if name == STAGE_NAMES[-1]:
+                db.finish_job(item["job_id"], "done", WORKER_ID, stage=name, data=data)
+            else:
+                db.checkpoint_job(item["job_id"], name, data, WORKER_ID)
+    return wrapper
+
+
+def build_stages(run_id, profiler=None, claims=None):
+    """The wrapped stage functions for one run; `claims` defaults to a fresh RunClaims."""
+    claims = claims or RunClaims()
+    stages = []
+    for name, fn in STAGES:
+        if name in CLAIMING_STAGES:
+            fn = partial(fn, claims=claims)
+        if profiler:
+            fn = profiler.wrap(name, fn)
+        stages.append((name, claims.releasing(checkpointed(name, timed(get_db(), run_id, name, fn)))))
+    return stages
+
+
+def stage_workers(concurrency):
+    workers = dict(STAGE_CONCURRENCY)
+    if isinstance(concurrency, dict):
+        workers.update(concurrency)
+    elif concurrency:
+        workers.update({name: concurrency for name in workers if name != "caption"})
+    return workers
+
+
+def sync_store():
+    if SHOPIFY_SYNC_ON_RUN:
+        sync_if_configured(get_db())
+
+
+def run_items(items, run_id, workers, description, profile=None):
+    sync_store()
+    print(f"Starting orchestrator {description}, run {run_id} ({', '.join(f'{k}={v}' for k, v in workers.items())})...")
+    with profile_run(run_id, profile) as profiler:
+        pipeline = Pipeline([
+            Stage(name, fn, workers[name], batch_size=BATCH_STAGES.get(name, 1))
+            for name, fn in build_stages(run_id, profiler)
+        ])
+        result = pipeline.run(items)
+    result.run_id = run_id
+    print(result.summary())
+    return result
+
+
+def run_batch(count, concurrency=None, stream=True, profile=None):
+    """
+    Runs `count` products through the stages as a pipeline. `concurrency` is either
+    a single worker count for every stage except captioning, or a dict of
+    per-stage overrides on top of STAGE_CONCURRENCY. With `stream`, listings come
+    from the generator's batch endpoint instead of one /generate call per product.
+    `profile` overrides PIPELINE_PROFILE (see profiling.py).
+    """
+    if stream:
+        items = (
+            {"id": n, "label": f"#{n}", "product": product}
+            for n, product in enumerate(iter_generated_products(count), start=1)
+        )
+    else:
+        items = ({"id": n, "label": f"#{n}"} for n in range(1, count + 1))
+
+    return run_items(items, new_run_id(), stage_workers(concurrency), f"batch of {count} products", profile)
+
+
+def resume(limit=50, concurrency=None, profile=None):
+    """
+    Claims failed, pending and abandoned jobs and runs each from its first
+    incomplete stage, reusing the checkpointed outputs of earlier stages.
+    Several resume workers can run at once; each job is leased to one of them.
+    """
+    jobs = get_db().claim_jobs(WORKER_ID, limit=limit)
+    if not jobs:
+        print("No jobs to resume.")
+        return None
+
+    items = []
+    for job in jobs:
+        item = dict(job["data"])
+        item.update({"id": job["id"], "label": f"job {job['id']}", "job_id": job["id"], "completed_stage": job["stage"]})
+        log(item, f"Resuming after stage '{job['stage'] or 'none'}' (attempt {job['attempts']})")
+        items.append(item)
+
+    return run_items(items, new_run_id(), stage_workers(concurrency), f"resume of {len(items)} jobs", profile)
+
+
+def main(run_once=True, count=1, concurrency=None, stream=True, profile=None):
+    if count > 1:
+        return run_batch(count, concurrency, stream, profile)
+
+    run_id = new_run_id()
+    print(f"Starting orchestrator run {run_id}...")
+    sync_store()
+
+    item = {}
+    with profile_run(run_id, profile) as profiler:
+        for name, stage in build_stages(run_id, profiler):
+            try:
+                stage([item] if name in BATCH_STAGES else item)
+            except (SkipItem, StageError):
+                return run_id
+            if item.get("status") in ("failed", "skipped"):
+                return run_id
 
     print("Orchestrator run complete.")
+    return run_id
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the AI Merch Maker pipeline.")
+    parser.add_argument("--count", type=int, default=1, help="number of products to generate")
+    parser.add_argument("--concurrency", type=int, default=None, help="workers per stage in batch mode")
+    parser.add_argument("--no-stream", action="store_true", help="call /generate once per product in batch mode")
+    parser.add_argument("--resume", action="store_true", help="resume failed or interrupted jobs instead of generating")
+    parser.add_argument("--limit", type=int, default=50, help="maximum jobs to claim with --resume")
+    parser.add_argument("--profile", action="store_true", default=None,
+                        help="write cProfile, sampled stacks and tracemalloc peaks per stage to PROFILE_DIR")
+    args = parser.parse_args()
+    if args.resume:
+        resume(limit=args.limit, concurrency=args.concurrency, profile=args.profile)
+    else:
+        main(count=args.count, concurrency=args.concurrency, stream=not args.no_stream, profile=args.profile)
@@ -1,84 +1,57 @@
+import os
 import subprocess
-import time
-import requests
 import sys
 
-# Config for each service
-SERVICES = {
-    "generator": {
-        "cmd": ["uvicorn", "main:app", "--host", "localhost", "--port", "8001"],
-        "cwd": "../generator",
-        "url": "http://localhost:8001/"
-    },
-    "mockup": {
-        "cmd": ["node", "server.js"],
-        "cwd": "../mockup",
-        "url": "http://localhost:3000/"
-    },
-    "publisher": {
-        "cmd": ["php", "-S", "localhost:8000"],
-        "cwd": "../publisher",
-        "url": "http://localhost:8000/api.php"  
-    }
-}
+from supervisor import (
+    SERVICES, SupervisorAuthError, start_services, wait_all_ready, stop_services, submit, supervisor_running,
+)
 
-def wait_for_service(url, retries=10, delay=3):
-    for i in range(retries):
-        try:
-            r = requests.get(url, timeout=2)
-            if r.status_code == 200:
-                print(f"Service at {url} is up.")
-                return True
-        except Exception:
-            pass
-        print(f"Waiting for service at {url} ({i+1}/{retries})...")
-        time.sleep(delay)
-    return False
-def print_process_logs(name, proc):
+orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_on_supervisor():
+    """
+    Submits the run to a supervisor (python supervisor.py serve), which keeps the
+    services and caption model warm. Returns the exit code, or None if whatever
+    is listening is not a supervisor we can use.
+    """
+    print("Supervisor is running; submitting the pipeline run to it...")
     try:
-        stdout, stderr = proc.communicate(timeout=5)
-        if stdout:
-            print(f"[{name} STDOUT]\n{stdout.decode()}")
-        if stderr:
-            print(f"[{name} STDERR]\n{stderr.decode()}")
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        print(f"[{name}] Process killed after timeout while reading logs.")
+        response = submit({"cmd": "run", "count": 1})
+    except SupervisorAuthError as e:
+        print(f"{e} Starting the services locally instead.")
+        return None
+    except OSError as e:
+        # The run may already have started there, so don't start a second one
+        print(f"Lost contact with the supervisor: {e}")
+        return 1
+    print(f"Supervisor response: {response}")
+    return 0 if response.get("status") == "ok" and not response.get("failed") else 1
 
 
 def main():
+    if supervisor_running():
+        code = run_on_supervisor()
+        if code is not None:
+            sys.exit(code)
+
     procs = {}
     try:
-        # Start all services
-        for name, svc in SERVICES.items():
-            print(f"Starting {name} server...")
-            procs[name] = subprocess.Popen(
-                svc["cmd"],
-                cwd=svc["cwd"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=False  # required for Windows sometimes, but can be adjusted
-            )
+        # Start all services; their output is drained into rotating files under logs/
+        procs = start_services(SERVICES)
 
         # Wait for all services to be ready
-        for name, svc in SERVICES.items():
-            if not wait_for_service(svc["url"]):
-                print(f"Error: {name} service failed to start in time.")
-                print_process_logs(name, procs[name])
-                raise Exception(f"{name} service not ready")
+        missing = wait_all_ready(procs)
+        if missing:
+            for name in missing:
+                print(f"Error: {name} service failed to start in time; see {procs[name].status()['log']}")
+            raise Exception(f"{', '.join(missing)} service not ready")
 
-        # Run the orchestrator
+        # Run the orchestrator; its output streams straight to ours
         print("All services running. Starting orchestrator...")
-        orchestrator_proc = subprocess.run(
-            ["python", "run.py"],
-            cwd=".",
-            capture_output=True,
-            text=True
-        )
-        print("Orchestrator output:")
-        print(orchestrator_proc.stdout)
+        orchestrator_proc = subprocess.run([sys.executable, "run.py"], cwd=orchestrator_dir)
         if orchestrator_proc.returncode != 0:
-            print("Orchestrator failed:", orchestrator_proc.stderr)
+            print(f"Orchestrator failed with exit code {orchestrator_proc.returncode}")
             sys.exit(1)
 
     except Exception as e:
@@ -86,9 +59,7 @@ def main():
     finally:
         # Terminate all started services
         print("Terminating all services...")
-        for proc in procs.values():
-            proc.terminate()
-            print_process_logs(name, proc)
+        stop_services(procs)
         print("All services terminated.")
 
 if __name__ == "__main__":
@@ -1,35 +1,183 @@
 import os
+import sys
+import base64
+import random
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.transport import IDEMPOTENT_METHODS, session_for
 
 load_dotenv()
 
 SHOPIFY_STORE = os.getenv("SHOPIFY_STORE")
 ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
 
-API_BASE = f"https://{SHOPIFY_STORE}/admin/api/2023-07"
+# SHOPIFY_API_BASE points the client at another server, e.g. a local stub
+API_BASE = os.getenv("SHOPIFY_API_BASE") or f"https://{SHOPIFY_STORE}/admin/api/2023-07"
 
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-Shopify-Access-Token": ACCESS_TOKEN,
-}
-import base64
+# (connect, read) seconds; image uploads carry multi-MB bodies so get a longer read timeout
+TIMEOUT = (5, 30)
+UPLOAD_TIMEOUT = (5, 120)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+UPLOAD_WORKERS = 2
+PUBLISH_WORKERS = 4
+# Catalog sync: the product fields mirrored locally, and products per page (Shopify's maximum)
+SYNC_FIELDS = "id,title,handle,status,updated_at"
+SYNC_PAGE_SIZE = 250
 
-def publish_to_shopify(product_json):
-    if not SHOPIFY_STORE or not ACCESS_TOKEN:
-        return {"status": "error", "message": "Shopify credentials not set"}
 
-    try:
+class CallLimitThrottle:
+    """
+    Client-side copy of Shopify's leaky bucket. Every request takes one token;
+    the bucket drains at `leak_rate` calls per second. The level and capacity
+    are resynced from the X-Shopify-Shop-Api-Call-Limit header ("32/40") on every
+    response, so several clients sharing a store still converge on the real state.
+    """
+
+    def __init__(self, capacity=40, leak_rate=2.0, headroom=2):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.headroom = headroom
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.cond = threading.Condition()
+
+    def _leak(self):
+        now = time.monotonic()
+        self.level = max(0.0, self.level - (now - self.updated) * self.leak_rate)
+        self.updated = now
+        return now
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = self._leak()
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    # Keep a little headroom for other clients of the same store
+                    if self.level + 1 <= self.capacity - self.headroom:
+                        self.level += 1
+                        return
+                    wait = (self.level + 1 - (self.capacity - self.headroom)) / self.leak_rate
+                self.cond.wait(wait)
+
+    def update(self, header):
+        if not header:
+            return
+        try:
+            used, capacity = (int(part) for part in header.split("/"))
+        except ValueError:
+            return
+        with self.cond:
+            self._leak()
+            self.capacity = capacity
+            self.level = float(used)
+            self.cond.notify_all()
+
+    def pause(self, seconds):
+        """Blocks every caller for `seconds`, e.g. after a 429 with Retry-After."""
+        with self.cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt):
+    # Full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class ShopifyClient:
+    def __init__(self, api_base=API_BASE, access_token=ACCESS_TOKEN, pool_size=10,
+                 upload_workers=UPLOAD_WORKERS, max_retries=MAX_RETRIES):
+        self.api_base = api_base.rstrip("/")
+        self.access_token = access_token
+        self.upload_workers = upload_workers
+        self.max_retries = max_retries
+        self.throttle = CallLimitThrottle()
+
+        # Keep-alive pool shared through common.transport; retries stay here since
+        # they are driven by Shopify's call-limit throttle
+        self.session = session_for(self.api_base, pool_size)
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-Shopify-Access-Token": access_token or "",
+        }
+
+    def request(self, method, path, timeout=TIMEOUT, retry_unsafe=False, **kwargs):
+        """
+        Sends a request through the throttle. 429s wait for Retry-After and
+        connection errors back off and retry, up to max_retries. Read timeouts
+        and 5xx responses are retried too, but for POSTs only with
+        `retry_unsafe`: Shopify may have created the product or image already,
+        and a retry would create it twice. Other errors raise requests.HTTPError.
+        """
+        url = path if path.startswith("http") else f"{self.api_base}{path}"
+        can_retry_any = retry_unsafe or method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            self.throttle.acquire()
+            try:
+                response = self.session.request(method, url, timeout=timeout, headers=self.headers, **kwargs)
+            except requests.exceptions.ConnectionError:
+                # Includes connect timeouts: the request never reached Shopify
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            except requests.exceptions.Timeout:
+                if not can_retry_any or attempt >= self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            self.throttle.update(response.headers.get("X-Shopify-Shop-Api-Call-Limit"))
+
+            # Throttled requests were never processed, so they are safe to repeat
+            if response.status_code == 429 or (response.status_code >= 500 and can_retry_any):
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+                retry_after = response.headers.get("Retry-After")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = backoff_delay(attempt)
+                if response.status_code == 429:
+                    self.throttle.pause(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def create_product(self, product_json):
+        """Creates the product and returns the created product object (with its variants)."""
+        price = str(product_json.get("price", "0.00"))
+        colors = [variant["color"] for variant in product_json.get("variant_mockups", [])]
+        if colors:
+            # One variant per mockup color, all at the listing price
+            options = [{"name": "Color"}]
+            variants = [{"option1": color.title(), "price": price} for color in colors]
+        else:
+            options = None
+            variants = [{"price": price}]
+
         # Prepare product data for Shopify API
         product_data = {
             "product": {
                 "title": product_json.get("title"),
                 "body_html": product_json.get("description"),
                 "tags": ", ".join(product_json.get("tags", [])),
-                "variants": [{
-                    "price": str(product_json.get("price", "0.00"))
-                }],
+                "variants": variants,
                 "metafields": [
                     {
                         "namespace": "ai_data",
@@ -40,29 +188,103 @@ def publish_to_shopify(product_json):
                 ]
             }
         }
+        if options:
+            product_data["product"]["options"] = options
+        response = self.request("POST", "/products.json", json=product_data)
+        return response.json()["product"]
+
+    def upload_image(self, product_id, image_path, position=None, variant_ids=None):
+        with open(image_path, "rb") as f:
+            encoded_string = base64.b64encode(f.read()).decode('utf-8')
+        # The filename's extension tells Shopify the format (PNG originals, JPEG/WebP renditions)
+        image_payload = {"image": {"attachment": encoded_string, "filename": os.path.basename(image_path)}}
+        if position is not None:
+            image_payload["image"]["position"] = position
+        if variant_ids:
+            image_payload["image"]["variant_ids"] = variant_ids
+        response = self.request("POST", f"/products/{product_id}/images.json",
+                                json=image_payload, timeout=UPLOAD_TIMEOUT)
+        return response.json()
+
+    def iter_product_pages(self, fields=SYNC_FIELDS, updated_at_min=None, limit=SYNC_PAGE_SIZE):
+        """
+        Yields the store's products one page (list) at a time, following the
+        cursor in each response's Link header. Filters go on the first request
+        only: Shopify rejects them next to page_info, whose cursor carries them.
+        """
+        params = {"limit": limit, "fields": fields}
+        if updated_at_min:
+            params["updated_at_min"] = updated_at_min
+        url = "/products.json"
+        while url:
+            response = self.request("GET", url, params=params)
+            yield response.json().get("products", [])
+            url = response.links.get("next", {}).get("url")
+            params = None if url and "fields=" in url else {"fields": fields}
+
+    def publish(self, product_json):
+        try:
+            # Step 1: Create product (without image)
+            product = self.create_product(product_json)
+            product_id = product["id"]
+
+            # Step 2: Upload images in parallel; position keeps the mockup first, then
+            # the design, then one image per color variant linked to that variant
+            variant_ids = {
+                (variant.get("option1") or "").lower(): variant["id"] for variant in product.get("variants") or []
+                if variant.get("id")
+            }
+            images = {product_json.get("mockup_path_abs"): [], product_json.get("image_path_abs"): []}
+            for variant in product_json.get("variant_mockups", []):
+                variant_id = variant_ids.get(variant["color"].lower())
+                if variant_id:
+                    # The primary mockup is also the white variant's image
+                    images.setdefault(variant["path"], []).append(variant_id)
+            images = [(path, ids or None) for path, ids in images.items() if path and os.path.isfile(path)]
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as pool:
+                uploads = [
+                    pool.submit(self.upload_image, product_id, path, position, ids)
+                    for position, (path, ids) in enumerate(images, start=1)
+                ]
+                for upload in uploads:
+                    upload.result()
+
+            return {"status": "success", "shopify_product_id": product_id}
+
+        except requests.exceptions.HTTPError as e:
+            return {"status": "error", "message": f"HTTP error: {e.response.text}"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def publish_many(self, products, workers=PUBLISH_WORKERS):
+        """Publishes several products concurrently; results are returned in input order."""
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self.publish, products))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ShopifyClient()
+    return _client
+
+
+def credentials_set():
+    return bool((SHOPIFY_STORE or os.getenv("SHOPIFY_API_BASE")) and ACCESS_TOKEN)
+
+
+def publish_to_shopify(product_json):
+    if not credentials_set():
+        return {"status": "skipped", "message": "Shopify credentials not set"}
+    return get_client().publish(product_json)
+
 
-        # Step 1: Create product (without image)
-        url = f"{API_BASE}/products.json"
-        response = requests.post(url, json=product_data, headers=HEADERS)
-        response.raise_for_status()
-        product_resp = response.json()
-        product_id = product_resp["product"]["id"]
-
-        orig_image_path = product_json.get("image_path_abs")
-        mockup_image_path = product_json.get("mockup_path_abs")
-
-        for image_path in [mockup_image_path, orig_image_path]:
-            if image_path and os.path.isfile(image_path):
-                with open(image_path, "rb") as f:
-                    encoded_string = base64.b64encode(f.read()).decode('utf-8')
-                    image_payload = {"image": {"attachment": encoded_string}}
-                    img_url = f"{API_BASE}/products/{product_id}/images.json"
-                    img_resp = requests.post(img_url, json=image_payload, headers=HEADERS)
-                    img_resp.raise_for_status()
-
-        return {"status": "success", "shopify_product_id": product_id}
-
-    except requests.exceptions.HTTPError as e:
-        return {"status": "error", "message": f"HTTP error: {e.response.text}"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+def publish_many(products):
+    if not credentials_set():
+        # Not an error: the demo setup runs without a store
+        return [{"status": "skipped", "message": "Shopify credentials not set"} for _ in products]
+    return get_client().publish_many(products)
@@ -0,0 +1,66 @@
+"""
+Mirrors the Shopify store's products into StateDB (shopify_products), so
+duplicate checks and publish decisions can be made locally.
+
+An incremental sync asks only for products updated since the last sync's
+newest updated_at (the watermark in sync_state), 250 per page, following the
+page_info cursor. A full sync walks the whole catalog and then drops mirror
+rows it did not see, since deleted products never show up in incremental syncs.
+
+    python -m orchestrator sync          # incremental
+    python -m orchestrator sync --full
+"""
+import time
+from datetime import datetime
+
+from shopify_client import credentials_set, get_client
+
+WATERMARK = "shopify_products.updated_at"
+
+
+def parse_updated_at(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_catalog(db, client=None, full=False):
+    """
+    Syncs the mirror and returns {"pages", "products", "pruned", "watermark"}.
+    The watermark only advances after every page was stored, so an interrupted
+    sync is simply repeated from the old watermark next time.
+    """
+    client = client or get_client()
+    watermark = None if full else db.get_sync_state(WATERMARK)
+    started = time.time()
+
+    pages = fetched = 0
+    newest, newest_at = watermark, parse_updated_at(watermark)
+    for products in client.iter_product_pages(updated_at_min=watermark):
+        pages += 1
+        fetched += len(products)
+        db.upsert_shopify_products(products, synced_at=started)
+        for product in products:
+            updated_at = parse_updated_at(product.get("updated_at"))
+            if updated_at and (newest_at is None or updated_at > newest_at):
+                newest, newest_at = product["updated_at"], updated_at
+
+    pruned = db.prune_shopify_products(started) if full else 0
+    if newest:
+        db.set_sync_state(WATERMARK, newest)
+    return {"pages": pages, "products": fetched, "pruned": pruned, "watermark": newest}
+
+
+def sync_if_configured(db, full=False):
+    """Runs a sync when Shopify credentials are set; errors are reported, not raised."""
+    if not credentials_set():
+        return None
+    try:
+        result = sync_catalog(db, full=full)
+    except Exception as e:
+        print(f"Shopify catalog sync failed: {e}")
+        return None
+    removed = f", {result['pruned']} removed" if result["pruned"] else ""
+    print(f"Shopify catalog sync: {result['products']} products in {result['pages']} pages{removed}.")
+    return result
@@ -0,0 +1,102 @@
+import os
+import re
+
+# Spellings that should count as the same word when comparing titles and tags
+SYNONYMS = {
+    "tee": "tshirt",
+    "tees": "tshirt",
+    "shirt": "tshirt",
+    "tshirts": "tshirt",
+    "mug": "cup",
+    "mugs": "cup",
+    "hat": "cap",
+    "hats": "cap",
+}
+PHRASES = [
+    (re.compile(r"\bt[\s-]?shirts?\b"), "tshirt"),
+    (re.compile(r"\bbaseball cap\b"), "cap"),
+    (re.compile(r"\bcoffee (mug|cup)\b"), "cup"),
+]
+STOPWORDS = {"a", "an", "the", "and", "of", "for", "with", "in", "on", "my", "your"}
+
+# dHash bits are split into this many bands for the multi-index lookup. Two
+# hashes within distance d < HASH_BANDS must share at least one band exactly.
+HASH_BITS = 64
+HASH_BANDS = 8
+BAND_BITS = HASH_BITS // HASH_BANDS
+
+# A title scoring at least this against a published one is treated as a duplicate
+TITLE_THRESHOLD = float(os.getenv("TITLE_SIMILARITY_THRESHOLD", "0.75"))
+# Designs whose dHashes differ in at most this many bits are treated as duplicates
+DESIGN_MAX_DISTANCE = int(os.getenv("DESIGN_HASH_DISTANCE", "6"))
+
+
+def normalize_tokens(text):
+    """Lowercases, folds product-type synonyms and drops stopwords: "Galactic Cat Tee" -> {galactic, cat, tshirt}."""
+    text = (text or "").lower()
+    for pattern, replacement in PHRASES:
+        text = pattern.sub(replacement, text)
+    tokens = set()
+    for word in re.findall(r"[a-z0-9]+", text):
+        word = SYNONYMS.get(word, word)
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+def tag_tokens(tags):
+    tokens = set()
+    for tag in tags or []:
+        tokens |= normalize_tokens(tag)
+    return tokens
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def similarity_score(title_a, tags_a, title_b, tags_b):
+    """Title token overlap, nudged by tag overlap when both sides have tags."""
+    title_score = jaccard(title_a, title_b)
+    if tags_a and tags_b:
+        return 0.8 * title_score + 0.2 * jaccard(tags_a, tags_b)
+    return title_score
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of a PIL image or image path."""
+    from PIL import Image
+
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    pixels = list(image.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hash_bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(HASH_BANDS)]
+
+
+def to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
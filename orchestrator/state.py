@@ -1,55 +1,814 @@
 import sqlite3
 from typing import Optional
+import base64
+import bisect
 import os
+import sys
 import json
+import math
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from similarity import (
+    normalize_tokens, tag_tokens, similarity_score, hash_bands, to_signed, hamming,
+    HASH_BANDS, TITLE_THRESHOLD, DESIGN_MAX_DISTANCE,
+)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+
+# Relative to the working directory, which is orchestrator/ for every entry point
+STATE_DB_PATH = os.getenv("STATE_DB", "state.db")
+POOL_SIZE = int(os.getenv("STATE_DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = 5000
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# BM25 column weights for search(): title, caption, tags
+SEARCH_WEIGHTS = (10.0, 2.0, 5.0)
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections for one database file. Connections are
+    opened lazily in WAL mode so readers never block the writer, and are handed
+    to one thread at a time.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # INSERT OR REPLACE only fires the delete trigger that keeps products_fts
+        # in sync when recursive triggers are on
+        conn.execute("PRAGMA recursive_triggers=ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.created < self.size
+                if can_open:
+                    self.created += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_initialized = set()
+
+def get_pool(db_path):
+    db_path = os.path.abspath(db_path)
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = ConnectionPool(db_path)
+        return _pools[db_path]
+
+
+def checkpoint_paths(value):
+    """Every string in a job checkpoint, including dict keys (renditions are keyed by source path)."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield key
+            yield from checkpoint_paths(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from checkpoint_paths(item)
+
+
+def encode_cursor(published_at, title):
+    return base64.urlsafe_b64encode(json.dumps([published_at, title]).encode()).decode()
+
+def decode_cursor(cursor):
+    published_at, title = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return published_at, title
+
 
 class StateDB:
-    def __init__(self, db_path="state.db"):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self._create_table()
+    """
+    Pipeline state. Instances are cheap: every StateDB for the same file shares
+    one connection pool, so it is safe to create one per request or per thread.
+    """
+
+    def __init__(self, db_path=None):
+        self.pool = get_pool(db_path or STATE_DB_PATH)
+        with _pools_lock:
+            if self.pool.db_path not in _initialized:
+                self._create_table()
+                _initialized.add(self.pool.db_path)
+
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
 
     def _create_table(self):
         # Add new columns caption and tags (tags stored as JSON string)
-        self.conn.execute("""
-        CREATE TABLE IF NOT EXISTS published_products (
-            product_title TEXT PRIMARY KEY,
-            fake_product_id TEXT,
-            mockup_url TEXT,
-            caption TEXT,
-            tags TEXT,
-            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS published_products (
+                product_title TEXT PRIMARY KEY,
+                fake_product_id TEXT,
+                mockup_url TEXT,
+                caption TEXT,
+                tags TEXT,
+                published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_published_at ON published_products (published_at, product_title)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fake_product_id ON published_products (fake_product_id)")
+            # Which asset store files (by content hash) each product uses
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS asset_refs (
+                digest TEXT NOT NULL,
+                product_title TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                PRIMARY KEY (digest, product_title, kind)
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_asset_refs_title ON asset_refs (product_title)")
+            # One row per item per pipeline stage execution (see metrics.py)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS stage_timings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT,
+                item TEXT,
+                stage TEXT NOT NULL,
+                started_at REAL,
+                duration REAL,
+                status TEXT,
+                error TEXT
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings (stage, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_timings_run ON stage_timings (run_id)")
+            # Running totals of stage_timings, updated on insert so /metrics does not
+            # scan the whole history. Buckets are not cumulative: each row counts in
+            # the smallest DURATION_BUCKETS bound it fits under (none if above all).
+            has_totals = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stage_totals'"
+            ).fetchone()
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS stage_totals (
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                duration_sum REAL NOT NULL,
+                PRIMARY KEY (stage, status)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS stage_duration_buckets (
+                stage TEXT NOT NULL,
+                le REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (stage, le)
+            ) WITHOUT ROWID
+            """)
+            if not has_totals:
+                conn.execute("""
+                    INSERT INTO stage_totals (stage, status, count, duration_sum)
+                    SELECT stage, COALESCE(status, ''), COUNT(*), TOTAL(duration) FROM stage_timings
+                    GROUP BY stage, COALESCE(status, '')
+                """)
+                bucket_of = " ".join(f"WHEN duration <= {float(le)} THEN {float(le)}" for le in DURATION_BUCKETS)
+                conn.execute(f"""
+                    INSERT INTO stage_duration_buckets (stage, le, count)
+                    SELECT stage, CASE {bucket_of} END AS le, COUNT(*) FROM stage_timings
+                    WHERE duration <= {float(DURATION_BUCKETS[-1])}
+                    GROUP BY stage, le
+                """)
+            # Durable pipeline jobs: `stage` is the last completed stage and `data`
+            # holds its outputs (product JSON, image/mockup paths, caption, ids)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                stage TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires)")
+            # Normalized title and tag tokens (see similarity.py) for near-duplicate lookups
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS title_tokens (
+                token TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                product_title TEXT NOT NULL,
+                PRIMARY KEY (token, kind, product_title)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_title_tokens_title ON title_tokens (product_title)")
+            # dHash of each product's design, plus its bands for multi-index Hamming search
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS design_hashes (
+                product_title TEXT PRIMARY KEY,
+                dhash INTEGER NOT NULL
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS design_hash_bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                product_title TEXT NOT NULL,
+                PRIMARY KEY (band, value, product_title)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_design_hash_bands_title ON design_hash_bands (product_title)")
+
+            # Mirror of the Shopify store's products (see shopify_sync.py)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS shopify_products (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                handle TEXT,
+                status TEXT,
+                updated_at TEXT,
+                synced_at REAL NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_shopify_products_title ON shopify_products (title COLLATE NOCASE)")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at REAL
+            )
+            """)
+
+            # Renditions made from each source image (see derivatives.py)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS derivatives (
+                source_digest TEXT NOT NULL,
+                rendition TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (source_digest, rendition)
+            ) WITHOUT ROWID
+            """)
+
+            # Full-text index over published_products (external content, kept in sync
+            # by triggers). Tags are indexed as their JSON text, which tokenizes to the tags.
+            has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+            ).fetchone()
+            conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                product_title, caption, tags,
+                content='published_products', content_rowid='rowid',
+                tokenize='porter unicode61'
+            )
+            """)
+            conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS published_products_fts_insert AFTER INSERT ON published_products BEGIN
+                INSERT INTO products_fts (rowid, product_title, caption, tags)
+                VALUES (new.rowid, new.product_title, new.caption, new.tags);
+            END
+            """)
+            conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS published_products_fts_delete AFTER DELETE ON published_products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, product_title, caption, tags)
+                VALUES ('delete', old.rowid, old.product_title, old.caption, old.tags);
+            END
+            """)
+            conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS published_products_fts_update AFTER UPDATE ON published_products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, product_title, caption, tags)
+                VALUES ('delete', old.rowid, old.product_title, old.caption, old.tags);
+                INSERT INTO products_fts (rowid, product_title, caption, tags)
+                VALUES (new.rowid, new.product_title, new.caption, new.tags);
+            END
+            """)
+            if not has_fts:
+                conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+            # Bumped on every change to published_products, for cache validators
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS published_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+            """)
+            conn.execute("INSERT OR IGNORE INTO published_version (id, version) VALUES (1, 0)")
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS published_products_version_{event.lower()}
+                AFTER {event} ON published_products BEGIN
+                    UPDATE published_version SET version = version + 1 WHERE id = 1;
+                END
+                """)
+
+            # Databases created before the token index existed get it filled once
+            if conn.execute("SELECT 1 FROM title_tokens LIMIT 1").fetchone() is None:
+                rows = conn.execute("SELECT product_title, tags FROM published_products").fetchall()
+                for row in rows:
+                    self._index_title(conn, row["product_title"], json.loads(row["tags"] or "[]"))
 
     def is_published(self, title: str) -> bool:
-        cur = self.conn.execute("SELECT 1 FROM published_products WHERE product_title = ?", (title,))
-        return cur.fetchone() is not None
+        with self.pool.connection() as conn:
+            cur = conn.execute("SELECT 1 FROM published_products WHERE product_title = ?", (title,))
+            return cur.fetchone() is not None
 
-    def save_record(self, title: str, fake_product_id: str, mockup_url: str, caption: Optional[str] = "", tags: Optional[list] = None):
-        tags_json = json.dumps(tags or [])
-        self.conn.execute("""
-            INSERT OR REPLACE INTO published_products (product_title, fake_product_id, mockup_url, caption, tags)
-            VALUES (?, ?, ?, ?, ?)
-        """, (title, fake_product_id, mockup_url, caption, tags_json))
-        self.conn.commit()
+    def save_record(self, title: str, fake_product_id: str, mockup_url: str, caption: Optional[str] = "",
+                    tags: Optional[list] = None, design_hash: Optional[int] = None):
+        self.save_records([{
+            "title": title,
+            "fake_product_id": fake_product_id,
+            "mockup_url": mockup_url,
+            "caption": caption,
+            "tags": tags,
+            "design_hash": design_hash,
+        }])
 
-    def get_all_records(self):
-        cur = self.conn.execute("SELECT product_title, fake_product_id, mockup_url, caption, tags, published_at FROM published_products")
-        rows = cur.fetchall()
-        products = []
+    def save_records(self, records: list):
+        """
+        Writes many records (dicts shaped like save_record's arguments) in one
+        transaction, keeping the title token and design hash indexes in step.
+        """
+        rows = [
+            (r["title"], r.get("fake_product_id"), r.get("mockup_url"), r.get("caption", ""), json.dumps(r.get("tags") or []))
+            for r in records
+        ]
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO published_products (product_title, fake_product_id, mockup_url, caption, tags)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            for r in records:
+                self._index_title(conn, r["title"], r.get("tags"))
+                if r.get("design_hash") is not None:
+                    self._index_design(conn, r["title"], r["design_hash"])
+
+    def _index_title(self, conn, title, tags):
+        conn.execute("DELETE FROM title_tokens WHERE product_title = ?", (title,))
+        rows = [(token, "title", title) for token in normalize_tokens(title)]
+        rows += [(token, "tag", title) for token in tag_tokens(tags)]
+        conn.executemany("INSERT OR IGNORE INTO title_tokens (token, kind, product_title) VALUES (?, ?, ?)", rows)
+
+    def _index_design(self, conn, title, design_hash):
+        conn.execute("INSERT OR REPLACE INTO design_hashes (product_title, dhash) VALUES (?, ?)",
+                     (title, to_signed(design_hash)))
+        conn.execute("DELETE FROM design_hash_bands WHERE product_title = ?", (title,))
+        conn.executemany(
+            "INSERT INTO design_hash_bands (band, value, product_title) VALUES (?, ?, ?)",
+            [(band, value, title) for band, value in enumerate(hash_bands(design_hash))],
+        )
+
+    def find_similar_titles(self, title: str, tags: Optional[list] = None, threshold: float = TITLE_THRESHOLD):
+        """
+        Returns [(product_title, score)] for published products whose normalized
+        title (and tags) overlap `title` by at least `threshold`, best first.
+
+        Candidates come from the token index using prefix filtering: a title
+        reaching the threshold must share at least one of the query's rarest
+        len(tokens) - ceil(min_overlap * len(tokens)) + 1 tokens, so common
+        words like "tshirt" are only looked up when the query is too short to avoid them.
+        """
+        tokens = normalize_tokens(title)
+        if not tokens:
+            return []
+        tags = tag_tokens(tags)
+        # Tags add at most 0.2 to the score (see similarity_score)
+        min_overlap = max(0.0, (threshold - 0.2) / 0.8) if tags else threshold
+        prefix_len = len(tokens) - math.ceil(min_overlap * len(tokens)) + 1
+
+        with self.pool.connection() as conn:
+            placeholders = ",".join("?" * len(tokens))
+            frequency = dict(conn.execute(
+                f"SELECT token, COUNT(*) FROM title_tokens WHERE kind = 'title' AND token IN ({placeholders}) GROUP BY token",
+                list(tokens),
+            ).fetchall())
+            rarest = sorted(tokens, key=lambda token: (frequency.get(token, 0), token))[:max(1, prefix_len)]
+            placeholders = ",".join("?" * len(rarest))
+            candidates = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT product_title FROM title_tokens WHERE kind = 'title' AND token IN ({placeholders})",
+                rarest,
+            ).fetchall()]
+            if not candidates:
+                return []
+            placeholders = ",".join("?" * len(candidates))
+            rows = conn.execute(
+                f"SELECT product_title, kind, token FROM title_tokens WHERE product_title IN ({placeholders})",
+                candidates,
+            ).fetchall()
+
+        indexed = {}
         for row in rows:
-            mockup_url = row["mockup_url"]
-            if os.path.isabs(mockup_url):
-                filename = os.path.basename(mockup_url)
-                mockup_url = f"http://localhost:3000/output/{filename}"
-            products.append({
-                "product_title": row["product_title"],
-                "fake_product_id": row["fake_product_id"],
-                "mockup_url": mockup_url,
-                "caption": row["caption"],
-                "tags": json.loads(row["tags"] or "[]"),
-                "published_at": row["published_at"],
-            })
-        return products
+            indexed.setdefault(row["product_title"], {"title": set(), "tag": set()})[row["kind"]].add(row["token"])
+        matches = []
+        for candidate, entry in indexed.items():
+            score = similarity_score(tokens, tags, entry["title"], entry["tag"])
+            if score >= threshold:
+                matches.append((candidate, score))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def find_similar_designs(self, design_hash: int, max_distance: int = DESIGN_MAX_DISTANCE):
+        """
+        Returns [(product_title, distance)] for designs within `max_distance` bits
+        of `design_hash`, closest first. The hash is split into HASH_BANDS bands
+        and any hash within fewer than HASH_BANDS bits must match one band
+        exactly, so only rows sharing a band are compared.
+        """
+        if max_distance >= HASH_BANDS:
+            raise ValueError(f"max_distance must be below {HASH_BANDS} for the banded lookup")
+        bands = hash_bands(design_hash)
+        band_sql = " UNION ".join(["SELECT product_title FROM design_hash_bands WHERE band = ? AND value = ?"] * len(bands))
+        params = [value for band in enumerate(bands) for value in band]
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT h.product_title, h.dhash FROM design_hashes h WHERE h.product_title IN ({band_sql})",
+                params,
+            ).fetchall()
+        matches = [(row["product_title"], hamming(row["dhash"], design_hash)) for row in rows]
+        return sorted((m for m in matches if m[1] <= max_distance), key=lambda match: match[1])
+
+    def add_asset_refs(self, title: str, paths: dict):
+        """Records that `title` uses the given asset store files, keyed by kind (design, mockup...)."""
+        store = AssetStore()
+        rows = [(store.digest_of(path), title, kind) for kind, path in paths.items() if store.digest_of(path)]
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO asset_refs (digest, product_title, kind) VALUES (?, ?, ?)", rows)
+
+    def live_asset_digests(self):
+        """
+        Content hashes referenced by a row that still exists in published_products,
+        or by the checkpoint of a job that may still be resumed (anything but done
+        or skipped): its design, mockups and renditions must survive until it is.
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT DISTINCT r.digest FROM asset_refs r
+                JOIN published_products p ON p.product_title = r.product_title
+            """).fetchall()
+            jobs = conn.execute("SELECT data FROM jobs WHERE status NOT IN ('done', 'skipped')").fetchall()
+        live = {row[0] for row in rows}
+        store = AssetStore()
+        for job in jobs:
+            for path in checkpoint_paths(json.loads(job[0] or "{}")):
+                digest = store.digest_of(path)
+                if digest:
+                    live.add(digest)
+        return live
+
+    def prune_asset_refs(self):
+        """Deletes references left behind by products that no longer exist. Returns the count."""
+        with self.transaction() as conn:
+            cur = conn.execute("""
+                DELETE FROM asset_refs WHERE product_title NOT IN (SELECT product_title FROM published_products)
+            """)
+            return cur.rowcount
+
+    def get_derivatives(self, source_digest: str) -> dict:
+        """{rendition key: path} of the renditions recorded for a source image."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT rendition, path FROM derivatives WHERE source_digest = ?", (source_digest,)
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def save_derivatives(self, source_digest: str, paths: dict):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO derivatives (source_digest, rendition, path) VALUES (?, ?, ?)",
+                [(source_digest, rendition, path) for rendition, path in paths.items()],
+            )
+
+    def forget_derivatives(self, paths: list) -> int:
+        """Drops derivative rows pointing at the given (deleted) files. Returns the count."""
+        with self.transaction() as conn:
+            return conn.executemany("DELETE FROM derivatives WHERE path = ?", [(path,) for path in paths]).rowcount
+
+    def save_stage_timings(self, rows: list):
+        """rows are (run_id, item, stage, started_at, duration, status, error) tuples."""
+        totals = [(stage, status or "", duration or 0.0) for _, _, stage, _, duration, status, _ in rows]
+        buckets = []
+        for _, _, stage, _, duration, _, _ in rows:
+            index = bisect.bisect_left(DURATION_BUCKETS, duration or 0.0)
+            if index < len(DURATION_BUCKETS):
+                buckets.append((stage, float(DURATION_BUCKETS[index])))
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO stage_timings (run_id, item, stage, started_at, duration, status, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany("""
+                INSERT INTO stage_totals (stage, status, count, duration_sum) VALUES (?, ?, 1, ?)
+                ON CONFLICT (stage, status) DO UPDATE SET
+                    count = count + 1, duration_sum = duration_sum + excluded.duration_sum
+            """, totals)
+            conn.executemany("""
+                INSERT INTO stage_duration_buckets (stage, le, count) VALUES (?, ?, 1)
+                ON CONFLICT (stage, le) DO UPDATE SET count = count + 1
+            """, buckets)
+
+    def get_stage_timings(self, run_id: str):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT item, stage, started_at, duration, status, error FROM stage_timings WHERE run_id = ? ORDER BY id",
+                (run_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stage_timing_stats(self):
+        """
+        Run counts by stage and status, and per-stage duration totals with
+        cumulative counts for each of DURATION_BUCKETS, from the running totals.
+        """
+        with self.pool.connection() as conn:
+            runs = conn.execute(
+                "SELECT stage, status, count FROM stage_totals ORDER BY stage, status"
+            ).fetchall()
+            durations = conn.execute(
+                "SELECT stage, SUM(count), SUM(duration_sum) FROM stage_totals GROUP BY stage ORDER BY stage"
+            ).fetchall()
+            bucket_rows = conn.execute("SELECT stage, le, count FROM stage_duration_buckets").fetchall()
+            published = conn.execute("SELECT COUNT(*) FROM published_products").fetchone()[0]
+        counts = {}
+        for stage, le, count in bucket_rows:
+            counts.setdefault(stage, {})[le] = count
+        stats = []
+        for stage, count, total in durations:
+            cumulative, running = [], 0
+            for le in DURATION_BUCKETS:
+                running += counts.get(stage, {}).get(float(le), 0)
+                cumulative.append(running)
+            stats.append({"stage": stage, "count": count, "sum": total or 0.0, "buckets": cumulative})
+        return {"runs": [dict(row) for row in runs], "durations": stats, "published": published}
+
+    def create_job(self, worker: str, data: Optional[dict] = None) -> int:
+        """Creates a job already leased to `worker` and returns its id."""
+        with self.transaction() as conn:
+            cur = conn.execute("""
+                INSERT INTO jobs (status, data, attempts, lease_owner, lease_expires)
+                VALUES ('running', ?, 1, ?, ?)
+            """, (json.dumps(data or {}), worker, time.time() + JOB_LEASE_SECONDS))
+            return cur.lastrowid
+
+    def claim_jobs(self, worker: str, limit: int = 10, lease_seconds: int = JOB_LEASE_SECONDS):
+        """
+        Leases up to `limit` resumable jobs to `worker`: pending or failed jobs
+        under the attempt limit, plus running jobs whose lease has expired
+        (their worker died). The claim is a single UPDATE, so concurrent
+        workers never receive the same job.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            rows = conn.execute("""
+                UPDATE jobs
+                SET status = 'running', lease_owner = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE (status IN ('pending', 'failed') OR (status = 'running' AND lease_expires < ?))
+                      AND attempts < ?
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING id, stage, data, attempts
+            """, (worker, now + lease_seconds, now, JOB_MAX_ATTEMPTS, limit)).fetchall()
+        return [
+            {"id": row["id"], "stage": row["stage"], "data": json.loads(row["data"]), "attempts": row["attempts"]}
+            for row in sorted(rows, key=lambda row: row["id"])
+        ]
+
+    def checkpoint_job(self, job_id: int, stage: str, data: dict, worker: str, lease_seconds: int = JOB_LEASE_SECONDS):
+        """Stores a completed stage's outputs and renews the lease."""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE jobs SET stage = ?, data = ?, lease_expires = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ?
+            """, (stage, json.dumps(data), time.time() + lease_seconds, job_id, worker))
+
+    def finish_job(self, job_id: int, status: str, worker: str, stage: Optional[str] = None,
+                   data: Optional[dict] = None, error: Optional[str] = None):
+        """Ends the lease with status done, failed or skipped. Failed jobs keep their checkpoints for resume."""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = ?, stage = COALESCE(?, stage), data = COALESCE(?, data), error = ?,
+                    lease_owner = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ?
+            """, (status, stage, json.dumps(data) if data is not None else None, error, job_id, worker))
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50):
+        sql = "SELECT id, status, stage, error, attempts, lease_owner, created_at, updated_at FROM jobs"
+        params = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self.pool.connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def job_counts(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def _row_to_record(self, row):
+        mockup_url = row["mockup_url"]
+        store = AssetStore()
+        if store.contains(mockup_url):
+            mockup_url = f"http://localhost:3000/assets/{store.relative_path(mockup_url)}"
+        elif mockup_url and os.path.isabs(mockup_url):
+            filename = os.path.basename(mockup_url)
+            mockup_url = f"http://localhost:3000/output/{filename}"
+        return {
+            "product_title": row["product_title"],
+            "fake_product_id": row["fake_product_id"],
+            "mockup_url": mockup_url,
+            "caption": row["caption"],
+            "tags": json.loads(row["tags"] or "[]"),
+            "published_at": row["published_at"],
+            "mockup_path": row["mockup_url"],
+        }
+
+    def upsert_shopify_products(self, products: list, synced_at: Optional[float] = None):
+        """Writes Shopify product objects (id, title, handle, status, updated_at) to the mirror."""
+        synced_at = synced_at or time.time()
+        rows = [
+            (p["id"], p.get("title") or "", p.get("handle"), p.get("status"), p.get("updated_at"), synced_at)
+            for p in products
+        ]
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO shopify_products (id, title, handle, status, updated_at, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    title = excluded.title,
+                    handle = COALESCE(excluded.handle, handle),
+                    status = COALESCE(excluded.status, status),
+                    updated_at = COALESCE(excluded.updated_at, updated_at),
+                    synced_at = excluded.synced_at
+            """, rows)
+
+    def prune_shopify_products(self, synced_before: float) -> int:
+        """Drops mirror rows a full sync did not see (products deleted from the store)."""
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM shopify_products WHERE synced_at < ?", (synced_before,)).rowcount
+
+    def find_shopify_product(self, title: str) -> Optional[int]:
+        """The id of a mirrored store product with this title (case-insensitive), or None."""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT id FROM shopify_products WHERE title = ? COLLATE NOCASE LIMIT 1", (title,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def shopify_product_count(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM shopify_products").fetchone()[0]
+
+    def get_sync_state(self, name: str) -> Optional[str]:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_sync_state(self, name: str, value: Optional[str]):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (name, value, updated_at) VALUES (?, ?, ?)",
+                (name, value, time.time()),
+            )
+
+    def records_version(self):
+        """
+        (change counter, latest published_at, row count). The counter goes up on
+        every insert, update or delete, even several within the same second, so
+        it can validate cached listing pages.
+        """
+        with self.pool.connection() as conn:
+            version = conn.execute("SELECT version FROM published_version WHERE id = 1").fetchone()[0]
+            latest, count = conn.execute("SELECT MAX(published_at), COUNT(*) FROM published_products").fetchone()
+        return version, latest, count
+
+    def get_records_page(self, limit: int = 50, cursor: Optional[str] = None):
+        """
+        Returns (records, next_cursor), newest first. Pages are keyset-paginated on
+        (published_at, product_title), so deep pages cost the same as the first.
+        next_cursor is None on the last page.
+        """
+        sql = "SELECT product_title, fake_product_id, mockup_url, caption, tags, published_at FROM published_products"
+        params = []
+        if cursor:
+            published_at, title = decode_cursor(cursor)
+            sql += " WHERE (published_at, product_title) < (?, ?)"
+            params += [published_at, title]
+        sql += " ORDER BY published_at DESC, product_title DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["published_at"], rows[-1]["product_title"])
+        return [self._row_to_record(row) for row in rows], next_cursor
+
+    def search(self, query: str = "", tag: Optional[str] = None, limit: int = 20, offset: int = 0,
+               facet_limit: int = 20):
+        """
+        Full-text search over titles, captions and tags, ranked by BM25 with
+        SEARCH_WEIGHTS. Every word must match (stemmed, so "cats" finds "Cat");
+        the last word also matches as a prefix, for search-as-you-type. `tag`
+        keeps only products with that exact tag. Without query words the
+        matches are the newest products. Returns {"total", "results", "facets"},
+        where facets are [{"tag", "count"}] over all matches, most common first.
+        """
+        words = re.findall(r"\w+", query.lower())
+        terms = [f'"{word}"' for word in words]
+        if terms:
+            terms[-1] = f'({terms[-1]} OR {terms[-1]}*)'
+            source = "products_fts JOIN published_products p ON p.rowid = products_fts.rowid"
+            where, params = ["products_fts MATCH ?"], [" AND ".join(terms)]
+            score = f"bm25(products_fts, {', '.join(str(w) for w in SEARCH_WEIGHTS)})"
+            order = "score"
+        else:
+            source = "published_products p"
+            where, params = [], []
+            score = "NULL"
+            order = "p.published_at DESC, p.product_title DESC"
+        if tag:
+            where.append("EXISTS (SELECT 1 FROM json_each(p.tags) WHERE value = ?)")
+            params.append(tag)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+
+        with self.pool.connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM {source}{where_sql}", params).fetchone()[0]
+            rows = conn.execute(f"""
+                SELECT p.product_title, p.fake_product_id, p.mockup_url, p.caption, p.tags, p.published_at,
+                       {score} AS score
+                FROM {source}{where_sql}
+                ORDER BY {order} LIMIT ? OFFSET ?
+            """, params + [limit, offset]).fetchall()
+            facets = conn.execute(f"""
+                SELECT t.value AS tag, COUNT(*) AS count
+                FROM {source} JOIN json_each(p.tags) t{where_sql}
+                GROUP BY t.value ORDER BY count DESC, tag LIMIT ?
+            """, params + [facet_limit]).fetchall()
+
+        results = []
+        for row in rows:
+            record = self._row_to_record(row)
+            # bm25() is lower for better matches; flip it so higher is better
+            record["score"] = -row["score"] if row["score"] is not None else None
+            results.append(record)
+        return {"total": total, "results": results, "facets": [dict(row) for row in facets]}
+
+    def iter_records(self, page_size: int = 500):
+        """Yields every record, newest first, one page at a time."""
+        cursor = None
+        while True:
+            records, cursor = self.get_records_page(page_size, cursor)
+            yield from records
+            if cursor is None:
+                break
+
+    def get_all_records(self):
+        return list(self.iter_records())
@@ -0,0 +1,403 @@
+"""
+Keeps the generator, mockup and publisher services running as long-lived
+daemons and runs pipeline jobs in-process, so the BLIP model, the caption
+cache and the services' connection pools stay warm between runs.
+
+    python supervisor.py serve                 # start services + job server
+    python supervisor.py submit --count 5      # run a batch on the warm supervisor
+    python supervisor.py status
+
+Jobs are newline-delimited JSON over a local TCP socket (127.0.0.1 only).
+Every request carries a token that `serve` writes to SUPERVISOR_TOKEN_FILE
+with 0600 permissions, so only the user running the supervisor can submit.
+"""
+import argparse
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import secrets
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(orchestrator_dir)
+
+sys.path.append(root_dir)
+
+SERVICES = {
+    "generator": {
+        "cmd": [sys.executable, "-m", "uvicorn", "main:app", "--host", "localhost", "--port", "8001"],
+        "cwd": os.path.join(root_dir, "generator"),
+        "url": "http://localhost:8001/",
+    },
+    "mockup": {
+        "cmd": ["node", "server.js"],
+        "cwd": os.path.join(root_dir, "mockup"),
+        "url": "http://localhost:3000/",
+    },
+    "publisher": {
+        "cmd": ["php", "-S", "localhost:8000"],
+        "cwd": os.path.join(root_dir, "publisher"),
+        "url": "http://localhost:8000/api.php",
+    },
+}
+
+SUPERVISOR_HOST = "127.0.0.1"
+SUPERVISOR_PORT = int(os.getenv("SUPERVISOR_PORT", "8765"))
+SUPERVISOR_TOKEN_FILE = os.getenv("SUPERVISOR_TOKEN_FILE", os.path.join(orchestrator_dir, ".supervisor-token"))
+LOG_DIR = os.getenv("SUPERVISOR_LOG_DIR", os.path.join(orchestrator_dir, "logs"))
+LOG_MAX_BYTES = int(os.getenv("SUPERVISOR_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUPS = 3
+
+READY_TIMEOUT = 30.0
+PROBE_DELAY_MIN = 0.05
+PROBE_DELAY_MAX = 1.0
+RESTART_DELAY_MAX = 60.0
+# A child that stays up this long has its crash backoff reset
+STABLE_UPTIME = 30.0
+
+
+def service_logger(name):
+    logger = logging.getLogger(f"supervisor.{name}")
+    if not logger.handlers:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(LOG_DIR, f"{name}.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class ManagedService:
+    """
+    One child process. Its stdout and stderr are merged and drained by a
+    background thread into a rotating log file, so the child can never block
+    on a full pipe no matter how much it writes.
+    """
+
+    def __init__(self, name, cmd, cwd, url):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.url = url
+        self.proc = None
+        self.started_at = None
+        self.crashes = 0
+        self.restarts = 0
+        self.next_start = 0.0
+        self.logger = service_logger(name)
+        # wait_ready does its own backoff, and probes are expected to fail while the service starts
+        # Imported here so clients that only check supervisor_running() skip requests
+        from common.transport import get_client
+        self.probe_client = get_client(f"{name}-probe", timeout=(0.5, 2), retries=0, circuit_breaker=False)
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            self.cmd, cwd=self.cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+        )
+        self.started_at = time.monotonic()
+        self.logger.info(f"--- started pid {self.proc.pid}: {' '.join(self.cmd)}")
+        threading.Thread(target=self._drain, args=(self.proc,), name=f"{self.name}-log", daemon=True).start()
+
+    def _drain(self, proc):
+        for line in iter(proc.stdout.readline, b""):
+            self.logger.info(line.decode("utf-8", "replace").rstrip())
+        proc.stdout.close()
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def probe(self):
+        try:
+            return self.probe_client.get(self.url).status_code == 200
+        except OSError:
+            return False
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        """Probes with short, doubling delays until the service answers, exits or times out."""
+        deadline = time.monotonic() + timeout
+        delay = PROBE_DELAY_MIN
+        while time.monotonic() < deadline:
+            if self.probe():
+                return True
+            if not self.running():
+                return False
+            time.sleep(delay)
+            delay = min(PROBE_DELAY_MAX, delay * 2)
+        return False
+
+    def check(self):
+        """Restarts the child if it has exited, with exponential backoff between crash restarts."""
+        if self.running():
+            if self.crashes and time.monotonic() - self.started_at > STABLE_UPTIME:
+                self.crashes = 0
+            return
+        now = time.monotonic()
+        if self.next_start == 0.0:
+            code = self.proc.returncode if self.proc else None
+            self.crashes += 1
+            delay = min(RESTART_DELAY_MAX, 2 ** (self.crashes - 1))
+            self.next_start = now + delay
+            print(f"[supervisor] {self.name} exited with code {code}; restarting in {delay:.0f}s")
+            self.logger.info(f"--- exited with code {code}")
+        if now >= self.next_start:
+            self.next_start = 0.0
+            self.restarts += 1
+            self.start()
+
+    def stop(self, timeout=5):
+        if not self.running():
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.logger.info("--- stopped")
+
+    def status(self):
+        return {
+            "running": self.running(),
+            "pid": self.proc.pid if self.proc else None,
+            "uptime": round(time.monotonic() - self.started_at, 1) if self.running() else 0,
+            "restarts": self.restarts,
+            "log": os.path.join(LOG_DIR, f"{self.name}.log"),
+        }
+
+
+def start_services(services=SERVICES):
+    managed = {name: ManagedService(name, **svc) for name, svc in services.items()}
+    for service in managed.values():
+        print(f"Starting {service.name} server...")
+        service.start()
+    return managed
+
+
+def wait_all_ready(managed, timeout=READY_TIMEOUT):
+    """Probes every service at once; returns the names of those that did not come up."""
+    with ThreadPoolExecutor(max_workers=len(managed)) as pool:
+        ready = dict(zip(managed, pool.map(lambda service: service.wait_ready(timeout), managed.values())))
+    for name, ok in ready.items():
+        print(f"Service {name} at {managed[name].url} is {'up' if ok else 'NOT ready'}.")
+    return [name for name, ok in ready.items() if not ok]
+
+
+def stop_services(managed):
+    with ThreadPoolExecutor(max_workers=max(1, len(managed))) as pool:
+        list(pool.map(lambda service: service.stop(), managed.values()))
+
+
+# Reply to requests without the right token
+UNAUTHORIZED = "invalid or missing token"
+
+
+class SupervisorAuthError(Exception):
+    """The supervisor's token could not be read, or the process on the port rejected it."""
+
+
+def write_token(path=SUPERVISOR_TOKEN_FILE):
+    """Writes a fresh random token readable only by the current user and returns it."""
+    token = secrets.token_hex(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        # The mode above only applies to newly created files
+        os.chmod(path, 0o600)
+        f.write(token)
+    return token
+
+
+def read_token(path=SUPERVISOR_TOKEN_FILE):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError as e:
+        raise SupervisorAuthError(
+            f"Could not read the supervisor token {path} ({e.strerror}); "
+            "is the supervisor running as this user with the same SUPERVISOR_TOKEN_FILE?"
+        )
+
+
+def summarize(result):
+    if result is None:
+        return {"ok": 0, "failed": 0, "skipped": 0}
+    return {status: result.count(status) for status in ("ok", "failed", "skipped")}
+
+
+class Supervisor:
+    def __init__(self, services=SERVICES, warm_model=True):
+        self.services = services
+        self.warm_model = warm_model
+        self.managed = {}
+        self.job_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.server = None
+        self.token = None
+
+    def run_job(self, request):
+        # Imported here so `submit` and `status` clients stay light
+        import run
+
+        command = request.get("cmd", "run")
+        with self.job_lock:
+            if command == "resume":
+                result = run.resume(limit=request.get("limit", 50), concurrency=request.get("concurrency"))
+                return {"status": "ok", "run_id": getattr(result, "run_id", None), **summarize(result)}
+
+            count = int(request.get("count", 1))
+            if count > 1:
+                result = run.run_batch(count, request.get("concurrency"), request.get("stream", True))
+                return {"status": "ok", "run_id": result.run_id, **summarize(result)}
+
+            run_id = run.main()
+            statuses = {row["status"] for row in run.get_db().get_stage_timings(run_id)}
+            outcome = "ok" if statuses == {"ok"} else "skipped" if "skipped" in statuses else "failed"
+            return {"status": "ok", "run_id": run_id, **{s: int(s == outcome) for s in ("ok", "failed", "skipped")}}
+
+    def handle(self, request):
+        if not (self.token and hmac.compare_digest(str(request.get("token", "")), self.token)):
+            return {"status": "error", "message": UNAUTHORIZED}
+        command = request.get("cmd", "run")
+        if command == "status":
+            return {
+                "status": "ok",
+                "busy": self.job_lock.locked(),
+                "services": {name: service.status() for name, service in self.managed.items()},
+            }
+        if command == "shutdown":
+            self.stopping.set()
+            return {"status": "ok"}
+        if command in ("run", "resume"):
+            missing = wait_all_ready(self.managed, timeout=10)
+            if missing:
+                return {"status": "error", "message": f"services not ready: {', '.join(missing)}"}
+            return self.run_job(request)
+        return {"status": "error", "message": f"unknown command {command!r}"}
+
+    def serve(self, host=SUPERVISOR_HOST, port=SUPERVISOR_PORT):
+        # run.py opens state.db relative to the working directory
+        os.chdir(orchestrator_dir)
+        supervisor = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        response = supervisor.handle(json.loads(line))
+                    except Exception as e:
+                        response = {"status": "error", "message": str(e)}
+                    self.wfile.write((json.dumps(response) + "\n").encode())
+                    self.wfile.flush()
+
+        self.token = write_token()
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+        self.managed = start_services(self.services)
+        if self.warm_model:
+            threading.Thread(target=self._warm_model, daemon=True).start()
+        wait_all_ready(self.managed)
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Supervisor listening on {host}:{port}; service logs in {LOG_DIR}")
+        try:
+            while not self.stopping.wait(1.0):
+                for service in self.managed.values():
+                    service.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("Stopping supervisor...")
+            self.server.shutdown()
+            self.server.server_close()
+            stop_services(self.managed)
+
+    def _warm_model(self):
+        try:
+            from captioning import load_model
+            load_model()
+            print("[supervisor] Caption model loaded.")
+        except Exception as e:
+            print(f"[supervisor] Could not preload caption model: {e}")
+
+
+def submit(request, host=SUPERVISOR_HOST, port=SUPERVISOR_PORT, timeout=None):
+    """
+    Sends one request to a running supervisor and returns its response. Raises
+    SupervisorAuthError if there is no token to send or the listener rejects it
+    (e.g. a supervisor started by another user or with another token file).
+    """
+    request = dict(request, token=read_token())
+    with socket.create_connection((host, port), timeout=5) as conn:
+        conn.settimeout(timeout)
+        conn.sendall((json.dumps(request) + "\n").encode())
+        with conn.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("supervisor closed the connection without a response")
+    response = json.loads(line)
+    if response.get("status") == "error" and response.get("message") == UNAUTHORIZED:
+        raise SupervisorAuthError(f"The process on port {port} rejected our supervisor token.")
+    return response
+
+
+def supervisor_running(host=SUPERVISOR_HOST, port=SUPERVISOR_PORT):
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Supervise the pipeline services and run jobs on warm processes.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="start the services and the job server")
+    serve.add_argument("--no-warm", action="store_true", help="do not preload the caption model")
+    run_parser = sub.add_parser("submit", help="run the pipeline on a running supervisor")
+    run_parser.add_argument("--count", type=int, default=1)
+    run_parser.add_argument("--concurrency", type=int, default=None)
+    run_parser.add_argument("--resume", action="store_true")
+    run_parser.add_argument("--limit", type=int, default=50)
+    sub.add_parser("status", help="show service status")
+    sub.add_parser("shutdown", help="stop a running supervisor and its services")
+    for p in sub.choices.values():
+        p.add_argument("--port", type=int, default=SUPERVISOR_PORT)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        Supervisor(warm_model=not args.no_warm).serve(port=args.port)
+        return 0
+
+    if args.command == "submit":
+        request = {"cmd": "resume", "limit": args.limit} if args.resume else {"cmd": "run", "count": args.count}
+        request["concurrency"] = args.concurrency
+    else:
+        request = {"cmd": args.command}
+    try:
+        response = submit(request, port=args.port)
+    except SupervisorAuthError as e:
+        print(e)
+        return 1
+    except OSError as e:
+        print(f"Could not reach the supervisor on port {args.port}: {e}")
+        return 1
+    print(json.dumps(response, indent=2))
+    return 0 if response.get("status") == "ok" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
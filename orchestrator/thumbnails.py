@@ -0,0 +1,92 @@
+import os
+import re
+import sys
+import tempfile
+
+from PIL import Image
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.asset_store import AssetStore
+
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnails"))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "400"))
+THUMBNAIL_QUALITY = 80
+SOURCE_EXTENSIONS = (".png", ".jpg", ".webp")
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def source_path(digest, store=None):
+    """The asset store file for `digest`, or None."""
+    if not DIGEST_RE.match(digest):
+        return None
+    store = store or AssetStore()
+    for ext in SOURCE_EXTENSIONS:
+        path = store.path_for(digest, ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def thumbnail_path(digest, width=THUMBNAIL_WIDTH):
+    return os.path.join(THUMBNAIL_DIR, digest[:2], f"{digest}-{width}.jpg")
+
+
+def fit(image, width, height):
+    """`image` scaled down to fit in width x height, keeping its aspect ratio; never enlarged."""
+    scale = min(width / image.width, height / image.height)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+
+def flatten(image, background=(255, 255, 255)):
+    """An RGB version of `image` with any transparency composited onto `background`."""
+    if image.mode == "RGB":
+        return image
+    image = image.convert("RGBA")
+    flat = Image.new("RGB", image.size, background)
+    flat.paste(image, mask=image.getchannel("A"))
+    return flat
+
+
+def make_thumbnail(image, width=THUMBNAIL_WIDTH):
+    return flatten(fit(image, width, width * 4))
+
+
+def save_thumbnail(thumb, digest, width=THUMBNAIL_WIDTH):
+    """Writes `thumb` as the cached thumbnail of `digest` and returns its path."""
+    path = thumbnail_path(digest, width)
+    # Written to a temp file and renamed, so concurrent requests never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            thumb.save(f, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def get_thumbnail(digest, width=THUMBNAIL_WIDTH, store=None):
+    """
+    Returns the path of a `width`-pixel-wide JPEG of the stored image `digest`,
+    rendering it on first request. Sources are content-addressed, so a cached
+    thumbnail never goes stale. Returns None when the source does not exist.
+    The derivatives stage renders thumbnails of new mockups ahead of time.
+    """
+    path = thumbnail_path(digest, width)
+    if os.path.exists(path):
+        return path
+    source = source_path(digest, store)
+    if source is None:
+        return None
+
+    with Image.open(source) as image:
+        image.draft("RGB", (width, width * 4))
+        # Small sources come back as the opened image itself, so save before it closes
+        return save_thumbnail(make_thumbnail(image, width), digest, width)
@@ -1,5 +1,6 @@
 <?php
 header('Content-Type: application/json');
+require __DIR__ . '/db.php';
 
 if ($_SERVER['REQUEST_METHOD'] === 'GET') {
     http_response_code(200);
@@ -10,59 +11,40 @@ if ($_SERVER['REQUEST_METHOD'] === 'GET') {
 $input = file_get_contents("php://input");
 $data = json_decode($input, true);
 
+// A JSON array of products is a bulk publish; results come back in the same order
+$bulk = is_array($data) && $data !== [] && array_keys($data) === range(0, count($data) - 1);
+
 // Validate input (title & price are required)
-if (!$data || !isset($data['title']) || !isset($data['price'])) {
+if (!$bulk && !valid_product($data)) {
     http_response_code(400);
     echo json_encode(['error' => 'Invalid product data']);
     exit;
 }
 
-$logFile = __DIR__ . '/published.log';
-$existingId = null;
+$db = publisher_db();
+$products = $bulk ? $data : [$data];
+$results = [];
+$logEntries = [];
 
-// Check for duplicate by title in log
-if (file_exists($logFile)) {
-    $lines = file($logFile, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES);
-    foreach ($lines as $line) {
-        if (strpos($line, $data['title']) !== false) {
-            // Extract fake_product_id from JSON in the log line
-            $parts = explode(" | ", $line);
-            if (isset($parts[1])) {
-                $jsonData = json_decode($parts[1], true);
-                if ($jsonData && isset($jsonData['fake_product_id'])) {
-                    $existingId = $jsonData['fake_product_id'];
-                } else {
-                    // If fake_product_id not stored, fallback to new ID creation
-                    $existingId = 'FP-EXISTING';
-                }
-            }
-            break;
-        }
+// One transaction for the whole request, so a bulk publish costs a single commit
+$db->beginTransaction();
+try {
+    foreach ($products as $product) {
+        $results[] = publish_product($db, $product, $logEntries);
     }
-}
-
-if ($existingId) {
-    // Return existing ID for duplicate
-    echo json_encode([
-        'status' => 'duplicate',
-        'fake_product_id' => $existingId,
-        'message' => 'Product already published'
-    ]);
+    $db->commit();
+} catch (Exception $e) {
+    $db->rollBack();
+    http_response_code(500);
+    echo json_encode(['error' => 'Could not store product: ' . $e->getMessage()]);
     exit;
 }
 
-// Create fake product ID
-$fakeId = 'FP-' . rand(1000, 9999);
-
-// Add fake_product_id to data for logging
-$data['fake_product_id'] = $fakeId;
-
-// Append to log
-$logEntry = date('Y-m-d H:i:s') . " | " . json_encode($data) . PHP_EOL;
-file_put_contents($logFile, $logEntry, FILE_APPEND);
+append_log($logEntries);
 
 // Return response
-echo json_encode([
-    'status' => 'success',
-    'fake_product_id' => $fakeId
-]);
+if ($bulk) {
+    echo json_encode(['status' => 'success', 'results' => $results]);
+} else {
+    echo json_encode($results[0]);
+}
@@ -0,0 +1,102 @@
+<?php
+// Shared storage for api.php and list.php: an SQLite table with a unique
+// title index for lookups, plus published.log kept as an append-only audit trail.
+
+define('PUBLISHER_LOG', __DIR__ . '/published.log');
+define('PUBLISHER_DB', getenv('PUBLISHER_DB') ?: __DIR__ . '/published.db');
+
+function publisher_db()
+{
+    static $db = null;
+    if ($db !== null) {
+        return $db;
+    }
+
+    $db = new PDO('sqlite:' . PUBLISHER_DB);
+    $db->setAttribute(PDO::ATTR_ERRMODE, PDO::ERRMODE_EXCEPTION);
+    $db->setAttribute(PDO::ATTR_DEFAULT_FETCH_MODE, PDO::FETCH_ASSOC);
+    $db->exec('PRAGMA journal_mode=WAL');
+    $db->exec('PRAGMA synchronous=NORMAL');
+    $db->exec('PRAGMA busy_timeout=5000');
+    $db->exec('CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        fake_product_id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        published_at TEXT NOT NULL
+    )');
+    $db->exec('CREATE UNIQUE INDEX IF NOT EXISTS idx_products_title ON products (title)');
+
+    // Products published before the database existed are imported from the log once
+    if ($db->query('SELECT COUNT(*) FROM products')->fetchColumn() == 0 && file_exists(PUBLISHER_LOG)) {
+        import_log($db);
+    }
+    return $db;
+}
+
+function import_log($db)
+{
+    $insert = $db->prepare('INSERT OR IGNORE INTO products (title, fake_product_id, data, published_at)
+        VALUES (?, ?, ?, ?)');
+    $handle = fopen(PUBLISHER_LOG, 'r');
+    $db->beginTransaction();
+    while (($line = fgets($handle)) !== false) {
+        $parts = explode(' | ', rtrim($line, "\r\n"), 2);
+        $entry = isset($parts[1]) ? json_decode($parts[1], true) : null;
+        if (!$entry || !isset($entry['title'])) {
+            continue;
+        }
+        $insert->execute([
+            $entry['title'],
+            $entry['fake_product_id'] ?? 'FP-EXISTING',
+            $parts[1],
+            $parts[0],
+        ]);
+    }
+    $db->commit();
+    fclose($handle);
+}
+
+function valid_product($data)
+{
+    return is_array($data) && isset($data['title']) && is_string($data['title']) && isset($data['price']);
+}
+
+// Stores one product, queues its audit log line and returns the API response.
+// The unique index decides duplicates, so concurrent publishers of one title get one winner.
+function publish_product($db, $data, &$logEntries)
+{
+    if (!valid_product($data)) {
+        return ['status' => 'error', 'error' => 'Invalid product data'];
+    }
+
+    $fakeId = 'FP-' . rand(1000, 9999);
+    $data['fake_product_id'] = $fakeId;
+    $json = json_encode($data);
+    $publishedAt = date('Y-m-d H:i:s');
+
+    $insert = $db->prepare('INSERT INTO products (title, fake_product_id, data, published_at)
+        VALUES (?, ?, ?, ?) ON CONFLICT (title) DO NOTHING');
+    $insert->execute([$data['title'], $fakeId, $json, $publishedAt]);
+
+    if ($insert->rowCount() === 0) {
+        $existing = $db->prepare('SELECT fake_product_id FROM products WHERE title = ?');
+        $existing->execute([$data['title']]);
+        return [
+            'status' => 'duplicate',
+            'fake_product_id' => $existing->fetchColumn(),
+            'message' => 'Product already published'
+        ];
+    }
+
+    $logEntries[] = $publishedAt . ' | ' . $json;
+    return ['status' => 'success', 'fake_product_id' => $fakeId];
+}
+
+// LOCK_EX takes an flock for the write, so lines from concurrent requests never interleave
+function append_log($entries)
+{
+    if ($entries) {
+        file_put_contents(PUBLISHER_LOG, implode(PHP_EOL, $entries) . PHP_EOL, FILE_APPEND | LOCK_EX);
+    }
+}
@@ -1,12 +1,37 @@
 <?php
+require __DIR__ . '/db.php';
 
-$logFile = __DIR__ . '/published.log';
+// Newest first, keyset-paginated on id: ?limit=50&before=<id of the last row shown>
+$limit = max(1, min(200, (int)($_GET['limit'] ?? 50)));
+$before = isset($_GET['before']) ? (int)$_GET['before'] : null;
 
-if (!file_exists($logFile)) {
+$db = publisher_db();
+$sql = 'SELECT id, title, fake_product_id, data, published_at FROM products';
+if ($before) {
+    $sql .= ' WHERE id < :before';
+}
+$query = $db->prepare($sql . ' ORDER BY id DESC LIMIT :limit');
+if ($before) {
+    $query->bindValue(':before', $before, PDO::PARAM_INT);
+}
+$query->bindValue(':limit', $limit + 1, PDO::PARAM_INT);
+$query->execute();
+$rows = $query->fetchAll();
+$hasMore = count($rows) > $limit;
+$rows = array_slice($rows, 0, $limit);
+
+if (!$rows && !$before) {
     echo "<h3>No products published yet.</h3>";
     exit;
 }
 
 echo "<h2>Recently Published Products</h2><pre>";
-echo htmlspecialchars(file_get_contents($logFile));
+foreach ($rows as $row) {
+    echo htmlspecialchars($row['published_at'] . ' | ' . $row['data']) . "\n";
+}
 echo "</pre>";
+
+if ($hasMore) {
+    $next = http_build_query(['limit' => $limit, 'before' => end($rows)['id']]);
+    echo '<a href="?' . htmlspecialchars($next) . '">Older products &rarr;</a>';
+}
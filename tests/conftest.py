@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# The orchestrator modules import each other as top-level modules
+sys.path.insert(0, os.path.join(ROOT, "orchestrator"))
+# The offline API stand-ins used by the benchmark
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, ROOT)
+
+from state import StateDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    return StateDB(str(tmp_path / "state.db"))
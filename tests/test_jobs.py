@@ -0,0 +1,56 @@
+import state
+
+
+def failed_job(db, worker="A", data=None):
+    job_id = db.create_job(worker, data)
+    db.finish_job(job_id, "failed", worker, error="mockup: boom")
+    return job_id
+
+
+def test_live_lease_is_not_claimed(db):
+    db.create_job("A")
+    assert db.claim_jobs("B") == []
+
+
+def test_expired_lease_is_reclaimed_with_checkpoints(db):
+    job_id = db.create_job("A")
+    db.checkpoint_job(job_id, "design", {"title": "Cosmic Fox"}, "A", lease_seconds=-1)
+
+    [job] = db.claim_jobs("B")
+    assert (job["id"], job["stage"], job["data"], job["attempts"]) == (job_id, "design", {"title": "Cosmic Fox"}, 2)
+    # B now holds a fresh lease
+    assert db.claim_jobs("C") == []
+
+
+def test_stale_worker_cannot_finish_a_reclaimed_job(db):
+    job_id = failed_job(db)
+    db.claim_jobs("B", lease_seconds=-1)
+    assert [job["id"] for job in db.claim_jobs("C")] == [job_id]
+
+    db.finish_job(job_id, "done", "B")
+    [row] = db.list_jobs()
+    assert (row["status"], row["lease_owner"]) == ("running", "C")
+
+
+def test_failed_jobs_are_claimed_in_order_up_to_limit(db):
+    first, second, third = failed_job(db), failed_job(db), failed_job(db)
+    assert [job["id"] for job in db.claim_jobs("B", limit=2)] == [first, second]
+    assert [job["id"] for job in db.claim_jobs("C", limit=2)] == [third]
+
+
+def test_finished_jobs_are_not_claimed(db):
+    for status in ("done", "skipped"):
+        job_id = db.create_job("A")
+        db.finish_job(job_id, status, "A")
+    assert db.claim_jobs("B") == []
+
+
+def test_jobs_stop_being_claimed_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(state, "JOB_MAX_ATTEMPTS", 3)
+    job_id = failed_job(db)
+    for worker in ("B", "C"):
+        [job] = db.claim_jobs(worker)
+        assert job["id"] == job_id
+        db.finish_job(job_id, "failed", worker, error="again")
+    assert db.claim_jobs("D") == []
+    assert db.list_jobs()[0]["attempts"] == 3
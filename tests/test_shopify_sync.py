@@ -0,0 +1,76 @@
+from functools import partial
+
+import pytest
+
+from shopify_client import ShopifyClient
+from shopify_sync import WATERMARK, sync_catalog
+from stubs import FakeShopify
+
+
+def product(product_id, updated_at):
+    return {"id": product_id, "title": f"Product {product_id}", "status": "active",
+            "updated_at": f"2026-01-01T00:00:{updated_at:02d}+00:00"}
+
+
+@pytest.fixture
+def store():
+    stub = FakeShopify(bucket_size=1000).start()
+    stub.products = [product(n, n) for n in range(1, 6)]
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def client(store):
+    client = ShopifyClient(api_base=store.url, access_token="test")
+    # Small pages, so a five-product store takes several cursor hops
+    client.iter_product_pages = partial(client.iter_product_pages, limit=2)
+    return client
+
+
+def test_full_sync_follows_cursors_and_sets_the_watermark(db, client):
+    result = sync_catalog(db, client, full=True)
+    assert result == {"pages": 3, "products": 5, "pruned": 0, "watermark": "2026-01-01T00:00:05+00:00"}
+    assert db.shopify_product_count() == 5
+    assert db.get_sync_state(WATERMARK) == "2026-01-01T00:00:05+00:00"
+    assert db.find_shopify_product("product 3") == 3
+
+
+def test_incremental_sync_fetches_only_products_since_the_watermark(db, client, store):
+    sync_catalog(db, client, full=True)
+    store.products[1] = dict(product(2, 20), title="Renamed")
+    store.products.append(product(6, 30))
+
+    result = sync_catalog(db, client)
+    # updated_at_min is inclusive, so the product at the old watermark comes back too
+    assert (result["products"], result["watermark"]) == (3, "2026-01-01T00:00:30+00:00")
+    assert db.find_shopify_product("Renamed") == 2
+    assert db.find_shopify_product("Product 2") is None
+    assert db.shopify_product_count() == 6
+
+
+def test_only_full_sync_prunes_deleted_products(db, client, store):
+    sync_catalog(db, client, full=True)
+    del store.products[0]
+
+    assert sync_catalog(db, client)["pruned"] == 0
+    assert db.find_shopify_product("Product 1") == 1
+
+    assert sync_catalog(db, client, full=True)["pruned"] == 1
+    assert db.find_shopify_product("Product 1") is None
+    assert db.shopify_product_count() == 4
+
+
+def test_interrupted_sync_keeps_the_old_watermark(db, client):
+    sync_catalog(db, client, full=True)
+
+    class Failing:
+        def iter_product_pages(self, updated_at_min=None):
+            yield [product(7, 40)]
+            raise ConnectionError("store went away")
+
+    with pytest.raises(ConnectionError):
+        sync_catalog(db, Failing())
+    # The page that arrived is kept, but the next sync starts from the old watermark
+    assert db.find_shopify_product("Product 7") == 7
+    assert db.get_sync_state(WATERMARK) == "2026-01-01T00:00:05+00:00"
@@ -0,0 +1,92 @@
+import pytest
+
+from similarity import DESIGN_MAX_DISTANCE, HASH_BANDS, TITLE_THRESHOLD, BAND_BITS
+
+DISTRACTORS = ["Neon Owl T-Shirt", "Retro Robot T-Shirt", "Lunar Whale Mug", "Sleepy Panda Cap", "Wild Tiger Tee"]
+
+
+def publish(db, title, tags=None, design_hash=None):
+    db.save_record(title, "fake-1", "/tmp/mockup.png", tags=tags, design_hash=design_hash)
+
+
+def matches(db, title, tags=None):
+    return [other for other, _ in db.find_similar_titles(title, tags)]
+
+
+@pytest.fixture
+def catalog(db):
+    for title in DISTRACTORS:
+        publish(db, title)
+    return db
+
+
+def test_default_title_threshold():
+    assert TITLE_THRESHOLD == 0.75
+
+
+def test_synonyms_and_plurals_match(catalog):
+    publish(catalog, "Galactic Cats T-Shirt")
+    assert matches(catalog, "The Galactic Cat Tee") == ["Galactic Cats T-Shirt"]
+
+
+def test_title_overlap_at_threshold_matches(catalog):
+    publish(catalog, "Retro Sunset Wolf T-Shirt")
+    # 3 of 4 tokens shared: exactly 0.75
+    [(other, score)] = catalog.find_similar_titles("Retro Sunset Wolf")
+    assert (other, score) == ("Retro Sunset Wolf T-Shirt", 0.75)
+
+
+def test_title_overlap_below_threshold_does_not_match(catalog):
+    publish(catalog, "Retro Sunset Wolf Howling T-Shirt")
+    # 3 of 5 tokens shared
+    assert matches(catalog, "Retro Sunset Wolf") == []
+    # Only the product type differs: 2 of 4
+    assert matches(catalog, "Neon Owl Mug") == []
+
+
+def test_tags_nudge_the_score_both_ways(catalog):
+    publish(catalog, "Retro Sunset Wolf T-Shirt", tags=["wolf", "sunset"])
+    # 0.8 * 0.75 + 0.2 * 0 = 0.6
+    assert matches(catalog, "Retro Sunset Wolf", tags=["space", "astronaut"]) == []
+    # 0.8 * 0.75 + 0.2 * 1 = 0.8
+    assert matches(catalog, "Retro Sunset Wolf", tags=["Sunset", "Wolf"]) == ["Retro Sunset Wolf T-Shirt"]
+    publish(catalog, "Sunset Wolf Cap", tags=["wolf", "sunset"])
+    # 2 of 3 title tokens is too little even with identical tags: 0.8 * 0.667 + 0.2 = 0.733
+    assert matches(catalog, "Sunset Wolf", tags=["wolf", "sunset"]) == []
+
+
+def test_common_tokens_still_find_matches(catalog):
+    # Many published titles share "tshirt", the prefix filter must still reach the match
+    for n in range(20):
+        publish(catalog, f"Design {n} T-Shirt")
+    publish(catalog, "Mystic Dragon T-Shirt")
+    assert matches(catalog, "Mystic Dragon Tee") == ["Mystic Dragon T-Shirt"]
+    # The query's rarest token ("galaxy") is not in the match, so more than one must be looked up
+    assert matches(catalog, "Mystic Galaxy Dragon Tee") == ["Mystic Dragon T-Shirt"]
+
+
+def flip(value, count):
+    # One bit in each of the first `count` bands, so at most count bands differ
+    for band in range(count):
+        value ^= 1 << (band * BAND_BITS + 3)
+    return value
+
+
+@pytest.mark.parametrize("design_hash", [0x0123456789ABCDEF, 0xF0E1D2C3B4A59687])
+def test_design_distance_threshold(db, design_hash):
+    publish(db, "Original", design_hash=design_hash)
+    assert db.find_similar_designs(design_hash) == [("Original", 0)]
+    assert db.find_similar_designs(flip(design_hash, DESIGN_MAX_DISTANCE)) == [("Original", DESIGN_MAX_DISTANCE)]
+    assert db.find_similar_designs(flip(design_hash, DESIGN_MAX_DISTANCE + 1)) == []
+
+
+def test_designs_are_ordered_by_distance(db):
+    publish(db, "Far", design_hash=flip(0, 5))
+    publish(db, "Near", design_hash=flip(0, 1))
+    publish(db, "Unrelated", design_hash=(1 << 64) - 1)
+    assert db.find_similar_designs(0) == [("Near", 1), ("Far", 5)]
+
+
+def test_design_distance_must_fit_the_band_lookup(db):
+    with pytest.raises(ValueError):
+        db.find_similar_designs(0, max_distance=HASH_BANDS)